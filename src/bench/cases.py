@@ -0,0 +1,317 @@
+"""Benchmark cases.
+
+Each case runs in its own process with HOME pointed at a scratch directory,
+so it starts from an empty ~/.ellm and never touches the user's data. Run
+one with: python -m bench.cases NAME PARAMS_JSON RESULT_PATH
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+from uuid import uuid4
+import gc
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+
+def summarize(times: List[float]) -> Dict[str, float]:
+    return {
+        "runs": len(times),
+        "min": round(min(times), 6),
+        "median": round(statistics.median(times), 6),
+        "mean": round(statistics.mean(times), 6),
+        "max": round(max(times), 6),
+    }
+
+
+def write_session(messages: int, chars: int) -> str:
+    "Write a synthetic conversation journal and return its id"
+    from storage.journal import Journal
+    from utils.constants import HISTORY_PATH
+
+    HISTORY_PATH.mkdir(parents=True, exist_ok=True)
+    session_id = str(uuid4())
+    journal = Journal(HISTORY_PATH / f"{session_id}.jsonl")
+    journal.append(
+        "header",
+        {
+            "title": f"Session {session_id[:8]}",
+            "branched_from": "master",
+            "settings": "DEFAULT",
+            "created_at": "2025-01-01T00:00:00",
+        },
+    )
+    content = ("lorem ipsum " * (chars // 12 + 1))[:chars]
+    for i in range(messages):
+        journal.append(
+            "message",
+            {
+                "role": "assistant" if i % 2 else "user",
+                "content": content,
+                "timestamp": "2025-01-01T00:00:00",
+                # Stored counts, so loading never needs the tokenizer
+                "tokens": chars // 4,
+            },
+        )
+    return session_id
+
+
+def cold_start(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Wall time of a fresh process running ellm.main.
+
+    "interpreter" is the bare Python startup to subtract, "config" prints a
+    profile and "chat" opens the chat CLI and quits. One untimed run first
+    writes the config and bytecode caches.
+    """
+    main = "import ellm; ellm.main()"
+    variants = {
+        "interpreter": (["-c", "pass"], None),
+        "config": (["-c", main, "config", "DEFAULT"], None),
+        "chat": (["-c", main], b"/quit\n"),
+    }
+    results = {}
+    for name, (args, stdin) in variants.items():
+        command = [sys.executable, *args]
+        subprocess.run(command, input=stdin, capture_output=True, check=True)
+        times = []
+        for _ in range(params["repeat"]):
+            started = time.perf_counter()
+            subprocess.run(command, input=stdin, capture_output=True, check=True)
+            times.append(time.perf_counter() - started)
+        results[name] = summarize(times)
+    return results
+
+
+def load_sessions(params: Dict[str, Any]) -> Dict[str, Any]:
+    """ChatCLI.load_sessions over many synthetic conversations.
+
+    "rebuild" indexes every conversation from scratch, "indexed" is the
+    normal startup path with the index already on disk.
+    """
+    from cli.chatcli import ChatCLI
+    from storage.index import SessionIndex
+    from utils.constants import CONFIG_PATH, INDEX_PATH
+
+    cli = ChatCLI(CONFIG_PATH)
+    for _ in range(params["sessions"]):
+        write_session(params["messages"], params["chars"])
+
+    started = time.perf_counter()
+    cli.load_sessions()
+    rebuild = time.perf_counter() - started
+
+    times = []
+    for _ in range(params["repeat"]):
+        started = time.perf_counter()
+        cli.index = SessionIndex(INDEX_PATH)
+        cli.load_sessions()
+        times.append(time.perf_counter() - started)
+
+    return {
+        "sessions": len(cli.index.ids()),
+        "messages_per_session": params["messages"],
+        "rebuild": round(rebuild, 6),
+        "indexed": summarize(times),
+    }
+
+
+def save_history(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Session.save_history and Session.compact against history length.
+
+    Each call is flushed, so the time covers the write itself and not just
+    handing it to the background writer. save_history appends a metadata
+    record and compacts every JournalStorage.COMPACT_AFTER calls, so its
+    mean includes the amortized compaction.
+    """
+    from models.session import Session
+    from storage.backend import JournalStorage
+    from storage.index import SessionIndex
+    from utils.constants import INDEX_PATH
+
+    index = SessionIndex(INDEX_PATH)
+    results = {}
+    for length in params["lengths"]:
+        session = Session(write_session(length, params["chars"]), index)
+
+        saves = []
+        for _ in range(params["repeat"]):
+            started = time.perf_counter()
+            session.save_history()
+            Session.storage.flush()
+            saves.append(time.perf_counter() - started)
+
+        compactions = []
+        for _ in range(max(1, params["repeat"] // JournalStorage.COMPACT_AFTER)):
+            started = time.perf_counter()
+            session.compact()
+            Session.storage.flush()
+            compactions.append(time.perf_counter() - started)
+
+        results[str(length)] = {
+            "save_history": summarize(saves),
+            "compact": summarize(compactions),
+        }
+    return results
+
+
+def streaming(params: Dict[str, Any]) -> Dict[str, Any]:
+    """End-to-end streaming through ChatCLI.stream_response.
+
+    Tokens per second are measured after the first token. The first request
+    per provider opens the connection and is not timed.
+    """
+    from cli.chatcli import ChatCLI
+    from config.manager import ConfigManager
+    from models.message import Message
+    from providers.manager import ProviderManager
+    from utils.constants import CONFIG_PATH
+
+    profiles = {
+        "openai": {"api_type": "openai", "base_url": params["openai_url"]},
+        "anthropic": {"api_type": "anthropic", "base_url": params["anthropic_url"]},
+    }
+    config_manager = ConfigManager(CONFIG_PATH)
+    for name, profile in profiles.items():
+        config_manager.save_config(
+            {**profile, "api_key": "mock", "model": "mock", "max_tokens": "4096"}, name
+        )
+
+    cli = ChatCLI(CONFIG_PATH)
+    messages = [
+        Message(role="system", content="You are a benchmark.", tokens=1),
+        Message(role="user", content="Go.", tokens=1),
+    ]
+    results = {}
+    for name in profiles:
+        config = cli.config_manager.get_config(name)
+        provider = ProviderManager.get_provider(config)
+        cli.stream_response(provider.send(config, messages))
+
+        ttfts, durations, rates, chars, writes = [], [], [], [], []
+        for _ in range(params["repeat"]):
+            result = cli.stream_response(provider.send(config, messages))
+            if result.error:
+                raise RuntimeError(f"{name}: {result.error}")
+            ttfts.append(result.ttft)
+            durations.append(result.duration)
+            rates.append(params["tokens"] / (result.duration - result.ttft))
+            chars.append(cli.last_renderer.chars_per_second)
+            writes.append(cli.last_renderer.flushes)
+        results[name] = {
+            "tokens": params["tokens"],
+            "ttft": summarize(ttfts),
+            "duration": summarize(durations),
+            "tokens_per_second": summarize(rates),
+            "chars_per_second": summarize(chars),
+            "writes": summarize(writes),
+        }
+    return results
+
+
+@dataclass
+class LegacyMessage:
+    "Message as it was before it was slotted, for the messages case"
+
+    role: str
+    content: str
+    timestamp: str = ""
+    tokens: int = 0
+
+    def __post_init__(self):
+        if not self.timestamp:
+            self.timestamp = datetime.now().isoformat()
+
+
+def messages(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Memory and load time of one long session, per message representation.
+
+    "legacy" is the previous Message dataclass, with a per-instance __dict__
+    and string timestamps and roles, "slotted" the current one. Both are
+    built from freshly parsed journal records. "bytes" includes the content
+    strings, which are the same in both, "overhead" leaves them out. "branch_context" assembles a request in a
+    branch of the session, copying the inherited history as branches used
+    to or reading it through a HistoryView.
+    """
+    from models.context import ContextWindow
+    from models.message import Message
+    from models.session import HistoryView, Session
+
+    session_id = write_session(params["count"], params["chars"])
+    builders = {"legacy": lambda record: LegacyMessage(**record)}
+    builders["slotted"] = Message.from_dict
+
+    results: Dict[str, Any] = {"messages": params["count"]}
+    for name, build in builders.items():
+        times = []
+        for _ in range(params["repeat"]):
+            started = time.perf_counter()
+            loaded = [build(record) for record in Session.storage.load(session_id)[1]]
+            times.append(time.perf_counter() - started)
+            del loaded
+
+        gc.collect()
+        tracemalloc.start()
+        loaded = [build(record) for record in Session.storage.load(session_id)[1]]
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        content = sum(sys.getsizeof(msg.content) for msg in loaded)
+        results[name] = {
+            "bytes": size,
+            "bytes_per_message": round(size / len(loaded), 1),
+            "overhead_per_message": round((size - content) / len(loaded), 1),
+            "load": summarize(times),
+        }
+        del loaded
+    results["saved_bytes_per_message"] = round(
+        results["legacy"]["bytes_per_message"]
+        - results["slotted"]["bytes_per_message"],
+        1,
+    )
+
+    history = [
+        Message.from_dict(record) for record in Session.storage.load(session_id)[1]
+    ]
+    own = [Message(role="user", content="Branched.", tokens=1)]
+    message = Message(role="user", content="Go on.", tokens=1)
+    window = ContextWindow(0)
+    branch_context = {}
+    for name, view in {
+        "copy": lambda: history[: len(history)] + own,
+        "view": lambda: HistoryView(history, len(history), own),
+    }.items():
+        times = []
+        for _ in range(params["repeat"]):
+            started = time.perf_counter()
+            window.build(view(), message, 0)
+            times.append(time.perf_counter() - started)
+        branch_context[name] = summarize(times)
+    results["branch_context"] = branch_context
+    return results
+
+
+CASES: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    "cold_start": cold_start,
+    "load_sessions": load_sessions,
+    "save_history": save_history,
+    "streaming": streaming,
+    "messages": messages,
+}
+
+
+def main():
+    name, params, result_path = sys.argv[1:4]
+    # Keep stdout free of the CLI's output
+    sys.stdout = open(os.devnull, "w")
+    result = CASES[name](json.loads(params))
+    with open(result_path, "w") as f:
+        json.dump(result, f)
+
+
+if __name__ == "__main__":
+    main()
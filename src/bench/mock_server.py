@@ -0,0 +1,251 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator
+import argparse
+import json
+import threading
+import time
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Answers OpenAI chat completions and Anthropic messages requests.
+
+    Responses are a fixed number of one-word tokens, streamed as SSE when the
+    request asks for it. The server's latency and token_rate settings control
+    the delay before the response starts and the pace of the tokens.
+    """
+
+    protocol_version = "HTTP/1.1"
+    server: "MockServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        self.server.requests += 1
+
+        if self.path.endswith("/chat/completions"):
+            api = OpenAIFormat
+        elif self.path.endswith("/messages"):
+            api = AnthropicFormat
+        else:
+            self.send_error(404)
+            return
+
+        time.sleep(self.server.latency)
+        tokens = self.server.tokens
+        model = body.get("model", "mock")
+
+        if not body.get("stream"):
+            data = json.dumps(api.complete(model, self.server.text(), tokens)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for event in api.stream(model, self.server.words(), tokens, body):
+            data = event.encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def sse(data: Dict[str, Any], event: str = "") -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+class OpenAIFormat:
+    @staticmethod
+    def complete(model: str, text: str, tokens: int) -> Dict[str, Any]:
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": 0,
+                "completion_tokens": tokens,
+                "total_tokens": tokens,
+            },
+        }
+
+    @staticmethod
+    def stream(
+        model: str, words: Iterator[str], tokens: int, body: Dict[str, Any]
+    ) -> Iterator[str]:
+        def chunk(delta, finish_reason=None):
+            return {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": 0,
+                "model": model,
+                "choices": [
+                    {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                ],
+            }
+
+        for word in words:
+            yield sse(chunk({"content": word}))
+        yield sse(chunk({}, "stop"))
+        if body.get("stream_options", {}).get("include_usage"):
+            usage = chunk({})
+            usage["choices"] = []
+            usage["usage"] = {
+                "prompt_tokens": 0,
+                "completion_tokens": tokens,
+                "total_tokens": tokens,
+            }
+            yield sse(usage)
+        yield "data: [DONE]\n\n"
+
+
+class AnthropicFormat:
+    @staticmethod
+    def complete(model: str, text: str, tokens: int) -> Dict[str, Any]:
+        return {
+            "id": "msg_mock",
+            "type": "message",
+            "role": "assistant",
+            "model": model,
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": 0, "output_tokens": tokens},
+        }
+
+    @staticmethod
+    def stream(
+        model: str, words: Iterator[str], tokens: int, body: Dict[str, Any]
+    ) -> Iterator[str]:
+        message = AnthropicFormat.complete(model, "", 0)
+        message["content"] = []
+        message["stop_reason"] = None
+        yield sse({"type": "message_start", "message": message}, "message_start")
+        yield sse(
+            {
+                "type": "content_block_start",
+                "index": 0,
+                "content_block": {"type": "text", "text": ""},
+            },
+            "content_block_start",
+        )
+        for word in words:
+            yield sse(
+                {
+                    "type": "content_block_delta",
+                    "index": 0,
+                    "delta": {"type": "text_delta", "text": word},
+                },
+                "content_block_delta",
+            )
+        yield sse({"type": "content_block_stop", "index": 0}, "content_block_stop")
+        yield sse(
+            {
+                "type": "message_delta",
+                "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                "usage": {"output_tokens": tokens},
+            },
+            "message_delta",
+        )
+        yield sse({"type": "message_stop"}, "message_stop")
+
+
+class MockServer(ThreadingHTTPServer):
+    """Local stand-in for the OpenAI and Anthropic APIs.
+
+    tokens: tokens per response
+    token_rate: tokens per second, 0 to send them as fast as possible
+    latency: seconds before the response starts
+    """
+
+    daemon_threads = True
+    # Clients open many connections at once, the default backlog of 5 drops them
+    request_queue_size = 128
+
+    def __init__(
+        self,
+        port: int = 0,
+        tokens: int = 500,
+        token_rate: float = 0,
+        latency: float = 0,
+    ):
+        super().__init__(("127.0.0.1", port), MockHandler)
+        self.tokens = tokens
+        self.token_rate = token_rate
+        self.latency = latency
+        self.requests = 0
+        self._thread = None
+
+    @property
+    def openai_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/v1"
+
+    @property
+    def anthropic_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def words(self) -> Iterator[str]:
+        "Yield the response tokens at the configured rate"
+        started = time.perf_counter()
+        for i in range(self.tokens):
+            if self.token_rate:
+                wait = started + i / self.token_rate - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+            yield f"word{i % 100} "
+
+    def text(self) -> str:
+        return "".join(f"word{i % 100} " for i in range(self.tokens))
+
+    def start(self) -> "MockServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve mock OpenAI and Anthropic streaming APIs"
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--tokens", type=int, default=500)
+    parser.add_argument("--token-rate", type=float, default=0)
+    parser.add_argument("--latency", type=float, default=0)
+    args = parser.parse_args()
+
+    server = MockServer(args.port, args.tokens, args.token_rate, args.latency)
+    print(f"OpenAI base_url:    {server.openai_url}")
+    print(f"Anthropic base_url: {server.anthropic_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
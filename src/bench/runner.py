@@ -0,0 +1,92 @@
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from bench.cases import CASES
+from bench.mock_server import MockServer
+
+
+def run_case(name: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    "Run one case in a child process with its own scratch HOME"
+    with tempfile.TemporaryDirectory(prefix="ellm-bench-") as home:
+        result_path = Path(home) / "result.json"
+        env = {
+            **os.environ,
+            "HOME": home,
+            "PYTHONPATH": os.pathsep.join(p for p in sys.path if p),
+        }
+        process = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "bench.cases",
+                name,
+                json.dumps(params),
+                result_path,
+            ],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        if process.returncode != 0:
+            lines = process.stderr.strip().splitlines()
+            return {"error": lines[-1] if lines else f"exit code {process.returncode}"}
+        with open(result_path) as f:
+            return json.load(f)
+
+
+def run_bench(
+    cases: Optional[List[str]] = None,
+    repeat: int = 5,
+    sessions: int = 10000,
+    tokens: int = 2000,
+    token_rate: float = 0,
+    latency: float = 0,
+) -> Dict[str, Any]:
+    "Run the benchmark cases against a local mock server and return the report"
+    server = MockServer(tokens=tokens, token_rate=token_rate, latency=latency).start()
+    params: Dict[str, Dict[str, Any]] = {
+        "cold_start": {"repeat": repeat},
+        "load_sessions": {
+            "repeat": repeat,
+            "sessions": sessions,
+            "messages": 10,
+            "chars": 400,
+        },
+        "save_history": {
+            "repeat": max(repeat, 64),
+            "lengths": [10, 100, 1000, 10000],
+            "chars": 400,
+        },
+        "messages": {"repeat": repeat, "count": 100000, "chars": 400},
+        "streaming": {
+            "repeat": repeat,
+            "tokens": tokens,
+            "token_rate": token_rate,
+            "latency": latency,
+            "openai_url": server.openai_url,
+            "anthropic_url": server.anthropic_url,
+        },
+    }
+
+    report: Dict[str, Any] = {
+        "started_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {},
+        "results": {},
+    }
+    try:
+        for name in cases or list(CASES):
+            print(f"Running {name}...", file=sys.stderr)
+            report["params"][name] = params[name]
+            report["results"][name] = run_case(name, params[name])
+    finally:
+        server.stop()
+    return report
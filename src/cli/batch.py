@@ -0,0 +1,180 @@
+from typing import Any, Dict, Iterable, Optional, TextIO
+import asyncio
+import json
+from config.manager import ConfigManager
+from models.context import context_window
+from models.message import Message, count_tokens
+from models.session import Session
+from providers.manager import ProviderManager
+from providers.streaming import collect
+from storage.index import SessionIndex
+from storage.search import SearchIndex
+import utils.prompts as prompts
+
+
+class BatchRunner:
+    """Runs prompts non-interactively through a bounded pool of workers.
+
+    Each job is a dict with a "prompt" and optionally an "id", the "settings"
+    profile to use and a "session" to continue. Results are written as JSONL
+    in completion order.
+    """
+
+    def __init__(
+        self,
+        config_manager: ConfigManager,
+        index: SessionIndex,
+        output: TextIO,
+        concurrency: int = 4,
+        default_settings: str = "DEFAULT",
+        search_index: Optional[SearchIndex] = None,
+    ):
+        self.config_manager = config_manager
+        self.index = index
+        self.output = output
+        self.concurrency = concurrency
+        self.default_settings = default_settings
+        self.search_index = search_index
+        self.sessions: Dict[str, Session] = {}
+        # Turns in the same session must not interleave
+        self.session_locks: Dict[str, asyncio.Lock] = {}
+
+    async def run(self, jobs: Iterable[Dict[str, Any]]) -> None:
+        queue: asyncio.Queue = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+
+        async def worker():
+            while not queue.empty():
+                job = queue.get_nowait()
+                try:
+                    record = await self.run_job(job)
+                except Exception as e:
+                    # One bad record must not end the batch
+                    record = {"id": job.get("id"), "error": f"{type(e).__name__}: {e}"}
+                self.write(record)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self.output.write(json.dumps(record) + "\n")
+        self.output.flush()
+
+    def get_session(self, session_id: str) -> Optional[Session]:
+        if session_id not in self.sessions:
+            if session_id not in self.index:
+                return None
+            self.sessions[session_id] = Session.load(
+                session_id, self.index, self.search_index
+            )
+            self.session_locks[session_id] = asyncio.Lock()
+        return self.sessions[session_id]
+
+    async def run_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        record: Dict[str, Any] = {"id": job.get("id")}
+        if "error" in job:
+            record["error"] = job["error"]
+            return record
+
+        prompt = job.get("prompt")
+        session_id = job.get("session")
+        session = None
+        if session_id:
+            session = self.get_session(session_id)
+            if session is None:
+                record["error"] = f"No session found with ID: {session_id}"
+                return record
+            record["session"] = session_id
+
+        settings = job.get("settings") or (
+            session.settings if session else self.default_settings
+        )
+        record["settings"] = settings
+        config = self.config_manager.get_config(settings)
+
+        if not prompt:
+            record["error"] = "Provide a prompt to send"
+        elif config is None:
+            record["error"] = f"Settings do not exist: {settings}"
+        elif config["api_key"] == "NOTSET" or config["model"] == "NOTSET":
+            record["error"] = f"Model and api key are required for settings: {settings}"
+        if "error" in record:
+            return record
+
+        record["model"] = model = str(config["model"])
+        if session:
+            async with self.session_locks[session.id]:
+                await self.send(record, config, settings, model, prompt, session)
+        else:
+            await self.send(record, config, settings, model, prompt, None)
+        return record
+
+    async def send(self, record, config, settings, model, prompt, session) -> None:
+        if session:
+            history = session.history
+            history_tokens = session.get_token_count()
+        else:
+            history = [Message(role="system", content=prompts.chat)]
+            history_tokens = history[0].tokens
+
+        user_message = Message(
+            role="user", content=prompt, tokens=count_tokens(prompt, model)
+        )
+        try:
+            window = context_window(
+                self.config_manager, settings, session.id if session else ""
+            )
+        except ValueError as e:
+            record["error"] = str(e)
+            return
+        context = window.build(history, user_message, history_tokens)
+
+        try:
+            provider = ProviderManager.get_provider(config)
+            # Preparing parses the profile, e.g. max_tokens
+            events = provider.send(config, context.messages)
+        except ValueError as e:
+            record["error"] = str(e)
+            return
+        result = await collect(events, lambda _: None)
+
+        record["queued"] = round(result.queued, 4)
+
+        record["ttft"] = round(result.ttft, 4) if result.ttft is not None else None
+        record["latency"] = round(result.duration, 4)
+        # token counts reported by the provider are preferred over local ones
+        record["prompt_tokens"] = result.usage.get("prompt_tokens", context.tokens)
+        if result.error:
+            record["error"] = str(result.error)
+            return
+
+        record["response"] = result.text
+        record["completion_tokens"] = result.usage.get(
+            "completion_tokens", count_tokens(result.text, model)
+        )
+        if session:
+            session.add_message("user", prompt, model)
+            session.add_message("assistant", result.text, model)
+            session.record_usage(result.usage)
+
+
+def read_jobs(lines: Iterable[str]) -> Iterable[Dict[str, Any]]:
+    "Parse JSONL prompts, turning unreadable lines into error jobs"
+    for line_no, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield {"id": line_no, "error": f"Invalid JSON: {e}"}
+            continue
+        if not isinstance(job, dict):
+            job = {"prompt": job}
+        job.setdefault("id", line_no)
+        if not isinstance(job.get("prompt", ""), str):
+            job["error"] = "prompt must be a string"
+        for field in ("settings", "session"):
+            if not isinstance(job.get(field, ""), str):
+                job["error"] = f"{field} must be a string"
+        yield job
@@ -1,19 +1,87 @@
-from typing import Dict, Optional, List
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, Optional, List, Set
 from rich.console import Console
 from rich.table import Table
+from rich.tree import Tree
 from rich.panel import Panel
+from rich.console import Group
+from rich.text import Text
 from rich import box
 from rich import print
+from rich.markup import escape
 from models.session import Session
-from models.message import Message
-from utils.constants import HISTORY_PATH
+from models.message import Message, count_tokens
+from models.context import AssembledContext, ContextWindow, context_window
+from utils.constants import (
+    INDEX_PATH,
+    CACHE_PATH,
+    METRICS_PATH,
+    SEARCH_PATH,
+)
+from utils.metrics import MetricsLog, RequestMetrics, StageTimer
+from storage.index import SessionIndex, SessionMeta
+from storage.response_cache import ResponseCache
+from storage.search import SearchIndex
+from storage.backend import open_storage
+from storage.writer import SessionWriter
 from config.manager import ConfigManager
 from providers.manager import ProviderManager
+from providers.streaming import StreamEvent, StreamResult, collect, collect_all
+from utils.aio import BackgroundLoop
+from cli.jobs import Job, JobQueue
+from cli.renderer import CompareRenderer, StreamRenderer
+from cli.paging import FLAG, page_footer, paginate, parse_options, positive
 from pathlib import Path
-import copy
+from datetime import date
+import asyncio
+import time
+
+
+def sort_key(value: str) -> str:
+    if value not in LIST_SORT_KEYS:
+        raise ValueError
+    return value
+
+
+def iso_date(value: str) -> str:
+    return date.fromisoformat(value).isoformat()
+
+
+# /list sort orders, all read from the session index
+LIST_SORT_KEYS: Dict[str, Callable[[SessionMeta], Any]] = {
+    "created": lambda meta: meta.created_at,
+    "title": lambda meta: meta.title.lower(),
+    "settings": lambda meta: meta.settings,
+    "messages": lambda meta: meta.messages,
+    "tokens": lambda meta: meta.tokens,
+}
+
+
+@dataclass
+class Turn:
+    "A message on its way to the provider, see ChatCLI.prepare_turn"
+
+    session: Session
+    settings: str
+    model: str
+    message: str
+    context: AssembledContext
+    window: ContextWindow
+    timer: StageTimer
+    events: Optional[AsyncIterator[StreamEvent]] = None
+    # Whether the events replay a cached response
+    cached: bool = False
+    cache_key: Optional[str] = None
+    max_age: int = 0
+    # Render the response as Markdown while it streams
+    markdown: bool = False
 
 
 class ChatCLI:
+    # Rows shown per page by /list and /history
+    LIST_PAGE_SIZE = 20
+    HISTORY_PAGE_SIZE = 10
+
     def __init__(self, config_path: Path):
         super().__init__()
 
@@ -22,11 +90,28 @@ class ChatCLI:
         self.console = Console()
         self.config_manager = ConfigManager(config_path)
 
+        Session.storage = SessionWriter(
+            open_storage(self.config_manager.get_option("DEFAULT", "storage"))
+        )
+        Session.config_manager = self.config_manager
+
+        # Sessions are only constructed (and their history parsed) once opened.
+        # Everything else is served from the metadata index.
+        self.index = SessionIndex(INDEX_PATH)
+        self.search_index = SearchIndex(SEARCH_PATH)
         self.sessions: Dict[str, Session] = {}
         self.current_session: Optional[Session] = None
         self.load_sessions()
 
         self.provider = None
+        # Timing of the most recent stream
+        self.last_result: Optional[StreamResult] = None
+        self.last_renderer: Optional[StreamRenderer] = None
+        self.response_cache = ResponseCache(CACHE_PATH)
+        self.metrics = MetricsLog(METRICS_PATH)
+        self.job_queue = JobQueue()
+        # Sessions whose messages are sent in the background by default
+        self.background: Set[str] = set()
 
         self.commands = {
             "new": self.new,
@@ -36,8 +121,14 @@ class ChatCLI:
             "list": self.list,
             "switch": self.switch,
             "send": self.send,
+            "bg": self.bg,
+            "jobs": self.jobs,
+            "compare": self.compare,
             "history": self.history,
             "tokens": self.tokens,
+            "search": self.search,
+            "cache": self.cache,
+            "stats": self.stats,
             "delete": self.delete,
             "quit": self.quit,
             "help": self.help,
@@ -47,13 +138,28 @@ class ChatCLI:
         self.multiline_buffer: List[str] = []
 
     def load_sessions(self) -> None:
-        if not HISTORY_PATH.exists():
-            HISTORY_PATH.mkdir(exist_ok=True)
-        else:
-            conversations = list(HISTORY_PATH.glob("*.json"))
-            for convo in conversations:
-                convo_id = convo.stem
-                self.sessions[convo_id] = Session(convo_id)
+        # Only the stored ids are needed to keep the index in sync.
+        # Conversations missing from the index (e.g. written by an older
+        # version) are parsed once and indexed.
+        stored = set(Session.storage.ids())
+        for convo_id in set(self.index.ids()) - stored:
+            self.index.remove(convo_id)
+        for convo_id in stored - set(self.index.ids()):
+            self.index.update(Session(convo_id))
+
+    def session_ids(self) -> List[str]:
+        "IDs of all indexed sessions plus any opened sessions not yet saved"
+        ids = self.index.ids()
+        ids.extend(s for s in self.sessions if s not in self.index)
+        return ids
+
+    def open_session(self, session_id: str) -> Session:
+        "Return the session, loading its history on first use"
+        if session_id not in self.sessions:
+            self.sessions[session_id] = Session.load(
+                session_id, self.index, self.search_index
+            )
+        return self.sessions[session_id]
 
     def update_provider(self):
         settings = self.current_session.settings
@@ -66,12 +172,19 @@ class ChatCLI:
             self.console.print(f"[red]Model not set for settings: {settings}[/]")
             self.provider = None
             return
-        self.provider = ProviderManager.get_provider(config)
+        try:
+            self.provider = ProviderManager.get_provider(config)
+        except ValueError as e:
+            self.console.print(f"[red]{e}. Check settings: {settings}[/]")
+            self.provider = None
+            return
+        if self.provider.transport.warmup:
+            BackgroundLoop.submit(self.provider.warmup())
 
     def new(self, arg):
         "Start a new chat: /new"
 
-        session = Session()
+        session = Session(index=self.index, search=self.search_index)
         self.sessions[session.id] = session
         self.current_session = session
         self.update_provider()
@@ -127,11 +240,64 @@ class ChatCLI:
         self.console.print(f"[bold green]Switched to settings: {arg}[/]")
 
     def list(self, arg):
-        "List all chats"
-        if not self.sessions:
+        "List chats, newest first: /list. Options: --sort created|title|settings|messages|tokens, --asc, --settings NAME, --title TEXT, --since DATE, --until DATE, --page N, --page-size N, --tree"
+        try:
+            options = parse_options(
+                arg,
+                {
+                    "tree": FLAG,
+                    "sort": sort_key,
+                    "asc": FLAG,
+                    "settings": str,
+                    "title": str,
+                    "since": iso_date,
+                    "until": iso_date,
+                    "page": positive,
+                    "page_size": positive,
+                },
+            )
+        except ValueError as e:
+            self.console.print(f"[red]{e}[/]")
+            return
+
+        session_ids = self.session_ids()
+        if not session_ids:
             self.console.print(f"[red]No chats yet. Start one with 'new'[/]")
             return
 
+        # rows come from the index, never from the conversations themselves
+        metas = []
+        for session_id in session_ids:
+            meta = self.index.get(session_id)
+            if meta is None:
+                # Opened but never saved, so it only exists in memory
+                meta = SessionMeta.from_session(self.sessions[session_id])
+            metas.append(meta)
+
+        if "settings" in options:
+            metas = [meta for meta in metas if meta.settings == options["settings"]]
+        if "title" in options:
+            text = options["title"].lower()
+            metas = [meta for meta in metas if text in meta.title.lower()]
+        if "since" in options:
+            metas = [meta for meta in metas if meta.created_at[:10] >= options["since"]]
+        if "until" in options:
+            metas = [meta for meta in metas if meta.created_at[:10] <= options["until"]]
+        if not metas:
+            self.console.print("[red]No chats match the filters[/]")
+            return
+
+        if options.get("tree"):
+            self.list_tree(metas)
+            return
+
+        metas.sort(
+            key=LIST_SORT_KEYS[options.get("sort", "created")],
+            reverse=not options.get("asc"),
+        )
+        page_size = options.get("page_size", self.LIST_PAGE_SIZE)
+        visible, page, pages = paginate(metas, options.get("page", 1), page_size)
+
         table = Table(title="All Chats:")
         table.add_column("ID")
         table.add_column("Title")
@@ -141,24 +307,49 @@ class ChatCLI:
         table.add_column("Messages", justify="right")
         table.add_column("Tokens", justify="right")
 
-        for session_id, session in self.sessions.items():
-            is_current = " (current)" if session == self.current_session else ""
-
-            title = f"{session.title} " if session.title else "(Untitled) "
-            msg_count = str(len(session.history))
-            token_count = str(session.get_token_count())
+        for meta in visible:
+            title = f"{meta.title} " if meta.title else "(Untitled) "
             table.add_row(
-                session_id,
+                meta.id,
                 title,
-                session.created_at,
-                session.branched_from,
-                session.settings,
-                msg_count,
-                token_count,
+                meta.created_at,
+                meta.branched_from,
+                meta.settings,
+                str(meta.messages),
+                str(meta.tokens),
             )
+        table.caption = page_footer(
+            (page - 1) * page_size, len(visible), len(metas), page, pages
+        )
 
         self.console.print(table)
 
+    def list_tree(self, metas: List[SessionMeta]) -> None:
+        "Print sessions nested under the session they were branched from"
+        tree = Tree("All Chats:")
+        nodes = {}
+        children: Dict[str, List[SessionMeta]] = {}
+        ids = {meta.id for meta in metas}
+        roots = []
+        for meta in metas:
+            if meta.branched_from in ids:
+                children.setdefault(meta.branched_from, []).append(meta)
+            else:
+                roots.append(meta)
+
+        pending = [(tree, meta) for meta in roots]
+        while pending:
+            parent_node, meta = pending.pop(0)
+            title = meta.title or "(Untitled)"
+            nodes[meta.id] = parent_node.add(
+                f"{title} [bright_black]{meta.id} · {meta.messages} messages · {meta.tokens} tokens[/]"
+            )
+            pending.extend(
+                (nodes[meta.id], child) for child in children.get(meta.id, [])
+            )
+
+        self.console.print(tree)
+
     def switch(self, session_id):
         "Switch to a different session: /switch <session_id>"
         if not session_id:
@@ -166,9 +357,7 @@ class ChatCLI:
             return
 
         # Allow prefix matching of conversation IDs
-        matching_sessions = [
-            s for s in self.sessions.keys() if s.startswith(session_id)
-        ]
+        matching_sessions = [s for s in self.session_ids() if s.startswith(session_id)]
 
         if len(matching_sessions) == 0:
             self.console.print(f"[red]No session found starting with {session_id}[/]")
@@ -177,7 +366,7 @@ class ChatCLI:
                 f"[red]Multiple sessions found starting with {session_id}[/]"
             )
         else:
-            self.current_session = self.sessions[matching_sessions[0]]
+            self.current_session = self.open_session(matching_sessions[0])
             self.update_provider()
             self.console.print(
                 f"[bold green]Switched to session:[/] ({self.current_session.title}) {self.current_session.id}"
@@ -202,85 +391,534 @@ class ChatCLI:
             )
             return
 
-        # copy the current session history and add the user message
-        # the history is not modified until a response is received
-        # ensures that the history alternates between user and assistant messages
-        message_history = copy.deepcopy(self.current_session.history)
-        message_history.append(Message(role="user", content=message))
+        if self.job_queue.active(self.current_session.id):
+            self.console.print(
+                "[red]This session has background jobs running. Queue the message after them with /bg, or check on them with /jobs[/]"
+            )
+            return
 
+        try:
+            turn = self.prepare_turn(self.current_session, self.provider, message)
+        except ValueError as e:
+            self.console.print(f"[red]{e}[/]")
+            return
+        if turn.context.trimmed_messages or turn.window.over_budget(turn.context):
+            self.console.print(f"[bright_black]{turn.window.describe(turn.context)}[/]")
+        if turn.cached:
+            self.console.print("[bright_black](cached response)[/]")
+
+        # call LLM (or replay the cached answer) and stream the response
+        turn.timer.start("stream")
+        result = self.stream_response(turn.events, turn.markdown)
+        turn.timer.stop()
+
+        # errors might include network errors, invalid API key, etc.
+        # text that arrived before the error is discarded
+        if result.error:
+            self.console.print(f"[red]An error occurred: {result.error}[/]")
+        self.finish_turn(turn, result)
+        if result.cancelled and result.parts and not result.error:
+            self.console.print("[yellow]Generation cancelled, partial response kept[/]")
+
+    def prepare_turn(
+        self, session: Session, provider, message: str, settings: str = ""
+    ) -> "Turn":
+        """Assemble the request for a message, answered from the cache when possible.
+
+        settings defaults to the session's current ones.
+        """
         # TODO: don't like having to repeat this to get the config of the current session
-        settings = self.current_session.settings
+        settings = settings or session.settings
         config = self.config_manager.get_config(settings)
+        model = str(config["model"])
 
-        # call LLM
-        response = self.provider.send(config, message_history)
+        # local time per stage is recorded with the request metrics
+        timer = StageTimer()
 
-        # response can be None if there was an error with the provider
-        # errors might include network errors, invalid API key, etc.
-        if not response:
+        # assemble the request from the session history and the user message
+        # the history is not modified until a response is received
+        # ensures that the history alternates between user and assistant messages
+        timer.start("tokenize")
+        user_message = Message(
+            role="user", content=message, tokens=count_tokens(message, model)
+        )
+        timer.start("assemble")
+        window = context_window(self.config_manager, settings, session.id)
+        context = window.build(
+            session.history,
+            user_message,
+            session.get_token_count(),
+        )
+
+        prepared_request = provider.prepare_request(config, context.messages)
+
+        # identical requests are answered from the response cache when the
+        # settings opt in to it
+        timer.start("cache")
+        turn = Turn(session, settings, model, message, context, window, timer)
+        turn.markdown = self.config_manager.get_bool_option(settings, "markdown")
+        if self.config_manager.get_bool_option(settings, "cache"):
+            turn.cache_key = ResponseCache.key(
+                str(config["api_type"]), str(config["base_url"]), prepared_request
+            )
+            turn.max_age = (
+                int(self.config_manager.get_option(settings, "cache_max_age_days"))
+                * 86400
+            )
+            cached = self.response_cache.get(turn.cache_key, turn.max_age)
+            if cached is not None:
+                turn.cached = True
+                turn.events = ResponseCache.replay(cached)
+        if turn.events is None:
+            turn.events = provider.stream(prepared_request, context.tokens)
+        timer.stop()
+        return turn
+
+    def finish_turn(self, turn: "Turn", result: StreamResult) -> None:
+        "Keep the answer in the session and cache, and record the metrics"
+        # a cancelled generation keeps whatever text arrived before Ctrl-C
+        if result.parts and not result.error:
+            # add both user and assistant messages to the history at the same time
+            turn.timer.start("persist")
+            turn.session.add_message("user", turn.message, turn.model)
+            turn.session.add_message("assistant", result.text, turn.model)
+            turn.session.record_usage(result.usage)
+
+            if turn.cache_key and not turn.cached and not result.cancelled:
+                turn.timer.start("cache")
+                max_bytes = (
+                    int(self.config_manager.get_option(turn.settings, "cache_max_mb"))
+                    * 1024
+                    * 1024
+                )
+                self.response_cache.put(
+                    turn.cache_key, result.parts, max_bytes, turn.max_age
+                )
+            turn.timer.stop()
+
+        self.record_metrics(
+            turn.settings,
+            turn.model,
+            result,
+            turn.context.tokens,
+            turn.timer,
+            turn.cached,
+        )
+
+    def compare(self, arg):
+        "Send a message to several settings at once: /compare <settings1,settings2,...> <message>"
+        if not self.current_session:
+            self.console.print(
+                "[red]You're not in a session. Start one with 'new' or switch to an existing one with 'switch'[/]"
+            )
+            return
+
+        if self.job_queue.active(self.current_session.id):
+            self.console.print(
+                "[red]This session has background jobs running. Wait for them to finish, see /jobs[/]"
+            )
+            return
+
+        names_arg, _, message = arg.partition(" ")
+        names = [name for name in names_arg.split(",") if name]
+        message = message.strip()
+        if len(names) < 2 or not message:
+            self.console.print(
+                "[red]Usage: /compare <settings1,settings2,...> <message>[/]"
+            )
+            return
+        if len(set(names)) != len(names):
+            self.console.print("[red]Each settings name can only be compared once[/]")
+            return
+        for name in names:
+            config = self.config_manager.get_config(name)
+            if config is None:
+                self.console.print(
+                    f"[red]Invalid settings name: {name}. Choose from: {', '.join(self.config_manager.get_config_names())}[/]"
+                )
+                return
+            if config["api_key"] == "NOTSET" or config["model"] == "NOTSET":
+                self.console.print(
+                    f"[red]Model and api key are required for sending. Check settings: {name}[/]"
+                )
+                return
+        windows = {}
+        for name in names:
+            try:
+                windows[name] = context_window(
+                    self.config_manager, name, self.current_session.id
+                )
+            except ValueError as e:
+                self.console.print(f"[red]{e}. Check settings: {name}[/]")
+                return
+
+        # the same history goes to every settings, each with its own provider
+        # and context budget
+        timer = StageTimer()
+        timer.start("assemble")
+        streams = []
+        requests = []
+        for name in names:
+            config = self.config_manager.get_config(name)
+            model = str(config["model"])
+            user_message = Message(
+                role="user", content=message, tokens=count_tokens(message, model)
+            )
+            context = windows[name].build(
+                self.current_session.history,
+                user_message,
+                self.current_session.get_token_count(),
+            )
+            try:
+                provider = ProviderManager.get_provider(config)
+                prepared_request = provider.prepare_request(config, context.messages)
+            except ValueError as e:
+                self.console.print(f"[red]{e}. Check settings: {name}[/]")
+                return
+            streams.append(provider.stream(prepared_request, context.tokens))
+            requests.append((name, model, context.tokens))
+        timer.stop()
+
+        # wall time is that of the slowest response. Ctrl-C stops all of them
+        renderer = CompareRenderer(self.console, names)
+        renderer.start()
+        results: List[StreamResult] = []
+        try:
+            results = BackgroundLoop.run(
+                collect_all(
+                    [
+                        (events, renderer.writer(name))
+                        for events, name in zip(streams, names)
+                    ]
+                )
+            )
+        finally:
+            renderer.finish(
+                {
+                    name: (
+                        "error"
+                        if result.error
+                        else "cancelled" if result.cancelled else "done"
+                    )
+                    for name, result in zip(names, results)
+                }
+            )
+
+        table = Table(title="Comparison:")
+        table.add_column("Settings")
+        table.add_column("Model")
+        table.add_column("First Token", justify="right")
+        table.add_column("Total", justify="right")
+        table.add_column("Tokens", justify="right")
+        table.add_column("Tokens/s", justify="right")
+        for (name, model, prompt_tokens), result in zip(requests, results):
+            self.record_metrics(name, model, result, prompt_tokens, timer, False)
+            if result.error:
+                table.add_row(name, model, f"[red]{escape(str(result.error))}[/]")
+                continue
+            tokens = result.usage.get(
+                "completion_tokens", count_tokens(result.text, model)
+            )
+            rate = (
+                f"{tokens / (result.duration - result.ttft):.1f}"
+                if result.ttft is not None and result.duration > result.ttft
+                else "-"
+            )
+            table.add_row(
+                name,
+                model,
+                f"{result.ttft:.2f}s" if result.ttft is not None else "-",
+                f"{result.duration:.2f}s",
+                str(tokens),
+                rate,
+            )
+        print()
+        self.console.print(table)
+
+        answered = [
+            (name, model, result)
+            for (name, model, _), result in zip(requests, results)
+            if result.parts and not result.error
+        ]
+        if not answered:
+            self.console.print("[red]No settings returned a response[/]")
+            return
+
+        choices = ", ".join(
+            f"{number}={name}" for number, (name, _, _) in enumerate(answered, 1)
+        )
+        choice = self.console.input(
+            f"Keep which response in the session? ({choices}, Enter to discard): "
+        ).strip()
+        if not choice:
+            self.console.print("[yellow]No response kept[/]")
+            return
+        if not choice.isdigit() or not 1 <= int(choice) <= len(answered):
+            self.console.print(f"[red]Invalid choice: {choice}. No response kept[/]")
+            return
+
+        name, model, result = answered[int(choice) - 1]
+        self.current_session.add_message("user", message, model)
+        self.current_session.add_message("assistant", result.text, model)
+        self.current_session.record_usage(result.usage)
+        self.console.print(f"[bold green]Kept the response from: {name}[/]")
+
+    def bg(self, message):
+        "Send a message in the background: /bg <message>. /bg alone toggles it for the whole session"
+        if not self.current_session:
+            self.console.print(
+                "[red]You're not in a session. Start one with 'new' or switch to an existing one with 'switch'[/]"
+            )
             return
 
-        # stream the response. returns the full response as a string
-        full_response = self.stream_response(response, str(config["api_type"]))
+        session = self.current_session
+        if not message:
+            if session.id in self.background:
+                self.background.discard(session.id)
+                self.console.print(
+                    "[bold green]Messages in this session are sent in the foreground[/]"
+                )
+            else:
+                self.background.add(session.id)
+                self.console.print(
+                    "[bold green]Messages in this session are sent in the background[/]"
+                )
+            return
+
+        if not self.provider:
+            self.console.print(
+                "[red]Model and api key are required for sending. Check current settings[/]"
+            )
+            return
+
+        config = self.config_manager.get_config(session.settings)
+        waiting = len(self.job_queue.active(session.id))
+        job = self.job_queue.add(
+            session, session.settings, str(config["model"]), message
+        )
+        job.future = BackgroundLoop.submit(self.run_job(job, self.provider))
+        self.console.print(
+            f"[bright_black]Job {job.id} started in the background"
+            + (f", after {waiting} more in this session" if waiting else "")
+            + ". See /jobs[/]"
+        )
 
-        # add both user and assistant messages to the history at the same time
-        self.current_session.add_message("user", message)
-        self.current_session.add_message("assistant", full_response)
+    async def run_job(self, job: Job, provider) -> None:
+        "Answer a background job once the session's previous jobs are done"
+        try:
+            async with self.job_queue.turn(job.session.id):
+                if job.status == "cancelled":
+                    return
+                job.start()
+                # The settings the job was submitted with, as its provider
+                # was. Tokenizing, the cache and saving touch the disk, so
+                # they run on a worker thread and leave the loop to the
+                # foreground stream
+                turn = await asyncio.to_thread(
+                    self.prepare_turn, job.session, provider, job.message, job.settings
+                )
+                turn.timer.start("stream")
+                result = await collect(turn.events, job.write)
+                turn.timer.stop()
+                await asyncio.to_thread(self.finish_turn, turn, result)
+                job.finish(result)
+        except asyncio.CancelledError:
+            # cancelled before its turn came
+            job.status = "cancelled"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+
+    def jobs(self, arg):
+        "List background jobs: /jobs. Show or stop one: /jobs show <id>, /jobs cancel <id>"
+        action, _, job_id = arg.strip().partition(" ")
+        if action:
+            if action not in ("show", "cancel"):
+                self.console.print(
+                    "[red]Usage: /jobs, /jobs show <id> or /jobs cancel <id>[/]"
+                )
+                return
+            job = self.job_queue.get(job_id.strip())
+            if job is None:
+                self.console.print(f"[red]No job with ID: {job_id.strip()}[/]")
+                return
+            if action == "show":
+                self.console.print(
+                    f"[bold]Job {job.id}[/] ({job.status}) {escape(job.message)}"
+                )
+                print()
+                # model output is shown as-is, not parsed as markup
+                self.console.print(Text(job.text))
+                if job.error:
+                    self.console.print(f"[red]{escape(job.error)}[/]")
+            elif not job.active:
+                self.console.print(
+                    f"[red]Job {job.id} has already finished ({job.status})[/]"
+                )
+            else:
+                job.cancel()
+                self.console.print(f"[yellow]Cancelling job {job.id}[/]")
+            return
 
-    def stream_response(self, response, api_type: str) -> str:
-        "Stream the response from the provider"
+        if not self.job_queue.jobs:
+            self.console.print("[yellow]No background jobs yet[/]")
+            return
+
+        table = Table(title="Background jobs:")
+        table.add_column("ID", justify="right")
+        table.add_column("Session")
+        table.add_column("Message")
+        table.add_column("Status")
+        table.add_column("First Token", justify="right")
+        table.add_column("Elapsed", justify="right")
+        table.add_column("Tokens", justify="right")
+        for job in self.job_queue.jobs.values():
+            elapsed = job.elapsed()
+            status = job.status
+            if job.error:
+                status = f"[red]{status}[/]"
+            table.add_row(
+                str(job.id),
+                escape(job.session.title),
+                escape(job.message[:40] + ("…" if len(job.message) > 40 else "")),
+                status,
+                f"{job.ttft:.2f}s" if job.ttft is not None else "-",
+                f"{elapsed:.1f}s" if elapsed is not None else "-",
+                str(job.tokens) if job.parts else "-",
+            )
+        self.console.print(table)
+
+    def report_jobs(self) -> None:
+        "Show a notice for each background job that finished since the last prompt"
+        for job in self.job_queue.unreported():
+            where = f"({escape(job.session.title)}) {job.session.id}"
+            if job.status == "done":
+                self.console.print(
+                    f"[bold green]Job {job.id} done[/] in {where}: "
+                    f"{job.tokens} tokens in {job.duration:.2f}s, see /history or /jobs show {job.id}"
+                )
+            elif job.status == "failed":
+                self.console.print(
+                    f"[red]Job {job.id} failed[/] in {where}: {escape(job.error or '')}"
+                )
+            else:
+                self.console.print(
+                    f"[yellow]Job {job.id} cancelled[/] in {where}"
+                    + (", partial response kept" if job.parts else "")
+                )
+
+    def record_metrics(
+        self,
+        settings: str,
+        model: str,
+        result: StreamResult,
+        prompt_tokens: int,
+        timer: StageTimer,
+        cached: bool,
+    ) -> None:
+        "Append the request's metrics to the metrics log"
+        # token counts reported by the provider are preferred over local ones
+        usage = result.usage
+        self.metrics.record(
+            RequestMetrics(
+                settings=settings,
+                model=model,
+                ttft=result.ttft,
+                latency=result.duration,
+                prompt_tokens=usage.get("prompt_tokens", prompt_tokens),
+                completion_tokens=usage.get(
+                    "completion_tokens", count_tokens(result.text, model)
+                ),
+                usage_source="provider" if usage else "local",
+                cache_creation_tokens=usage.get("cache_creation_tokens", 0),
+                cache_read_tokens=usage.get("cache_read_tokens", 0),
+                cached=cached,
+                cancelled=result.cancelled,
+                error=result.error is not None,
+                retries=result.retries,
+                stages=timer.stages,
+            )
+        )
+
+    def stream_response(
+        self, events: AsyncIterator[StreamEvent], markdown: bool = False
+    ) -> StreamResult:
+        "Stream the response from the provider. Ctrl-C stops the generation"
+        print()
+        renderer = StreamRenderer(self.console, markdown)
+        renderer.start()
+        try:
+            result = BackgroundLoop.run(collect(events, renderer.write))
+        finally:
+            renderer.finish()
         print()
-        full_response = ""
-        if api_type == "openai":
-            for chunk in response:
-                if chunk.choices:
-                    delta = chunk.choices[0].delta
-                    if delta and delta.content:
-                        content = delta.content
-                        full_response += content
-                        print(content, end="", flush=True)
-                    if chunk.choices[0].finish_reason:
-                        print()
-                        break
-        elif api_type == "anthropic":
-            for chunk in response:
-                if chunk.type == "content_block_delta":
-                    content = chunk.delta.text
-                    full_response += content
-                    print(content, end="", flush=True)
-                elif chunk.type == "message_stop":
-                    print()
-                    break
         print()
-        return full_response
+
+        self.last_result = result
+        self.last_renderer = renderer
+        if result.ttft is not None:
+            self.console.print(
+                f"[bright_black]First token {result.ttft:.2f}s, total {result.duration:.2f}s, "
+                f"{renderer.chars_per_second:.0f} chars/s in {renderer.flushes} writes"
+                + (f", {result.retries} retries" if result.retries else "")
+                + (f", queued {result.queued:.2f}s" if result.queued else "")
+                + "[/]"
+            )
+        return result
 
     def history(self, arg):
-        "Show message history for the active session"
+        "Show message history for the active session: /history. Options: --last N, --page N, --page-size N"
         if not self.current_session:
             self.console.print(
                 "[red]You're not in a session. Start one with 'new' or switch to an existing one with 'switch'[/]"
             )
             return
 
-        if not self.current_session.history:
-            self.console.print("[red]Current session is empty.[/]")
+        try:
+            options = parse_options(
+                arg, {"last": positive, "page": positive, "page_size": positive}
+            )
+        except ValueError as e:
+            self.console.print(f"[red]{e}[/]")
             return
 
-        history_text = ""
-        for msg in self.current_session.history:
-            content = msg.content.strip()
+        messages = [msg for msg in self.current_session.history if msg.role != "system"]
+        if not messages:
+            self.console.print("[red]Current session is empty.[/]")
+            return
 
-            if msg.role == "user":
-                history_text += f"\n[[yellow]{msg.role.upper()}[/]]\n\n{content}\n"
-            elif msg.role == "assistant":
-                history_text += f"\n[[bold blue]{msg.role.upper()}[/]]\n\n{content}\n"
-            else:
-                continue
+        # only the visible messages are rendered. Pages count back from the
+        # most recent messages, which are on page 1
+        if "last" in options:
+            visible = messages[-options["last"] :]
+            page = pages = 1
+            newer = 0
+        else:
+            page_size = options.get("page_size", self.HISTORY_PAGE_SIZE)
+            newest_first, page, pages = paginate(
+                messages[::-1], options.get("page", 1), page_size
+            )
+            visible = newest_first[::-1]
+            newer = (page - 1) * page_size
+        first = len(messages) - newer - len(visible)
+        footer = page_footer(first, len(visible), len(messages), page, pages)
+
+        styles = {"user": "yellow", "assistant": "bold blue"}
+        renderables = []
+        for msg in visible:
+            # model output is shown as-is, not parsed as markup
+            renderables.append(
+                Text.assemble("[", (msg.role.upper(), styles.get(msg.role, "")), "]")
+            )
+            renderables.append(Text())
+            renderables.append(Text(msg.content.strip()))
+            renderables.append(Text())
 
         print(
             Panel(
-                history_text.strip(),
+                Group(*renderables[:-1]),
                 title=f"Chat History ({self.current_session.title})",
+                subtitle=footer,
                 box=box.ROUNDED,
                 border_style="bright_black",
                 padding=(1, 2),
@@ -300,28 +938,170 @@ class ChatCLI:
             f"Total session tokens: {self.current_session.get_token_count()}"
         )
 
+        # Prompt tokens as reported by the provider, summed over every request
+        usage = self.current_session.usage
+        if usage.get("prompt_tokens"):
+            read = usage.get("cache_read_tokens", 0)
+            self.console.print(f"Prompt tokens sent: {usage['prompt_tokens']}")
+            self.console.print(
+                f"Prompt cache: {usage.get('cache_creation_tokens', 0)} written, "
+                f"{read} read ({read / usage['prompt_tokens']:.0%} of prompt tokens)"
+            )
+
+    def cache(self, arg):
+        "Show response cache statistics: /cache. Empty the cache: /cache clear"
+        if arg == "clear":
+            self.response_cache.clear()
+            self.console.print("[bold green]Cleared the response cache[/]")
+            return
+
+        stats = self.response_cache.stats
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = f"{stats['hits'] / lookups:.0%}" if lookups else "-"
+        self.console.print(f"Hits: {stats['hits']}")
+        self.console.print(f"Misses: {stats['misses']}")
+        self.console.print(f"Hit rate: {hit_rate}")
+        self.console.print(f"Size: {self.response_cache.size() / 1024:.1f} KiB")
+
+    def search(self, arg):
+        "Search all chats: /search <query>. Reindex existing chats: /search --rebuild"
+        if arg == "--rebuild":
+            started = time.perf_counter()
+            session_ids = self.index.ids()
+            count = self.search_index.rebuild(
+                (
+                    session_id,
+                    [
+                        (msg.role, msg.content)
+                        # not kept open, so memory stays flat over large archives
+                        for msg in Session.load(session_id).messages
+                        if msg.role != "system"
+                    ],
+                )
+                for session_id in session_ids
+            )
+            self.console.print(
+                f"[bold green]Indexed {count} messages from {len(session_ids)} chats "
+                f"in {time.perf_counter() - started:.2f}s[/]"
+            )
+            return
+
+        if not arg:
+            self.console.print("[red]Provide a search query[/]")
+            return
+
+        started = time.perf_counter()
+        results = self.search_index.search(arg)
+        elapsed = time.perf_counter() - started
+        if not results:
+            self.console.print(f"[red]No messages found for: {escape(arg)}[/]")
+            return
+
+        table = Table(title=f"Results for: {escape(arg)}")
+        table.add_column("Session ID")
+        table.add_column("Title")
+        table.add_column("Role")
+        table.add_column("Snippet")
+        for result in results:
+            meta = self.index.get(result.session_id)
+            snippet = (
+                escape(result.snippet.replace("\n", " "))
+                .replace(SearchIndex.MATCH_START, "[bold yellow]")
+                .replace(SearchIndex.MATCH_END, "[/]")
+            )
+            table.add_row(
+                result.session_id,
+                meta.title if meta else "",
+                result.role,
+                snippet,
+            )
+        self.console.print(table)
+        self.console.print(
+            f"[bright_black]{len(results)} results in {elapsed * 1000:.1f} ms[/]"
+        )
+
+    def stats(self, arg):
+        "Show request latency percentiles: /stats. Export all metrics: /stats export <path>"
+        if arg.startswith("export"):
+            path = arg[len("export") :].strip()
+            if not path:
+                self.console.print("[red]Provide a path to export to[/]")
+                return
+            try:
+                count = self.metrics.export(Path(path).expanduser())
+            except OSError as e:
+                self.console.print(
+                    f"[red]Could not export metrics: {escape(str(e))}[/]"
+                )
+                return
+            self.console.print(f"[bold green]Exported {count} requests to {path}[/]")
+            return
+
+        summary = self.metrics.summarize()
+        if not summary:
+            self.console.print("[red]No requests recorded yet[/]")
+            return
+
+        def pair(row, name, unit="s", scale=1):
+            values = [row[f"{name}_p50"], row[f"{name}_p95"]]
+            return " / ".join(
+                "-" if v is None else f"{v * scale:.2f}{unit}" for v in values
+            )
+
+        table = Table(title="Request Stats (p50 / p95):")
+        table.add_column("Settings")
+        table.add_column("Model")
+        table.add_column("Requests", justify="right")
+        table.add_column("First Token", justify="right")
+        table.add_column("Total", justify="right")
+        table.add_column("Tokens/s", justify="right")
+        table.add_column("Local Overhead", justify="right")
+        for (settings, model), row in sorted(summary.items()):
+            table.add_row(
+                settings,
+                model,
+                str(row["requests"]),
+                pair(row, "ttft"),
+                pair(row, "latency"),
+                pair(row, "tokens_per_second", unit=""),
+                pair(row, "overhead", unit="ms", scale=1000),
+            )
+        self.console.print(table)
+
     def delete(self, arg):
         "Delete a session: /delete <session_id>"
         if not arg:
             self.console.print("[red]Please provide a valid chat ID[/]")
             return
 
-        if arg not in self.sessions:
+        if arg not in self.index and arg not in self.sessions:
             self.console.print(f"[red]No chat found with ID: {arg}[/]")
             return
 
-        file_path = HISTORY_PATH / f"{arg}.json"
-        if file_path.exists():
+        if self.job_queue.active(arg):
+            self.console.print(
+                f"[red]Chat {arg} has background jobs running. Cancel them first, see /jobs[/]"
+            )
+            return
+
+        if Session.storage.exists(arg):
             # double check
             confirm = input(f"Are you sure you want to delete chat: {arg}? (y/n): ")
             if confirm.lower() != "y":
                 self.console.print("[red]Deletion cancelled[/]")
                 return
 
-            # delete the file
-            file_path.unlink()
+            # branches that still read their history from this session get
+            # their own copy of it first
+            for meta in list(self.index.entries.values()):
+                if meta.branched_from == arg and meta.fork_offset is not None:
+                    self.open_session(meta.id).detach()
 
-            del self.sessions[arg]
+            Session.storage.delete(arg)
+            self.index.remove(arg)
+            self.search_index.remove(arg)
+            self.sessions.pop(arg, None)
+            Session.forget(arg)
 
             if self.current_session and self.current_session.id == arg:
                 self.current_session = None
@@ -336,13 +1116,16 @@ class ChatCLI:
             )
             return
 
-        # create a new session with the same metadata as the current session
-        branch_session = Session()
-        branch_session.title = self.current_session.title + " (branch)"
-        branch_session.branched_from = self.current_session.id
-        branch_session.settings = self.current_session.settings
-        branch_session.history = self.current_session.history
-        branch_session.save_history()
+        # jobs add their turns from another thread, so the fork could catch
+        # one half written and end on an unanswered message
+        if self.job_queue.active(self.current_session.id):
+            self.console.print(
+                "[red]This session has background jobs running. Wait for them to finish, see /jobs[/]"
+            )
+            return
+
+        # the branch shares the current history without copying it
+        branch_session = self.current_session.branch()
 
         self.sessions[branch_session.id] = branch_session
         self.current_session = branch_session
@@ -380,12 +1163,19 @@ class ChatCLI:
                 multiline_input = "\n".join(self.multiline_buffer)
                 print(multiline_input)
                 if multiline_input:
-                    self.send(multiline_input)
+                    self.send_message(multiline_input)
                 self.multiline_buffer = []
             else:
                 self.multiline_buffer.append(user_input)
         else:
-            self.send(user_input)
+            self.send_message(user_input)
+
+    def send_message(self, message: str) -> None:
+        "Send typed input, in the background when the session is set to"
+        if self.current_session and self.current_session.id in self.background:
+            self.bg(message)
+        else:
+            self.send(message)
 
     def run(self):
         "Start the chat CLI"
@@ -398,13 +1188,35 @@ class ChatCLI:
                 prompt = "... " if self.multiline_mode else ">>> "
                 user_input = self.console.input(prompt)
                 self.handle_input(user_input)
+                self.report_jobs()
+                self.report_write_error()
             except KeyboardInterrupt:
-                self.quit()
+                self.quit("")
             except EOFError:
-                self.quit()
+                self.quit("")
+
+    def report_write_error(self) -> None:
+        "Show a failed background write once; the writer keeps retrying it"
+        error = Session.storage.error
+        if error:
+            Session.storage.error = None
+            self.console.print(f"[red]Could not save sessions: {error}[/]")
 
     def quit(self, arg):
         "Exit the chat CLI"
+        # cancelled jobs keep their partial responses, as with Ctrl-C
+        active = self.job_queue.active()
+        if active:
+            for job in active:
+                job.cancel()
+            deadline = time.monotonic() + 5
+            while self.job_queue.active() and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.console.print(f"[yellow]Cancelled {len(active)} background jobs[/]")
+        try:
+            Session.storage.flush()
+        except Exception as e:
+            self.console.print(f"[red]Could not save sessions: {e}[/]")
         self.console.print("[green]Goodbye![/]")
         self.running = False
 
@@ -0,0 +1,134 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import asyncio
+import concurrent.futures
+import time
+from models.message import count_tokens
+from models.session import Session
+from providers.streaming import StreamResult
+
+
+@dataclass
+class Job:
+    "A message being answered in the background, see ChatCLI.bg"
+
+    id: int
+    session: Session
+    settings: str
+    model: str
+    message: str
+    # queued, running, done, cancelled or failed
+    status: str = "queued"
+    submitted: float = field(default_factory=time.time)
+    ttft: Optional[float] = None
+    duration: Optional[float] = None
+    parts: List[str] = field(default_factory=list)
+    usage: Dict[str, int] = field(default_factory=dict)
+    error: Optional[str] = None
+    future: Optional[concurrent.futures.Future] = None
+    # Whether the completion notice has been shown
+    reported: bool = False
+    _started: float = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    @property
+    def tokens(self) -> int:
+        "Completion tokens, counted locally until the provider reports them"
+        return self.usage.get("completion_tokens") or count_tokens(
+            self.text, self.model
+        )
+
+    def start(self) -> None:
+        self.status = "running"
+        self._started = time.perf_counter()
+
+    def write(self, text: str) -> None:
+        # Live timings, replaced by the stream's own once it finishes
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self._started
+        self.parts.append(text)
+
+    def cancel(self) -> None:
+        "Stop the job. A running job keeps the text that arrived so far"
+        # A job cancelled before the loop picks it up never runs at all
+        if self.status == "queued":
+            self.status = "cancelled"
+        if self.future is not None:
+            self.future.cancel()
+
+    def finish(self, result: StreamResult) -> None:
+        self.ttft = result.ttft
+        self.duration = result.duration
+        self.usage = dict(result.usage)
+        if result.error:
+            self.status = "failed"
+            self.error = str(result.error)
+        elif result.cancelled:
+            self.status = "cancelled"
+        else:
+            self.status = "done"
+
+    def elapsed(self) -> Optional[float]:
+        if self.duration is not None:
+            return self.duration
+        if self.status == "running":
+            return time.perf_counter() - self._started
+        return None
+
+
+class JobQueue:
+    """Background jobs started from the REPL, in the order they were submitted.
+
+    Jobs of the same session take turns: each one starts only after the
+    previous one has added its messages, so the history keeps alternating
+    between user and assistant messages and every job sees the answers
+    before it. Jobs of different sessions run concurrently.
+    """
+
+    def __init__(self):
+        self.jobs: Dict[int, Job] = {}
+        self._next_id = 1
+        # One lock per session, only used on the background loop
+        self._turns: Dict[str, asyncio.Lock] = {}
+
+    def add(self, session: Session, settings: str, model: str, message: str) -> Job:
+        job = Job(self._next_id, session, settings, model, message)
+        self.jobs[job.id] = job
+        self._next_id += 1
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        try:
+            return self.jobs.get(int(job_id))
+        except ValueError:
+            return None
+
+    def turn(self, session_id: str) -> asyncio.Lock:
+        "Held by the job of the session that is currently running"
+        return self._turns.setdefault(session_id, asyncio.Lock())
+
+    def active(self, session_id: Optional[str] = None) -> List[Job]:
+        "Queued and running jobs, of one session or all of them"
+        return [
+            job
+            for job in list(self.jobs.values())
+            if job.active and (session_id is None or job.session.id == session_id)
+        ]
+
+    def unreported(self) -> List[Job]:
+        "Jobs that finished since the last call"
+        finished = [
+            job
+            for job in list(self.jobs.values())
+            if not job.active and not job.reported
+        ]
+        for job in finished:
+            job.reported = True
+        return finished
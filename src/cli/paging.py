@@ -0,0 +1,61 @@
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+import math
+import shlex
+
+# Flag options take no value
+FLAG = None
+
+
+def parse_options(
+    arg: str, options: Dict[str, Optional[Callable[[str], Any]]]
+) -> Dict[str, Any]:
+    """Parse "--name value" and "--flag" options from a command argument.
+
+    options maps each option name to a converter for its value, or FLAG.
+    Raises ValueError with a message for the user on bad input.
+    """
+    values: Dict[str, Any] = {}
+    words = shlex.split(arg)
+    while words:
+        word = words.pop(0)
+        name = word[2:].replace("-", "_")
+        if not word.startswith("--") or name not in options:
+            raise ValueError(f"Unknown option: {word}")
+        convert = options[name]
+        if convert is FLAG:
+            values[name] = True
+            continue
+        if not words:
+            raise ValueError(f"Missing value for {word}")
+        value = words.pop(0)
+        try:
+            values[name] = convert(value)
+        except ValueError:
+            raise ValueError(f"Invalid value for {word}: {value}")
+    return values
+
+
+def positive(value: str) -> int:
+    number = int(value)
+    if number <= 0:
+        raise ValueError
+    return number
+
+
+def paginate(items: Sequence, page: int, page_size: int) -> Tuple[Sequence, int, int]:
+    """Return the slice of items on a 1-based page, the page and the page count.
+
+    Pages past the end are clamped to the last page.
+    """
+    pages = max(1, math.ceil(len(items) / page_size))
+    page = min(page, pages)
+    start = (page - 1) * page_size
+    return items[start : start + page_size], page, pages
+
+
+def page_footer(first: int, shown: int, total: int, page: int, pages: int) -> str:
+    "Position of the visible slice"
+    footer = f"{first + 1}-{first + shown} of {total}"
+    if pages > 1:
+        footer += f", page {page}/{pages} (--page N for others)"
+    return footer
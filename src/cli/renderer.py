@@ -0,0 +1,163 @@
+from typing import Callable, Dict, List, Optional
+import asyncio
+import threading
+import time
+from rich.console import Console
+
+
+class StreamRenderer:
+    """Writes streamed text to the terminal in coalesced frames.
+
+    Chunks are buffered in a list and written at most once per frame instead
+    of once per token. In Markdown mode the whole response is re-rendered
+    through a rich Live view, at a lower frame rate since each frame
+    re-parses everything received so far.
+    """
+
+    FRAME_INTERVAL = 1 / 30
+    MARKDOWN_FRAME_INTERVAL = 1 / 8
+
+    def __init__(self, console: Console, markdown: bool = False):
+        self.console = console
+        self.markdown = markdown
+        self.interval = (
+            self.MARKDOWN_FRAME_INTERVAL if markdown else self.FRAME_INTERVAL
+        )
+
+        self.parts: List[str] = []
+        self._pending: List[str] = []
+        self._lock = threading.Lock()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._live = None
+
+        self.chars = 0
+        self.flushes = 0
+        self._started = 0.0
+        self._last_flush = 0.0
+        self._finished = 0.0
+
+    def start(self) -> None:
+        self._started = self._last_flush = time.perf_counter()
+        if self.markdown:
+            from rich.live import Live
+
+            self._live = Live(
+                console=self.console, auto_refresh=False, vertical_overflow="visible"
+            )
+            self._live.start()
+
+    def write(self, text: str) -> None:
+        "Buffer a chunk, flushing if a frame is due"
+        with self._lock:
+            self._pending.append(text)
+            self.parts.append(text)
+            self.chars += len(text)
+
+        wait = self.interval - (time.perf_counter() - self._last_flush)
+        if wait <= 0:
+            self.flush()
+        elif self._timer is None:
+            # Make sure buffered text is shown even if the stream stalls
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._timer = loop.call_later(wait, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            pending = self._pending
+            self._pending = []
+
+            if self._live is not None:
+                from rich.markdown import Markdown
+
+                self._live.update(Markdown("".join(self.parts)), refresh=True)
+            else:
+                # Written as-is: no markup parsing of model output
+                self.console.file.write("".join(pending))
+                self.console.file.flush()
+            self.flushes += 1
+            self._last_flush = time.perf_counter()
+
+    def finish(self) -> None:
+        self.flush()
+        if self._live is not None:
+            self._live.stop()
+            self._live = None
+        self._finished = time.perf_counter()
+
+    @property
+    def chars_per_second(self) -> float:
+        elapsed = (self._finished or time.perf_counter()) - self._started
+        return self.chars / elapsed if elapsed > 0 else 0.0
+
+
+class CompareRenderer:
+    """Streams several responses side by side, one panel per profile.
+
+    Text is appended from the event loop thread; rich's Live refresh thread
+    redraws all panels a few times per second.
+    """
+
+    REFRESH_PER_SECOND = 8
+
+    def __init__(self, console: Console, names: List[str]):
+        self.console = console
+        self.names = names
+        self.parts: Dict[str, List[str]] = {name: [] for name in names}
+        self.status: Dict[str, str] = {name: "waiting" for name in names}
+        self._live = None
+
+    def writer(self, name: str) -> Callable[[str], None]:
+        "A text callback for one profile's stream"
+
+        def write(text: str) -> None:
+            if not self.parts[name]:
+                self.status[name] = "streaming"
+            self.parts[name].append(text)
+
+        return write
+
+    def render(self):
+        from rich.panel import Panel
+        from rich.table import Table
+        from rich.text import Text
+
+        grid = Table.grid(expand=True, padding=(0, 1))
+        panels = []
+        for name in self.names:
+            grid.add_column(ratio=1)
+            panels.append(
+                Panel(
+                    Text("".join(self.parts[name])),
+                    title=name,
+                    subtitle=self.status[name],
+                )
+            )
+        grid.add_row(*panels)
+        return grid
+
+    def start(self) -> None:
+        from rich.live import Live
+
+        self._live = Live(
+            get_renderable=self.render,
+            console=self.console,
+            refresh_per_second=self.REFRESH_PER_SECOND,
+            vertical_overflow="visible",
+        )
+        self._live.start()
+
+    def finish(self, status: Dict[str, str]) -> None:
+        "Stop refreshing and draw the final panels with their status lines"
+        self.status.update(status)
+        if self._live is not None:
+            self._live.stop()
+            self._live = None
@@ -2,6 +2,73 @@ from typing import List, Dict
 import configparser
 from pathlib import Path
 
+# Optional per-profile options and the values used when a profile omits them.
+# These are not written into new configs.
+OPTION_DEFAULTS = {
+    # Maximum prompt tokens sent per request, 0 for no limit
+    "context_tokens": "0",
+    # recent keeps the newest turns that fit. relevant (needs NumPy) keeps
+    # context_recent_turns newest turns plus up to context_relevant_turns
+    # older ones that best match the new message
+    "context_mode": "recent",
+    "context_recent_turns": "2",
+    "context_relevant_turns": "4",
+    # Reuse stored responses for identical requests
+    "cache": "false",
+    "cache_max_mb": "100",
+    "cache_max_age_days": "30",
+    # Client-side rate limits per endpoint, shared by all ellm processes.
+    # 0 follows the provider's rate limit headers, if it sends any
+    "requests_per_minute": "0",
+    "tokens_per_minute": "0",
+    # Render responses as Markdown while they stream
+    "markdown": "false",
+    # HTTP transport, see providers.transport
+    "connect_timeout": "10",
+    "read_timeout": "600",
+    "first_byte_timeout": "120",
+    "max_retries": "3",
+    "backoff_base": "0.5",
+    "backoff_max": "30",
+    "pool_max_connections": "20",
+    "pool_max_keepalive": "10",
+    "keepalive_expiry": "60",
+    "warmup": "false",
+    # Request token usage in OpenAI streams (stream_options)
+    "stream_usage": "true",
+    # Anthropic prompt caching of the system prompt and earlier turns
+    "prompt_cache": "true",
+    # Session storage backend, journal or sqlite. Only read from DEFAULT
+    "storage": "journal",
+    # Days without changes before ellm archive compresses a session. Only
+    # read from DEFAULT
+    "archive_after_days": "90",
+}
+
+
+def get_option(config: configparser.SectionProxy, option: str) -> str:
+    "Read an optional setting from a profile, falling back to its default"
+    return config.get(option, OPTION_DEFAULTS[option])
+
+
+def parse_bool(value: str, option: str) -> bool:
+    if value.lower() not in configparser.ConfigParser.BOOLEAN_STATES:
+        raise ValueError(f"Not a boolean for {option}: {value}")
+    return configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
+
+
+def get_bool_option(config: configparser.SectionProxy, option: str) -> bool:
+    return parse_bool(get_option(config, option), option)
+
+
+def get_number_option(config: configparser.SectionProxy, option: str, kind=float):
+    "The option as a float, or as kind (e.g. int)"
+    value = get_option(config, option)
+    try:
+        return kind(value)
+    except ValueError:
+        raise ValueError(f"Not a number for {option}: {value}")
+
 
 class ConfigManager:
     def __init__(self, config_file_path: Path):
@@ -50,6 +117,15 @@ class ConfigManager:
 
         return self.configs[name]
 
+    def get_option(self, name: str, option: str) -> str:
+        config = self.get_config(name)
+        if config is None:
+            return OPTION_DEFAULTS[option]
+        return get_option(config, option)
+
+    def get_bool_option(self, name: str, option: str) -> bool:
+        return parse_bool(self.get_option(name, option), option)
+
     def get_config_names(self) -> List[str]:
         return list(self.configs.keys())
 
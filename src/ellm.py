@@ -1,5 +1,18 @@
+import sys
+
+# Started before any other import, so the profile covers the whole startup.
+# main() still parses --profile-startup, this only peeks at it
+if "--profile-startup" in sys.argv:
+    from utils.importtime import ImportProfiler
+
+    startup_profiler = ImportProfiler()
+    startup_profiler.start()
+else:
+    startup_profiler = None
+
 import argparse
-from cli.chatcli import ChatCLI
+import atexit
+import signal
 from utils.constants import CONFIG_PATH
 from config.manager import ConfigManager
 
@@ -14,8 +27,216 @@ def positive_int(value) -> str:
         raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
 
 
+def non_negative_int(value) -> str:
+    try:
+        value = int(value)
+        if value < 0:
+            raise ValueError
+        return str(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not a non-negative integer")
+
+
+def option_value(value) -> tuple:
+    from config.manager import OPTION_DEFAULTS
+
+    option, sep, setting = value.partition("=")
+    if not sep or option not in OPTION_DEFAULTS:
+        raise argparse.ArgumentTypeError(
+            f"{value} is not OPTION=VALUE with OPTION one of: {', '.join(OPTION_DEFAULTS)}"
+        )
+    return option, setting
+
+
+def exit_on_signal(signum, frame) -> None:
+    # Exiting normally runs the atexit handlers, which write pending sessions
+    raise SystemExit(128 + signum)
+
+
+def run_batch(args) -> None:
+    import asyncio
+    import sys
+    from cli.batch import BatchRunner, read_jobs
+    from models.session import Session
+    from storage.backend import open_storage
+    from storage.index import SessionIndex
+    from storage.search import SearchIndex
+    from storage.writer import SessionWriter
+    from utils.constants import INDEX_PATH, SEARCH_PATH
+
+    config_manager = ConfigManager(CONFIG_PATH)
+    Session.storage = SessionWriter(
+        open_storage(config_manager.get_option("DEFAULT", "storage"))
+    )
+    Session.config_manager = config_manager
+    runner = BatchRunner(
+        config_manager,
+        SessionIndex(INDEX_PATH),
+        sys.stdout,
+        concurrency=int(args.concurrency),
+        default_settings=args.settings,
+        search_index=SearchIndex(SEARCH_PATH),
+    )
+    if args.input == "-":
+        asyncio.run(runner.run(read_jobs(sys.stdin)))
+    else:
+        with open(args.input) as f:
+            asyncio.run(runner.run(read_jobs(f)))
+
+
+def run_migrate(args) -> None:
+    import sys
+    import time
+    from storage.backend import copy_sessions, open_storage
+
+    config_manager = ConfigManager(CONFIG_PATH)
+    current = config_manager.get_option("DEFAULT", "storage")
+    if current == args.to:
+        sys.exit(f"Sessions are already stored with {args.to}")
+
+    # Archived sessions stay where they are, shared by both backends
+    source = open_storage(current, archive=False)
+    target = open_storage(args.to, archive=False)
+    started = time.perf_counter()
+    sessions, messages = copy_sessions(source, target)
+    config_manager.save_config({"storage": args.to}, "DEFAULT")
+    print(
+        f"Copied {sessions} sessions ({messages} messages) from {source.location()} "
+        f"to {target.location()} in {time.perf_counter() - started:.2f}s"
+    )
+    print(f"Now using {args.to} storage. The {current} copy was left in place.")
+
+
+def format_bytes(size: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size:.0f} B"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+def run_archive(args) -> None:
+    import time
+    from models.session import Session
+    from storage.backend import open_storage
+    from storage.writer import SessionWriter
+
+    config_manager = ConfigManager(CONFIG_PATH)
+    days = int(args.days or config_manager.get_option("DEFAULT", "archive_after_days"))
+    writer = SessionWriter(
+        open_storage(config_manager.get_option("DEFAULT", "storage"))
+    )
+    storage = writer.storage
+
+    started = time.perf_counter()
+    # Sessions open here are left live; those written to by other processes
+    # while being archived are caught by archive_idle itself
+    archived = writer.archive_idle(time.time() - days * 86400, skip=Session._open)
+    if archived.sessions:
+        print(
+            f"Archived {archived.sessions} sessions unchanged for {days} days "
+            f"in {time.perf_counter() - started:.2f}s: "
+            f"{format_bytes(archived.stored_bytes)} freed from {storage.location()}, "
+            f"archive grew by {format_bytes(archived.compressed_bytes)}, "
+            f"{format_bytes(archived.saved_bytes)} saved"
+        )
+    else:
+        print(f"No sessions unchanged for {days} days")
+
+    total = storage.archive.stats()
+    if total.sessions and total.stored_bytes:
+        print(
+            f"Archive: {total.sessions} sessions in {format_bytes(total.compressed_bytes)}, "
+            f"{format_bytes(total.saved_bytes)} saved "
+            f"({total.saved_bytes / total.stored_bytes:.0%} of {format_bytes(total.stored_bytes)}) "
+            f"with {storage.archive.codec}, at {storage.archive.path}"
+        )
+
+
+def run_serve(args) -> None:
+    import asyncio
+    import sys
+    from models.session import Session
+    from server.gateway import Gateway
+    from storage.backend import open_storage
+    from storage.index import SessionIndex
+    from storage.search import SearchIndex
+    from storage.writer import SessionWriter
+    from utils.constants import INDEX_PATH, SEARCH_PATH
+
+    config_manager = ConfigManager(CONFIG_PATH)
+    Session.storage = SessionWriter(
+        open_storage(config_manager.get_option("DEFAULT", "storage"))
+    )
+    Session.config_manager = config_manager
+    gateway = Gateway(
+        config_manager,
+        SessionIndex(INDEX_PATH),
+        sys.stdout,
+        search_index=SearchIndex(SEARCH_PATH),
+    )
+
+    async def serve():
+        server = await gateway.serve(args.host, int(args.port))
+        # Raising SystemExit from a signal handler would only end the
+        # connection it interrupts, so signals stop the loop instead
+        stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for name in ("SIGTERM", "SIGHUP"):
+            try:
+                loop.add_signal_handler(getattr(signal, name), stopped.set)
+            except (AttributeError, NotImplementedError):
+                pass
+        print(
+            f"Serving on http://{args.host}:{args.port}/v1 with settings: "
+            f"{', '.join(config_manager.get_config_names())}",
+            flush=True,
+        )
+        async with server:
+            await stopped.wait()
+            # Don't wait for idle keep-alive connections
+            server.close_clients()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print("Stopped")
+
+
+def run_bench(args) -> None:
+    import json
+    import sys
+    from bench.cases import CASES
+    from bench.runner import run_bench as run
+
+    cases = args.only.split(",") if args.only else list(CASES)
+    unknown = [case for case in cases if case not in CASES]
+    if unknown:
+        sys.exit(f"Unknown benchmark cases: {', '.join(unknown)}")
+
+    report = run(
+        cases,
+        repeat=int(args.repeat),
+        sessions=int(args.sessions),
+        tokens=int(args.tokens),
+        token_rate=args.token_rate,
+        latency=args.latency,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
 def main():
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Report the import time of each module on exit",
+    )
     subparsers = parser.add_subparsers(dest="action", help="Available actions")
 
     model_parser = subparsers.add_parser("config", help="Add additional model settings")
@@ -29,19 +250,168 @@ def main():
         help="Set the api type (OpenAI API, AnthropicAPI, etc)",
     )
     model_parser.add_argument("--max-tokens", type=positive_int, help="Set max tokens")
+    model_parser.add_argument(
+        "--context-tokens",
+        type=non_negative_int,
+        help="Set the prompt token budget per request (0 for no limit)",
+    )
+    model_parser.add_argument(
+        "--cache",
+        choices=["true", "false"],
+        help="Reuse cached responses for identical requests",
+    )
+    model_parser.add_argument(
+        "--markdown",
+        choices=["true", "false"],
+        help="Render responses as Markdown while they stream",
+    )
+    model_parser.add_argument(
+        "--cache-max-mb", type=positive_int, help="Set the response cache size limit"
+    )
+    model_parser.add_argument(
+        "--cache-max-age-days",
+        type=positive_int,
+        help="Set how long cached responses stay valid",
+    )
+
+    model_parser.add_argument(
+        "--set",
+        action="append",
+        type=option_value,
+        metavar="OPTION=VALUE",
+        help="Set any optional setting, e.g. --set read_timeout=120",
+    )
+
+    batch_parser = subparsers.add_parser(
+        "batch", help="Send prompts from a JSONL file and print results as JSONL"
+    )
+    batch_parser.add_argument(
+        "input",
+        nargs="?",
+        default="-",
+        help="JSONL file with one prompt per line (default: stdin)",
+    )
+    batch_parser.add_argument(
+        "--settings",
+        default="DEFAULT",
+        help="Settings used by prompts that don't name any",
+    )
+    batch_parser.add_argument(
+        "--concurrency",
+        type=positive_int,
+        default="4",
+        help="Maximum number of requests in flight",
+    )
+
+    migrate_parser = subparsers.add_parser(
+        "migrate",
+        help="Copy all sessions to another storage backend and switch to it",
+    )
+    migrate_parser.add_argument(
+        "--to",
+        choices=["journal", "sqlite"],
+        default="sqlite",
+        help="Storage backend to move sessions to",
+    )
+
+    bench_parser = subparsers.add_parser(
+        "bench", help="Benchmark ellm against local mock provider servers"
+    )
+    bench_parser.add_argument(
+        "--only",
+        help="Comma-separated cases to run: cold_start, load_sessions, save_history, streaming, messages",
+    )
+    bench_parser.add_argument(
+        "--output", help="Write the JSON report to this file instead of stdout"
+    )
+    bench_parser.add_argument(
+        "--repeat", type=positive_int, default="5", help="Timed runs per measurement"
+    )
+    bench_parser.add_argument(
+        "--sessions",
+        type=positive_int,
+        default="10000",
+        help="Synthetic conversations for load_sessions",
+    )
+    bench_parser.add_argument(
+        "--tokens", type=positive_int, default="2000", help="Tokens per mock response"
+    )
+    bench_parser.add_argument(
+        "--token-rate",
+        type=float,
+        default=0,
+        help="Mock tokens per second (0 for as fast as possible)",
+    )
+    bench_parser.add_argument(
+        "--latency",
+        type=float,
+        default=0,
+        help="Mock seconds before each response starts",
+    )
+
+    archive_parser = subparsers.add_parser(
+        "archive",
+        help="Compress sessions that haven't changed in a while and report the space saved",
+    )
+    archive_parser.add_argument(
+        "--days",
+        type=non_negative_int,
+        help="Archive sessions unchanged for this many days (default: the archive_after_days option)",
+    )
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="Run an OpenAI-compatible HTTP gateway to the settings"
+    )
+    serve_parser.add_argument(
+        "--host", default="127.0.0.1", help="Address to listen on"
+    )
+    serve_parser.add_argument(
+        "--port", type=positive_int, default="8080", help="Port to listen on"
+    )
 
     args = parser.parse_args()
+
+    for name in ("SIGTERM", "SIGHUP"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), exit_on_signal)
+
+    # Heavy modules (rich, tiktoken, provider SDKs) are imported on first use,
+    # so the report at exit covers everything this command ends up loading
+    if args.profile_startup:
+        global startup_profiler
+        if startup_profiler is None:
+            # main() called with arguments set after this module was imported
+            from utils.importtime import ImportProfiler
+
+            startup_profiler = ImportProfiler()
+            startup_profiler.start()
+        atexit.register(startup_profiler.report)
+
     if args.action == "config":
         args_dict = {
             key: value for key, value in vars(args).items() if value is not None
         }
         del args_dict["action"]
         del args_dict["name"]
+        del args_dict["profile_startup"]
+        args_dict.update(args_dict.pop("set", []))
         if args_dict:
             ConfigManager(CONFIG_PATH).save_config(args_dict, args.name)
         else:
             ConfigManager(CONFIG_PATH).print_config(args.name)
+    elif args.action == "batch":
+        run_batch(args)
+    elif args.action == "migrate":
+        run_migrate(args)
+    elif args.action == "bench":
+        run_bench(args)
+    elif args.action == "archive":
+        run_archive(args)
+    elif args.action == "serve":
+        run_serve(args)
     else:
+        from cli.chatcli import ChatCLI
+
         ChatCLI(CONFIG_PATH).run()
 
 
@@ -0,0 +1,109 @@
+from dataclasses import dataclass
+from typing import List, Sequence
+from models.message import Message
+
+
+@dataclass
+class AssembledContext:
+    messages: List[Message]
+    tokens: int
+    # Older messages left out to fit the budget
+    trimmed_messages: int = 0
+    trimmed_tokens: int = 0
+    # Older messages sent because they are relevant, see RelevantContext
+    relevant_messages: int = 0
+
+
+CONTEXT_MODES = ("recent", "relevant")
+
+
+def context_window(config_manager, settings: str, key: str = "") -> "ContextWindow":
+    """The context selection of a profile, from its context_* options.
+
+    key identifies the session, so per-session state is kept between
+    requests. Raises ValueError for an unknown mode or a missing dependency.
+    """
+    budget = int(config_manager.get_option(settings, "context_tokens"))
+    mode = config_manager.get_option(settings, "context_mode")
+    if mode == "recent":
+        return ContextWindow(budget)
+    if mode == "relevant":
+        try:
+            from models.relevance import RelevantContext
+        except ImportError:
+            raise ValueError(
+                "context_mode = relevant needs NumPy: pip install 'ellm[relevance]'"
+            )
+        return RelevantContext(
+            budget,
+            int(config_manager.get_option(settings, "context_recent_turns")),
+            int(config_manager.get_option(settings, "context_relevant_turns")),
+            key,
+        )
+    raise ValueError(
+        f"Unknown context_mode: {mode}. Choose from: {', '.join(CONTEXT_MODES)}"
+    )
+
+
+class ContextWindow:
+    """Selects the messages sent with each request.
+
+    The system prompt and the newest turn are always kept. When the session
+    no longer fits in the token budget, the oldest user/assistant turns are
+    dropped until it does, or until only the newest turn is left.
+    """
+
+    def __init__(self, budget: int = 0):
+        # 0 means no limit
+        self.budget = budget
+
+    def build(
+        self, history: Sequence[Message], message: Message, history_tokens: int
+    ) -> AssembledContext:
+        "history_tokens is the running token total of history"
+        total = history_tokens + message.tokens
+        if not self.budget or total <= self.budget:
+            return AssembledContext(messages=[*history, message], tokens=total)
+
+        system = [msg for msg in history[:1] if msg.role == "system"]
+
+        # Drop whole turns from the front so the history still starts with a
+        # user message and keeps alternating
+        start = len(system)
+        # The newest turn starts at the last user message
+        newest = len(history)
+        while newest > start and history[newest - 1].role != "user":
+            newest -= 1
+        newest = max(start, newest - 1)
+        trimmed_tokens = 0
+        while total > self.budget and start < newest:
+            end = start + 1
+            while end < len(history) and history[end].role != "user":
+                end += 1
+            dropped = sum(history[i].tokens for i in range(start, end))
+            total -= dropped
+            trimmed_tokens += dropped
+            start = end
+
+        return AssembledContext(
+            messages=[*system, *history[start:], message],
+            tokens=total,
+            trimmed_messages=start - len(system),
+            trimmed_tokens=trimmed_tokens,
+        )
+
+    def over_budget(self, context: AssembledContext) -> bool:
+        return bool(self.budget) and context.tokens > self.budget
+
+    def describe(self, context: AssembledContext) -> str:
+        "What was left out of the context, for the user"
+        if self.over_budget(context):
+            return (
+                f"Context: left out {context.trimmed_messages} older messages "
+                f"({context.trimmed_tokens} tokens), still "
+                f"{context.tokens} tokens with only the newest turn, over the {self.budget} token budget"
+            )
+        return (
+            f"Context: left out {context.trimmed_messages} older messages "
+            f"({context.trimmed_tokens} tokens) to fit the {self.budget} token budget"
+        )
@@ -1,22 +1,63 @@
 from dataclasses import dataclass
 from datetime import datetime
-import tiktoken
+from enum import StrEnum
+from typing import Any, Dict
+import time
+from utils.tokenizer import Tokenizer
 
 
-def count_tokens(text: str) -> int:
-    encoding = tiktoken.get_encoding("cl100k_base")
-    return len(encoding.encode(text))
+def count_tokens(text: str, model: str = "") -> int:
+    return Tokenizer.count(text, model)
 
 
-@dataclass
+class Role(StrEnum):
+    SYSTEM = "system"
+    USER = "user"
+    ASSISTANT = "assistant"
+
+
+# Role(value) is slow next to a dict lookup, which adds up over long sessions
+ROLES = {role.value: role for role in Role}
+
+
+@dataclass(frozen=True, slots=True)
 class Message:
-    role: str
+    """One message of a conversation.
+
+    Messages are immutable and slotted, as long sessions hold a great many
+    of them. The timestamp is in seconds since the epoch; stored messages
+    keep the ISO format, see to_dict.
+    """
+
+    role: Role
     content: str
-    timestamp: str = ""
+    timestamp: float = 0.0
     tokens: int = 0
 
     def __post_init__(self):
+        # Frozen, so defaults are filled in through object.__setattr__
+        if type(self.role) is not Role:
+            object.__setattr__(self, "role", Role(self.role))
         if not self.timestamp:
-            self.timestamp = datetime.now().isoformat()
+            object.__setattr__(self, "timestamp", time.time())
         if not self.tokens:
-            self.tokens = count_tokens(self.content)
+            object.__setattr__(self, "tokens", count_tokens(self.content))
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Message":
+        "A message as stored by to_dict"
+        timestamp = data.get("timestamp")
+        return cls(
+            ROLES.get(data["role"]) or Role(data["role"]),
+            data["content"],
+            datetime.fromisoformat(timestamp).timestamp() if timestamp else 0.0,
+            data.get("tokens", 0),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "role": self.role.value,
+            "content": self.content,
+            "timestamp": datetime.fromtimestamp(self.timestamp).isoformat(),
+            "tokens": self.tokens,
+        }
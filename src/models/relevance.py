@@ -0,0 +1,223 @@
+"""Relevance-ranked context selection, see RelevantContext.
+
+Needs NumPy, an optional dependency (pip install 'ellm[relevance]'). This
+module is only imported once a profile sets context_mode = relevant.
+"""
+
+from collections import Counter, OrderedDict
+from itertools import accumulate
+from typing import Dict, List, Optional, Sequence
+import re
+import threading
+import numpy as np
+from models.context import AssembledContext, ContextWindow
+from models.message import Message
+
+WORD = re.compile(r"\w+")
+
+
+def terms(text: str) -> List[str]:
+    return WORD.findall(text.lower())
+
+
+def grow(array: np.ndarray, size: int) -> np.ndarray:
+    "The array, reallocated with room for at least size items"
+    if size <= len(array):
+        return array
+    grown = np.zeros(max(size, 2 * len(array)), dtype=array.dtype)
+    grown[: len(array)] = array
+    return grown
+
+
+class TermIndex:
+    """BM25 over the messages of one session, extended as the session grows.
+
+    Postings are kept in flat NumPy arrays with one entry per distinct term
+    of each message, so a query is scored against the whole history with a
+    few vectorised operations instead of a loop over the messages.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.vocabulary: Dict[str, int] = {}
+        # Messages indexed so far, and the last of them
+        self.count = 0
+        self.last: Optional[Message] = None
+        self._size = 0
+        self._terms = np.empty(4096, dtype=np.int32)
+        self._docs = np.empty(4096, dtype=np.int32)
+        self._freqs = np.empty(4096, dtype=np.float32)
+        # Per message
+        self._lengths = np.empty(256, dtype=np.float32)
+        # Per term, the number of messages containing it
+        self._doc_freqs = np.zeros(1024, dtype=np.int32)
+
+    def sync(self, history: Sequence[Message]) -> None:
+        "Index messages added to history since the last call"
+        if self.count > len(history) or (
+            self.count and history[self.count - 1] != self.last
+        ):
+            # The history was rewritten, e.g. by another session with the same key
+            self.__init__()
+        for message in history[self.count :]:
+            self.add(message)
+
+    def add(self, message: Message) -> None:
+        counts = Counter(terms(message.content))
+        ids = [
+            self.vocabulary.setdefault(term, len(self.vocabulary)) for term in counts
+        ]
+        end = self._size + len(ids)
+        self._terms = grow(self._terms, end)
+        self._docs = grow(self._docs, end)
+        self._freqs = grow(self._freqs, end)
+        self._terms[self._size : end] = ids
+        self._docs[self._size : end] = self.count
+        self._freqs[self._size : end] = list(counts.values())
+        self._size = end
+
+        self._doc_freqs = grow(self._doc_freqs, len(self.vocabulary))
+        # Each term appears once in ids
+        self._doc_freqs[ids] += 1
+        self._lengths = grow(self._lengths, self.count + 1)
+        self._lengths[self.count] = sum(counts.values())
+        self.count += 1
+        self.last = message
+
+    def scores(self, query: str) -> np.ndarray:
+        "BM25 score of every indexed message for the query"
+        scores = np.zeros(self.count, dtype=np.float64)
+        ids = [
+            self.vocabulary[term]
+            for term in set(terms(query))
+            if term in self.vocabulary
+        ]
+        if not ids:
+            return scores
+        query_ids = np.array(ids, dtype=np.int32)
+
+        entry_terms = self._terms[: self._size]
+        matched = np.isin(entry_terms, query_ids)
+        docs = self._docs[: self._size][matched]
+        freqs = self._freqs[: self._size][matched]
+
+        doc_freqs = self._doc_freqs[query_ids]
+        idf = np.zeros(len(self.vocabulary))
+        idf[query_ids] = np.log1p((self.count - doc_freqs + 0.5) / (doc_freqs + 0.5))
+
+        lengths = self._lengths[: self.count]
+        average = lengths.mean() or 1.0
+        norms = self.K1 * (1 - self.B + self.B * lengths[docs] / average)
+        weights = idf[entry_terms[matched]] * freqs * (self.K1 + 1) / (freqs + norms)
+        return np.bincount(docs, weights=weights, minlength=self.count)
+
+
+class RelevantContext(ContextWindow):
+    """Selects the system prompt, the newest turns and the relevant older turns.
+
+    Older turns (a user message and its answer) are ranked by the BM25
+    score of their messages against the new message. The best ones are
+    added, up to top_k, while they fit in the token budget left after the
+    newest turns, then sent in their original order so the history still
+    alternates. Without a budget only the number of turns is limited.
+    """
+
+    # Term indexes of recently used sessions, by session id
+    _indexes: "OrderedDict[str, TermIndex]" = OrderedDict()
+    _lock = threading.Lock()
+    MAX_INDEXES = 64
+
+    def __init__(
+        self, budget: int = 0, recent_turns: int = 2, top_k: int = 4, key: str = ""
+    ):
+        super().__init__(budget)
+        self.recent_turns = recent_turns
+        self.top_k = top_k
+        # Session id, so its index is kept between requests
+        self.key = key
+
+    def index(self, history: Sequence[Message]) -> TermIndex:
+        with self._lock:
+            index = self._indexes.pop(self.key, None) or TermIndex()
+            if self.key:
+                self._indexes[self.key] = index
+                while len(self._indexes) > self.MAX_INDEXES:
+                    self._indexes.popitem(last=False)
+        index.sync(history)
+        return index
+
+    def build(
+        self, history: Sequence[Message], message: Message, history_tokens: int
+    ) -> AssembledContext:
+        "history_tokens is the running token total of history"
+        system = [msg for msg in history[:1] if msg.role == "system"]
+        offset = len(system)
+
+        # Turns start at each user message
+        starts = [
+            i
+            for i in range(offset, len(history))
+            if history[i].role == "user" or i == offset
+        ]
+        ends = starts[1:] + [len(history)]
+        cumulative = [0, *accumulate(msg.tokens for msg in history)]
+        turn_tokens = [
+            cumulative[end] - cumulative[start] for start, end in zip(starts, ends)
+        ]
+
+        available = (
+            self.budget - cumulative[offset] - message.tokens
+            if self.budget
+            else float("inf")
+        )
+        kept = set()
+        # The newest turns first, as ContextWindow would keep them
+        older = max(0, len(starts) - self.recent_turns)
+        for turn in range(len(starts) - 1, older - 1, -1):
+            if turn_tokens[turn] > available:
+                older = turn + 1
+                break
+            kept.add(turn)
+            available -= turn_tokens[turn]
+
+        relevant = 0
+        if older and self.top_k:
+            scores = self.index(history).scores(message.content)[offset:]
+            turn_of = np.repeat(np.arange(len(starts)), np.subtract(ends, starts))
+            turn_scores = np.bincount(turn_of, weights=scores, minlength=len(starts))
+            # Best first; ties go to the newer turn
+            for turn in np.argsort(-turn_scores[:older][::-1], kind="stable"):
+                turn = older - 1 - int(turn)
+                if relevant == self.top_k or turn_scores[turn] <= 0:
+                    break
+                if turn_tokens[turn] <= available:
+                    kept.add(turn)
+                    available -= turn_tokens[turn]
+                    relevant += 1
+
+        messages = list(system)
+        for turn in sorted(kept):
+            messages.extend(history[starts[turn] : ends[turn]])
+        tokens = cumulative[offset] + sum(turn_tokens[turn] for turn in kept)
+        return AssembledContext(
+            messages=[*messages, message],
+            tokens=tokens + message.tokens,
+            trimmed_messages=len(history) - len(messages),
+            trimmed_tokens=history_tokens - tokens,
+            relevant_messages=sum(
+                ends[turn] - starts[turn] for turn in kept if turn < older
+            ),
+        )
+
+    def describe(self, context: AssembledContext) -> str:
+        if not context.relevant_messages:
+            return (
+                f"Context: left out {context.trimmed_messages} older messages "
+                f"({context.trimmed_tokens} tokens), none relevant to the message"
+            )
+        return (
+            f"Context: sent {context.relevant_messages} older messages picked by relevance, "
+            f"left out {context.trimmed_messages} ({context.trimmed_tokens} tokens)"
+        )
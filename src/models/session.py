@@ -1,52 +1,253 @@
 from uuid import uuid4
 from utils.constants import HISTORY_PATH
-import json
 import utils.prompts as prompts
 from models.message import Message
-from dataclasses import asdict
 from datetime import datetime
-from typing import List
+from itertools import chain, islice
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+from weakref import WeakValueDictionary
+from config.manager import ConfigManager
+from storage.index import SessionIndex
+from storage.backend import JournalStorage
+from storage.search import SearchIndex
+from storage.writer import SessionWriter
+from utils.tokenizer import Tokenizer
+
+
+class HistoryView(Sequence[Message]):
+    """A branch's inherited messages followed by its own, without copying either.
+
+    Both lists stay owned by their sessions. Messages the parent adds after
+    the fork are outside the view, as its inherited length is fixed.
+    """
+
+    __slots__ = ("inherited", "fork_offset", "own")
+
+    def __init__(
+        self, inherited: Sequence[Message], fork_offset: int, own: List[Message]
+    ):
+        self.inherited = inherited
+        self.fork_offset = fork_offset
+        self.own = own
+
+    def __len__(self) -> int:
+        return self.fork_offset + len(self.own)
+
+    def __iter__(self) -> Iterator[Message]:
+        return chain(islice(self.inherited, self.fork_offset), self.own)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return list(self)[index]
+            split = self.fork_offset
+            return [
+                *self.inherited[start : max(start, min(stop, split))],
+                *self.own[max(start - split, 0) : max(stop - split, 0)],
+            ]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history index out of range")
+        if index < self.fork_offset:
+            return self.inherited[index]
+        return self.own[index - self.fork_offset]
 
 
 class Session:
-    def __init__(self, id: str = ""):
+    # Provider-reported prompt token totals kept per session
+    USAGE_KEYS = ("prompt_tokens", "cache_creation_tokens", "cache_read_tokens")
+
+    # Where sessions are persisted, chosen once at startup (see open_storage).
+    # Writes happen in the background, see SessionWriter
+    storage: SessionWriter = SessionWriter(JournalStorage(HISTORY_PATH))
+
+    # Settings of the running command, for the model each session's tokens
+    # are counted with. Set once at startup, like storage
+    config_manager: Optional[ConfigManager] = None
+
+    # Sessions currently in memory, so branches share their parent's instance
+    _open: "WeakValueDictionary[str, Session]" = WeakValueDictionary()
+
+    def __init__(
+        self,
+        id: str = "",
+        index: Optional[SessionIndex] = None,
+        search: Optional[SearchIndex] = None,
+    ):
         self.id = id or str(uuid4())
+        self.index = index
+        self.search = search
         self.title: str = "Untitled"
         self.branched_from: str = "master"
         self.settings = "DEFAULT"
-        self.history_file = HISTORY_PATH / f"{self.id}.json"
-        self.history: List[Message] = []
+        # Copy-on-write branches only store the messages added after the fork.
+        # The first fork_offset messages are resolved through the parent.
+        self.fork_offset: Optional[int] = None
+        self.fork_tokens = 0
+        self._parent: Optional[Session] = None
+        # Totals of USAGE_KEYS over every response in this session
+        self.usage: Dict[str, int] = {}
+        self._set_messages([])
         self.created_at = datetime.now().isoformat()
         if id:
             self.load_history()
         else:
-            self.history.append(Message(role="system", content=prompts.chat))
+            self._set_messages([Message(role="system", content=prompts.chat)])
+            self.storage.created(self.id)
+        Session._open[self.id] = self
 
-    def load_history(self) -> None:
-        if self.history_file.exists():
-            with open(self.history_file) as f:
-                data = json.load(f)
-                self.title = data.get("title", "Untitled")
-                self.branched_from = data.get("branched_from", "master")
-                self.settings = data.get("settings", "DEFAULT")
-                self.created_at = data.get("created_at", self.created_at)
-                self.history = [Message(**msg) for msg in data.get("history", [])]
+    @classmethod
+    def load(
+        cls,
+        id: str,
+        index: Optional[SessionIndex] = None,
+        search: Optional[SearchIndex] = None,
+    ) -> "Session":
+        "Return the in-memory session with this id, loading it if needed"
+        session = cls._open.get(id)
+        if session is None:
+            session = cls(id, index, search)
+        return session
 
-    def save_history(self) -> None:
-        data = {
+    @classmethod
+    def forget(cls, id: str) -> None:
+        "Drop a deleted session from memory"
+        cls._open.pop(id, None)
+
+    def _set_messages(self, messages: List[Message]) -> None:
+        self.messages = messages
+        # Running total, kept up to date by add_message
+        self.token_count = self.fork_tokens + sum(msg.tokens for msg in messages)
+
+    @property
+    def history(self) -> Sequence[Message]:
+        "The full conversation, including messages inherited from the parent"
+        if self.fork_offset is None:
+            return self.messages
+        return HistoryView(self.parent().history, self.fork_offset, self.messages)
+
+    def parent(self) -> "Session":
+        if self._parent is None:
+            self._parent = Session.load(self.branched_from, self.index, self.search)
+        return self._parent
+
+    def message_count(self) -> int:
+        return (self.fork_offset or 0) + len(self.messages)
+
+    def branch(self) -> "Session":
+        "Create a branch that shares this session's history up to now"
+        # The branch reads its history from this session's stored copy
+        if not self.storage.exists(self.id):
+            self.save_history()
+
+        branch = Session(index=self.index, search=self.search)
+        branch.title = self.title + " (branch)"
+        branch.branched_from = self.id
+        branch.settings = self.settings
+        branch.fork_offset = self.message_count()
+        branch.fork_tokens = self.get_token_count()
+        branch._parent = self
+        branch._set_messages([])
+        branch.save_history()
+        return branch
+
+    def detach(self) -> None:
+        "Copy the inherited messages into this branch so it no longer needs its parent"
+        if self.fork_offset is None:
+            return
+        messages = list(self.history)
+        # The inherited messages are now this session's own
+        if self.search:
+            self.search.add_many(
+                self.id,
+                [(msg.role, msg.content) for msg in messages[: self.fork_offset]],
+            )
+        self.fork_offset = None
+        self.fork_tokens = 0
+        self._parent = None
+        self._set_messages(messages)
+        self.compact()
+        if self.index:
+            self.index.update(self)
+
+    def metadata(self) -> Dict[str, Any]:
+        metadata = {
             "title": self.title,
             "branched_from": self.branched_from,
             "settings": self.settings,
             "created_at": self.created_at,
-            "history": [asdict(msg) for msg in self.history],
         }
-        with open(self.history_file, "w") as f:
-            json.dump(data, f, indent=2)
+        if self.fork_offset is not None:
+            metadata["fork_offset"] = self.fork_offset
+            metadata["fork_tokens"] = self.fork_tokens
+        if self.usage:
+            metadata["usage"] = dict(self.usage)
+        return metadata
+
+    def model(self) -> str:
+        "Model of the session's settings, or an empty string if unknown"
+        if self.config_manager is None:
+            return ""
+        config = self.config_manager.get_config(self.settings)
+        return str(config["model"]) if config is not None else ""
+
+    def load_history(self) -> None:
+        stored = self.storage.load(self.id)
+        if stored is None:
+            return
+        data, messages = stored
+
+        self.title = data.get("title", "Untitled")
+        self.branched_from = data.get("branched_from", "master")
+        self.settings = data.get("settings", "DEFAULT")
+        self.created_at = data.get("created_at", self.created_at)
+        self.fork_offset = data.get("fork_offset")
+        self.fork_tokens = data.get("fork_tokens", 0)
+        self.usage = data.get("usage") or {}
+
+        # Count any messages stored without a token count in one batch
+        uncounted = [msg for msg in messages if not msg.get("tokens")]
+        if uncounted:
+            counts = Tokenizer.count_batch(
+                [msg["content"] for msg in uncounted], self.model()
+            )
+            for msg, tokens in zip(uncounted, counts):
+                msg["tokens"] = tokens
+
+        self._set_messages([Message.from_dict(msg) for msg in messages])
+
+    def save_history(self) -> None:
+        "Persist the session metadata, and the messages if it was never stored"
+        self.storage.save_metadata(self)
+        if self.index:
+            self.index.update(self)
+
+    def compact(self) -> None:
+        "Rewrite the stored session from memory"
+        self.storage.snapshot(self)
+
+    def add_message(self, role: str, content: str, model: str = "") -> None:
+        message = Message(
+            role=role, content=content, tokens=Tokenizer.count(content, model)
+        )
+        self.messages.append(message)
+        self.token_count += message.tokens
+        self.storage.append(self, message)
+        if self.index:
+            self.index.update(self)
+        if self.search:
+            self.search.add(self.id, role, content)
 
-    def add_message(self, role: str, content: str) -> None:
-        message = Message(role=role, content=content)
-        self.history.append(message)
+    def record_usage(self, usage: Dict[str, int]) -> None:
+        "Add a response's prompt and prompt cache token counts to the totals"
+        counts = {key: usage[key] for key in self.USAGE_KEYS if usage.get(key)}
+        if not counts:
+            return
+        for key, count in counts.items():
+            self.usage[key] = self.usage.get(key, 0) + count
         self.save_history()
 
-    def get_token_count(self):
-        return sum(msg.tokens for msg in self.history)
+    def get_token_count(self) -> int:
+        return self.token_count
@@ -1,4 +1,9 @@
 from .base import APIProvider
+from .transport import RETRY_STATUSES
+from .streaming import StreamEvent
+from config.manager import get_bool_option
+
+CACHE_CONTROL = {"type": "ephemeral"}
 
 
 class AnthropicAPI(APIProvider):
@@ -14,24 +19,69 @@ class AnthropicAPI(APIProvider):
             else:
                 stripped_messages.append({"role": msg.role, "content": msg.content})
 
+        system = system_msg
+        if get_bool_option(config, "prompt_cache"):
+            # Cache breakpoints on the system prompt and on the last turn
+            # before the new message. The next request finds this prefix and
+            # only pays full price for the newest turn.
+            # Empty text blocks are rejected, so without a system prompt
+            # it stays a plain string
+            if system_msg:
+                system = [
+                    {"type": "text", "text": system_msg, "cache_control": CACHE_CONTROL}
+                ]
+            if len(stripped_messages) > 1:
+                stable = stripped_messages[-2]
+                stable["content"] = [
+                    {
+                        "type": "text",
+                        "text": stable["content"],
+                        "cache_control": CACHE_CONTROL,
+                    }
+                ]
+
         return {
             "model": config["model"],
             "max_tokens": int(config["max_tokens"]),
             "temperature": 0,
             "messages": stripped_messages,
-            "system": system_msg,
+            "system": system,
             "stream": True,
         }
 
-    def send_request(self, prepared_request) -> str:
-        try:
-            response = self.sdk.messages.create(**prepared_request)
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            response = None
-        return response
-
-    def send(self, config, messages) -> str:
-        """Convenience method to prepare and send in one call"""
-        prepared_request = self.prepare_request(config, messages)
-        return self.send_request(prepared_request)
+    async def send_request(self, prepared_request):
+        return await self.sdk.messages.create(**prepared_request)
+
+    def is_retryable(self, error):
+        import anthropic
+
+        if isinstance(error, anthropic.APIStatusError):
+            return error.status_code in RETRY_STATUSES
+        return isinstance(error, anthropic.APIConnectionError)
+
+    def parse_chunk(self, chunk):
+        if chunk.type == "message_start":
+            # input_tokens only counts the part of the prompt after the
+            # last cache breakpoint
+            usage = chunk.message.usage
+            cache_creation = getattr(usage, "cache_creation_input_tokens", None) or 0
+            cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+            yield StreamEvent(
+                "usage",
+                usage={
+                    "prompt_tokens": usage.input_tokens + cache_creation + cache_read,
+                    "cache_creation_tokens": cache_creation,
+                    "cache_read_tokens": cache_read,
+                },
+            )
+        elif chunk.type == "message_delta":
+            yield StreamEvent(
+                "usage", usage={"completion_tokens": chunk.usage.output_tokens}
+            )
+        elif chunk.type == "content_block_delta":
+            # Only text deltas are shown; other delta types (e.g. tool input) are skipped
+            text = getattr(chunk.delta, "text", None)
+            if text:
+                yield StreamEvent("text", text)
+        elif chunk.type == "message_stop":
+            yield StreamEvent("stop")
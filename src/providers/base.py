@@ -1,15 +1,24 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, Iterator
+import asyncio
 import configparser
 from models.message import Message
 from sdk.manager import SDKManager
+from .ratelimit import RateLimiter, response_headers
+from .streaming import StreamEvent
+from .transport import TransportConfig
 
 
 class APIProvider(ABC):
     def __init__(self, config: configparser.ConfigParser):
+        self.transport = TransportConfig.from_config(config)
         self.sdk = SDKManager.get_sdk(
-            str(config["api_type"]), str(config["base_url"]), str(config["api_key"])
+            str(config["api_type"]),
+            str(config["base_url"]),
+            str(config["api_key"]),
+            self.transport,
         )
+        self.limiter = RateLimiter.get_limiter(config)
 
     @abstractmethod
     def prepare_request(
@@ -19,6 +28,105 @@ class APIProvider(ABC):
         pass
 
     @abstractmethod
-    def send_request(self, prepared_request: Dict[str, Any]) -> str:
-        """Send request and return response"""
+    async def send_request(self, prepared_request: Dict[str, Any]) -> Any:
+        """Send request and return the provider's response stream"""
         pass
+
+    @abstractmethod
+    def parse_chunk(self, chunk: Any) -> Iterator[StreamEvent]:
+        """Translate one provider stream chunk into normalised events"""
+        pass
+
+    @abstractmethod
+    def is_retryable(self, error: Exception) -> bool:
+        """Whether a failed request is worth sending again"""
+        pass
+
+    async def connect(self, prepared_request: Dict[str, Any]) -> AsyncIterator[Any]:
+        """Send the request, retrying transient failures with backoff.
+
+        Yields a "retry" event before each retry, then the response stream.
+        Only the start of the response is retried: once text has been
+        streamed, retrying would repeat it.
+        """
+        attempt = 0
+        while True:
+            try:
+                response = await asyncio.wait_for(
+                    self.send_request(prepared_request),
+                    self.transport.first_byte_timeout,
+                )
+            except Exception as e:
+                await self.limiter.observe(response_headers(e))
+                retryable = isinstance(e, TimeoutError) or self.is_retryable(e)
+                if not retryable or attempt >= self.transport.max_retries:
+                    raise
+                delay = self.transport.backoff(attempt, e)
+                if getattr(e, "status_code", None) == 429:
+                    # Other requests to the endpoint, in any process, wait too
+                    await self.limiter.block(delay)
+                attempt += 1
+                yield StreamEvent(
+                    "retry", f"{type(e).__name__}, retry {attempt} in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+            else:
+                await self.limiter.observe(response_headers(response))
+                yield response
+                return
+
+    async def stream(
+        self, prepared_request: Dict[str, Any], prompt_tokens: int = 0
+    ) -> AsyncIterator[StreamEvent]:
+        """Send a prepared request and yield normalised events until the stop event.
+
+        prompt_tokens is the local estimate of the prompt, counted against the
+        tokens-per-minute limit together with max_tokens.
+        """
+        estimated = prompt_tokens + int(prepared_request.get("max_tokens", 0))
+        waited = await self.limiter.acquire(estimated)
+        if waited:
+            yield StreamEvent("queued", seconds=waited)
+
+        response = None
+        usage: Dict[str, int] = {}
+        async for item in self.connect(prepared_request):
+            if isinstance(item, StreamEvent):
+                yield item
+            else:
+                response = item
+        try:
+            async for chunk in response:
+                for event in self.parse_chunk(chunk):
+                    if event.usage:
+                        usage.update(event.usage)
+                    yield event
+                    if event.type == "stop":
+                        return
+        finally:
+            await response.close()
+            if usage:
+                await self.limiter.settle(
+                    estimated,
+                    usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0),
+                )
+
+    async def warmup(self) -> None:
+        """Open a connection to the provider ahead of the first request.
+
+        The connection (including its TLS handshake) stays in the shared
+        pool, so the first message doesn't pay for it.
+        """
+        http_client = SDKManager.get_http_client(self.transport)
+        try:
+            await http_client.head(str(self.sdk.base_url))
+        except Exception:
+            # Best effort, the real request will report any problem
+            pass
+
+    def send(
+        self, config: configparser.ConfigParser, messages: List[Message]
+    ) -> AsyncIterator[StreamEvent]:
+        """Convenience method to prepare and send in one call"""
+        prepared_request = self.prepare_request(config, messages)
+        return self.stream(prepared_request, sum(msg.tokens for msg in messages))
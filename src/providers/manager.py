@@ -3,6 +3,8 @@ from .base import APIProvider
 from .openai_provider import OpenAIAPI
 from .anthropic_provider import AnthropicAPI
 from typing import Tuple, Dict
+from .ratelimit import RateLimiter
+from .transport import TransportConfig
 
 PROVIDERS = {"openai": OpenAIAPI, "anthropic": AnthropicAPI}
 
@@ -12,7 +14,15 @@ class ProviderManager:
 
     @classmethod
     def get_provider(cls, config: configparser.ConfigParser) -> APIProvider:
-        key = (str(config["api_type"]), str(config["base_url"]), str(config["api_key"]))
+        # Profiles on the same endpoint share a provider only if their
+        # timeouts, retries, pool and rate limits match too
+        key = (
+            str(config["api_type"]),
+            str(config["base_url"]),
+            str(config["api_key"]),
+            TransportConfig.from_config(config),
+            RateLimiter.configured(config),
+        )
         if key not in cls._instances:
             provider_class = PROVIDERS.get(str(config["api_type"]))
             if provider_class is None:
@@ -1,4 +1,7 @@
 from .base import APIProvider
+from .transport import RETRY_STATUSES
+from .streaming import StreamEvent
+from config.manager import get_bool_option
 
 
 class OpenAIAPI(APIProvider):
@@ -8,23 +11,44 @@ class OpenAIAPI(APIProvider):
         for msg in messages:
             stripped_messages.append({"role": msg.role, "content": msg.content})
 
-        return {
+        request = {
             "model": config["model"],
             "max_tokens": int(config["max_tokens"]),
             "temperature": 0,
             "messages": stripped_messages,
             "stream": True,
         }
+        # Ask for token usage in the final chunk. Some OpenAI-compatible
+        # servers reject stream_options, so this can be turned off
+        if get_bool_option(config, "stream_usage"):
+            request["stream_options"] = {"include_usage": True}
+        return request
 
-    def send_request(self, prepared_request):
-        try:
-            response = self.sdk.chat.completions.create(**prepared_request)
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            response = None
-        return response
+    async def send_request(self, prepared_request):
+        return await self.sdk.chat.completions.create(**prepared_request)
 
-    def send(self, config, messages) -> str:
-        """Convenience method to prepare and send in one call"""
-        prepared_request = self.prepare_request(config, messages)
-        return self.send_request(prepared_request)
+    def is_retryable(self, error):
+        import openai
+
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in RETRY_STATUSES
+        return isinstance(error, openai.APIConnectionError)
+
+    def parse_chunk(self, chunk):
+        # The usage chunk comes after the finish reason, so the stream is
+        # read until the server ends it
+        if chunk.usage:
+            usage = {
+                "prompt_tokens": chunk.usage.prompt_tokens,
+                "completion_tokens": chunk.usage.completion_tokens,
+            }
+            # OpenAI caches long prompt prefixes on its own and reports the hits
+            details = getattr(chunk.usage, "prompt_tokens_details", None)
+            if details and details.cached_tokens:
+                usage["cache_read_tokens"] = details.cached_tokens
+            yield StreamEvent("usage", usage=usage)
+        if not chunk.choices:
+            return
+        choice = chunk.choices[0]
+        if choice.delta and choice.delta.content:
+            yield StreamEvent("text", choice.delta.content)
@@ -0,0 +1,280 @@
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, Mapping, Optional, Tuple
+import asyncio
+import configparser
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: buckets are only shared within the process
+    fcntl = None
+
+# Limit and remaining-count headers, per bucket, for each provider
+LIMIT_HEADERS = {
+    "requests": [
+        ("x-ratelimit-limit-requests", "x-ratelimit-remaining-requests"),
+        (
+            "anthropic-ratelimit-requests-limit",
+            "anthropic-ratelimit-requests-remaining",
+        ),
+    ],
+    "tokens": [
+        ("x-ratelimit-limit-tokens", "x-ratelimit-remaining-tokens"),
+        ("anthropic-ratelimit-tokens-limit", "anthropic-ratelimit-tokens-remaining"),
+    ],
+}
+RESET_HEADERS = {
+    "requests": ["x-ratelimit-reset-requests", "anthropic-ratelimit-requests-reset"],
+    "tokens": ["x-ratelimit-reset-tokens", "anthropic-ratelimit-tokens-reset"],
+}
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+
+
+def parse_reset(value: str) -> Optional[float]:
+    """Seconds until a rate limit resets.
+
+    OpenAI sends durations such as "1s" or "6m0s", Anthropic an RFC 3339 time.
+    """
+    parts = DURATION_PART.findall(value)
+    if parts and "".join(number + unit for number, unit in parts) == value:
+        return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+    try:
+        reset = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return max(0.0, reset.timestamp() - time.time())
+
+
+class SharedBuckets:
+    """Bucket levels shared by every ellm process through a small JSON file.
+
+    The file is read and rewritten under an exclusive lock on a sibling lock
+    file, so each check-and-take is atomic across processes.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock_path = path.with_suffix(".lock")
+        self._lock = threading.Lock()
+
+    def read(self) -> Dict[str, Dict[str, float]]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def write(self, state: Dict[str, Dict[str, float]]) -> None:
+        temp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.path)
+
+    @contextmanager
+    def bucket(self, key: str) -> Iterator[Dict[str, float]]:
+        "The bucket for key, saved when the block exits without an error"
+        with self._lock:
+            self.path.parent.mkdir(exist_ok=True)
+            with open(self.lock_path, "a") as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    state = self.read()
+                    yield state.setdefault(key, {})
+                    self.write(state)
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class RateLimiter:
+    """Token buckets for requests and tokens per minute, per provider endpoint.
+
+    One limiter is kept per endpoint and configured limits, so profiles with
+    different limits on the same endpoint each apply their own. The bucket
+    levels are kept per endpoint in ~/.ellm, so those limiters and
+    concurrent ellm processes all draw from the same buckets. Limits come from the profile's
+    requests_per_minute and tokens_per_minute, or, when those are unset, from
+    the provider's rate limit headers. Remaining counts in those headers also
+    bring the buckets down to what the provider has actually seen, and a 429
+    blocks the endpoint until its retry-after passes. Requests that would go
+    over wait for the buckets to refill instead of failing.
+    """
+
+    _instances: Dict[Tuple, "RateLimiter"] = {}
+
+    # Longest single sleep, so changes from other processes are noticed
+    MAX_SLEEP = 5.0
+
+    def __init__(
+        self,
+        key: str,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        buckets: SharedBuckets,
+    ):
+        self.key = key
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.buckets = buckets
+        # Whether the shared file needs to be consulted at all
+        self.active = bool(requests_per_minute or tokens_per_minute)
+
+    @staticmethod
+    def configured(config: configparser.SectionProxy) -> Tuple[float, float]:
+        "The profile's requests and tokens per minute"
+        from config.manager import get_number_option
+
+        return (
+            get_number_option(config, "requests_per_minute"),
+            get_number_option(config, "tokens_per_minute"),
+        )
+
+    @classmethod
+    def get_limiter(cls, config: configparser.SectionProxy) -> "RateLimiter":
+        from utils.constants import RATE_LIMIT_PATH
+
+        endpoint = (
+            str(config["api_type"]),
+            str(config["base_url"]),
+            str(config["api_key"]),
+        )
+        limits = cls.configured(config)
+        key = (*endpoint, *limits)
+        if key not in cls._instances:
+            # The API key is hashed so it is never written to disk
+            digest = hashlib.sha256("\n".join(endpoint).encode()).hexdigest()[:16]
+            cls._instances[key] = cls(digest, *limits, SharedBuckets(RATE_LIMIT_PATH))
+        return cls._instances[key]
+
+    def limits(self, bucket: Dict[str, float]) -> Tuple[float, float]:
+        "Configured limits, or those learned from the provider"
+        return (
+            self.requests_per_minute or bucket.get("requests_limit", 0.0),
+            self.tokens_per_minute or bucket.get("tokens_limit", 0.0),
+        )
+
+    def refill(self, bucket: Dict[str, float], now: float) -> None:
+        elapsed = max(0.0, now - bucket.get("updated", now))
+        for name, limit in zip(("requests", "tokens"), self.limits(bucket)):
+            if limit:
+                level = bucket.get(name, limit) + elapsed * limit / 60
+                bucket[name] = min(limit, level)
+        bucket["updated"] = now
+
+    def take(self, tokens: int) -> float:
+        "Take a request from the buckets, or return the seconds until it fits"
+        with self.buckets.bucket(self.key) as bucket:
+            now = time.time()
+            self.refill(bucket, now)
+            requests_limit, tokens_limit = self.limits(bucket)
+            # A request larger than the whole bucket goes once it is full
+            cost = min(tokens, tokens_limit)
+
+            wait = bucket.get("blocked_until", 0.0) - now
+            if requests_limit and bucket["requests"] < 1:
+                wait = max(wait, (1 - bucket["requests"]) * 60 / requests_limit)
+            if tokens_limit and bucket["tokens"] < cost:
+                wait = max(wait, (cost - bucket["tokens"]) * 60 / tokens_limit)
+            if wait <= 0:
+                if requests_limit:
+                    bucket["requests"] -= 1
+                if tokens_limit:
+                    bucket["tokens"] -= cost
+            return wait
+
+    async def acquire(self, tokens: int = 0) -> float:
+        """Wait until a request of about this many tokens fits in the buckets.
+
+        Returns the seconds spent waiting. The shared file is locked and
+        rewritten on a worker thread, as are the updates below, so streams
+        on the event loop keep going while another process holds the lock.
+        """
+        if not self.active:
+            return 0.0
+        started = time.time()
+        while True:
+            wait = await asyncio.to_thread(self.take, tokens)
+            if wait <= 0:
+                return time.time() - started
+            await asyncio.sleep(min(wait, self.MAX_SLEEP))
+
+    def refund(self, tokens: int) -> None:
+        with self.buckets.bucket(self.key) as bucket:
+            tokens_limit = self.limits(bucket)[1]
+            if tokens_limit and "tokens" in bucket:
+                bucket["tokens"] = min(tokens_limit, bucket["tokens"] + tokens)
+
+    async def settle(self, estimated: int, used: int) -> None:
+        "Return tokens taken by acquire that the response didn't use"
+        if not self.active or estimated <= used:
+            return
+        await asyncio.to_thread(self.refund, estimated - used)
+
+    async def observe(self, headers: Optional[Mapping[str, str]]) -> None:
+        "Adjust the buckets to the rate limit headers of a response"
+        if not headers:
+            return
+        seen: Dict[str, Tuple[float, float, Optional[float]]] = {}
+        for name, pairs in LIMIT_HEADERS.items():
+            for limit_header, remaining_header in pairs:
+                limit = headers.get(limit_header)
+                remaining = headers.get(remaining_header)
+                if limit is None or remaining is None:
+                    continue
+                try:
+                    limit_value, remaining_value = float(limit), float(remaining)
+                except ValueError:
+                    continue
+                reset = None
+                for reset_header in RESET_HEADERS[name]:
+                    if headers.get(reset_header):
+                        reset = parse_reset(headers[reset_header])
+                        break
+                seen[name] = (limit_value, remaining_value, reset)
+                break
+        if not seen:
+            return
+
+        self.active = True
+        await asyncio.to_thread(self.apply, seen)
+
+    def apply(self, seen: Dict[str, Tuple[float, float, Optional[float]]]) -> None:
+        "Set the buckets to the limits and remaining counts seen in headers"
+        with self.buckets.bucket(self.key) as bucket:
+            now = time.time()
+            for name, (limit, remaining, reset) in seen.items():
+                bucket[f"{name}_limit"] = limit
+            self.refill(bucket, now)
+            for name, (limit, remaining, reset) in seen.items():
+                if name in bucket:
+                    # Other clients of the same key may have used some
+                    bucket[name] = min(bucket[name], remaining)
+                if remaining < 1 and reset:
+                    bucket["blocked_until"] = max(
+                        bucket.get("blocked_until", 0.0), now + reset
+                    )
+
+    async def block(self, seconds: float) -> None:
+        "Hold every request to the endpoint for a while, after a 429"
+        self.active = True
+        until = time.time() + seconds
+        await asyncio.to_thread(self.hold, until)
+
+    def hold(self, until: float) -> None:
+        with self.buckets.bucket(self.key) as bucket:
+            bucket["blocked_until"] = max(bucket.get("blocked_until", 0.0), until)
+
+
+def response_headers(response: Any) -> Optional[Mapping[str, str]]:
+    "HTTP headers of an SDK stream or error, when it has any"
+    http_response = getattr(response, "response", None)
+    return getattr(http_response, "headers", None)
@@ -0,0 +1,100 @@
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+import asyncio
+import time
+
+
+@dataclass
+class StreamEvent:
+    "A provider-independent streaming event"
+
+    type: str  # "text", "usage", "retry", "queued" or "stop"
+    text: str = ""
+    # Token counts reported by the provider, for "usage" events
+    usage: Optional[Dict[str, int]] = None
+    # Time spent waiting for the rate limiter, for "queued" events
+    seconds: float = 0.0
+
+
+@dataclass
+class StreamResult:
+    parts: List[str] = field(default_factory=list)
+    # Seconds from sending the request to the first text delta
+    ttft: Optional[float] = None
+    # Seconds from sending the request to the end of the stream
+    duration: float = 0.0
+    # Number of times the request was retried before streaming
+    retries: int = 0
+    # Seconds spent waiting for the rate limiter before sending
+    queued: float = 0.0
+    # Token counts reported by the provider (e.g. prompt_tokens)
+    usage: Dict[str, int] = field(default_factory=dict)
+    cancelled: bool = False
+    error: Optional[Exception] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+async def collect(
+    events: AsyncIterator[StreamEvent], on_text: Callable[[str], None]
+) -> StreamResult:
+    """Consume a stream of events, passing text deltas to on_text.
+
+    Cancellation and provider errors end the stream early but still return
+    whatever text arrived before them.
+    """
+    result = StreamResult()
+    started = time.perf_counter()
+    try:
+        async for event in events:
+            if event.type == "text":
+                if result.ttft is None:
+                    result.ttft = time.perf_counter() - started
+                result.parts.append(event.text)
+                on_text(event.text)
+            elif event.type == "usage" and event.usage:
+                result.usage.update(event.usage)
+            elif event.type == "retry":
+                result.retries += 1
+            elif event.type == "queued":
+                # Timings start when the request is actually sent
+                result.queued += event.seconds
+                started += event.seconds
+            elif event.type == "stop":
+                break
+    except asyncio.CancelledError:
+        result.cancelled = True
+    except Exception as e:
+        result.error = e
+    finally:
+        result.duration = time.perf_counter() - started
+        # Close the underlying HTTP stream when we stopped reading early
+        aclose = getattr(events, "aclose", None)
+        if aclose is not None:
+            await aclose()
+    return result
+
+
+async def collect_all(
+    streams: List[Tuple[AsyncIterator[StreamEvent], Callable[[str], None]]],
+) -> List[StreamResult]:
+    """Collect several streams concurrently, in the order given.
+
+    Cancelling stops every stream and still returns their partial results.
+    """
+    tasks = [
+        asyncio.ensure_future(collect(events, on_text)) for events, on_text in streams
+    ]
+    try:
+        await asyncio.wait(tasks)
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        await asyncio.wait(tasks)
+    # A task cancelled before it started never ran collect
+    return [
+        StreamResult(cancelled=True) if task.cancelled() else task.result()
+        for task in tasks
+    ]
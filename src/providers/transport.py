@@ -0,0 +1,97 @@
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Any, Optional
+import configparser
+import random
+import time
+from config.manager import get_bool_option, get_number_option
+
+# Statuses worth retrying: timeouts, conflicts, rate limits and server errors
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+@dataclass(frozen=True)
+class TransportConfig:
+    "HTTP timeouts, retry policy and connection pool limits of a profile"
+
+    connect_timeout: float = 10.0
+    read_timeout: float = 600.0
+    # Time allowed for the provider to start responding
+    first_byte_timeout: float = 120.0
+    max_retries: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 30.0
+    pool_max_connections: int = 20
+    pool_max_keepalive: int = 10
+    keepalive_expiry: float = 60.0
+    warmup: bool = False
+
+    @classmethod
+    def from_config(cls, config: configparser.ConfigParser) -> "TransportConfig":
+        return cls(
+            connect_timeout=get_number_option(config, "connect_timeout"),
+            read_timeout=get_number_option(config, "read_timeout"),
+            first_byte_timeout=get_number_option(config, "first_byte_timeout"),
+            max_retries=get_number_option(config, "max_retries", int),
+            backoff_base=get_number_option(config, "backoff_base"),
+            backoff_max=get_number_option(config, "backoff_max"),
+            pool_max_connections=get_number_option(config, "pool_max_connections", int),
+            pool_max_keepalive=get_number_option(config, "pool_max_keepalive", int),
+            keepalive_expiry=get_number_option(config, "keepalive_expiry"),
+            warmup=get_bool_option(config, "warmup"),
+        )
+
+    def timeout(self) -> Any:
+        import httpx
+
+        return httpx.Timeout(
+            self.read_timeout, connect=self.connect_timeout, pool=self.connect_timeout
+        )
+
+    def limits(self) -> Any:
+        import httpx
+
+        return httpx.Limits(
+            max_connections=self.pool_max_connections,
+            max_keepalive_connections=self.pool_max_keepalive,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def backoff(self, attempt: int, error: Optional[Exception] = None) -> float:
+        """Seconds to wait before retry number attempt (starting at 0).
+
+        A retry-after from the provider wins. Otherwise the delay is drawn
+        uniformly up to an exponentially growing cap (full jitter).
+        """
+        retry_after = parse_retry_after(error)
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+
+def parse_retry_after(error: Optional[Exception]) -> Optional[float]:
+    "Read the retry-after(-ms) header of a failed response, in seconds"
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    # Otherwise an HTTP date
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -1,21 +1,50 @@
 from typing import Dict, Tuple, Any
-from openai import OpenAI
-from anthropic import Anthropic
+from providers.transport import TransportConfig
 
 
 class SDKManager:
     _instances: Dict[Tuple, Any] = {}
+    # One HTTP connection pool per transport configuration, shared by every
+    # SDK client that uses it
+    _http_clients: Dict[TransportConfig, Any] = {}
 
     @classmethod
-    def get_sdk(cls, api_type: str, base_url: str, api_key: str) -> Any:
-        key = (api_type, base_url, api_key)
+    def get_http_client(cls, transport: TransportConfig) -> Any:
+        if transport not in cls._http_clients:
+            import httpx
+
+            cls._http_clients[transport] = httpx.AsyncClient(
+                timeout=transport.timeout(), limits=transport.limits()
+            )
+        return cls._http_clients[transport]
+
+    @classmethod
+    def get_sdk(
+        cls,
+        api_type: str,
+        base_url: str,
+        api_key: str,
+        transport: TransportConfig = TransportConfig(),
+    ) -> Any:
+        key = (api_type, base_url, api_key, transport)
         if key not in cls._instances:
+            # Retries are handled by the provider so they can honour our
+            # backoff policy, the SDK's own retries are disabled
+            options = {
+                "base_url": base_url if base_url != "NOTSET" else None,
+                "api_key": api_key,
+                "timeout": transport.timeout(),
+                "max_retries": 0,
+                "http_client": cls.get_http_client(transport),
+            }
+            # SDKs are imported on first use so that commands which never talk
+            # to a provider (e.g. `ellm config`) don't pay for loading them
             if api_type == "openai":
-                cls._instances[key] = OpenAI(
-                    base_url=base_url if base_url != "NOTSET" else None, api_key=api_key
-                )
+                from openai import AsyncOpenAI
+
+                cls._instances[key] = AsyncOpenAI(**options)
             elif api_type == "anthropic":
-                cls._instances[key] = Anthropic(
-                    base_url=base_url if base_url != "NOTSET" else None, api_key=api_key
-                )
+                from anthropic import AsyncAnthropic
+
+                cls._instances[key] = AsyncAnthropic(**options)
         return cls._instances[key]
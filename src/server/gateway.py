@@ -0,0 +1,551 @@
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, TextIO, Tuple
+from uuid import uuid4
+import asyncio
+import configparser
+import json
+import time
+from config.manager import ConfigManager
+from models.context import context_window
+from models.message import Message, count_tokens
+from models.session import Session
+from providers.manager import ProviderManager
+from providers.streaming import StreamResult, collect
+from sdk.manager import SDKManager
+from server.http import (
+    ChunkedResponse,
+    HTTPError,
+    Request,
+    read_request,
+    send_error,
+    send_json,
+)
+from storage.index import SessionIndex
+from storage.response_cache import ResponseCache
+from storage.search import SearchIndex
+from utils.constants import CACHE_PATH, METRICS_PATH
+from utils.metrics import MetricsLog, RequestMetrics, percentile
+
+ROLES = ("system", "user", "assistant")
+
+
+def message_text(content: Any) -> str:
+    "Text of an OpenAI message content, a string or a list of text parts"
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        parts = []
+        for part in content:
+            if not isinstance(part, dict) or part.get("type") != "text":
+                raise HTTPError(400, "Only text message content is supported")
+            parts.append(str(part.get("text", "")))
+        return "".join(parts)
+    raise HTTPError(400, "Message content must be a string or a list of text parts")
+
+
+def parse_messages(messages: Any) -> List[Tuple[str, str]]:
+    if not isinstance(messages, list) or not messages:
+        raise HTTPError(400, "messages must be a non-empty list")
+    parsed = []
+    for message in messages:
+        role = message.get("role") if isinstance(message, dict) else None
+        if role not in ROLES:
+            raise HTTPError(
+                400, f"Unsupported message role: {role}. Use one of: {', '.join(ROLES)}"
+            )
+        parsed.append((role, message_text(message.get("content", ""))))
+    return parsed
+
+
+def upstream_error(error: Exception) -> HTTPError:
+    "Pass on the provider's client errors, report anything else as a bad gateway"
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int) and 400 <= status < 500:
+        return HTTPError(status, str(error), "upstream_error")
+    return HTTPError(502, f"{type(error).__name__}: {error}", "upstream_error")
+
+
+class GatewayStats:
+    "Counters and recent timings for the health endpoint"
+
+    # Number of recent requests the percentiles are taken over
+    WINDOW = 1000
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests = 0
+        self.active = 0
+        self.errors = 0
+        # Completions per profile
+        self.completions: Dict[str, int] = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.ttfts: Deque[float] = deque(maxlen=self.WINDOW)
+        self.latencies: Deque[float] = deque(maxlen=self.WINDOW)
+
+    def record(self, metrics: RequestMetrics) -> None:
+        self.completions[metrics.settings] = (
+            self.completions.get(metrics.settings, 0) + 1
+        )
+        if metrics.error:
+            self.errors += 1
+            return
+        self.prompt_tokens += metrics.prompt_tokens
+        self.completion_tokens += metrics.completion_tokens
+        if metrics.ttft is not None and not metrics.cached:
+            self.ttfts.append(metrics.ttft)
+            self.latencies.append(metrics.latency)
+
+    def snapshot(self) -> Dict[str, Any]:
+        def pcts(values: Deque[float]) -> Dict[str, Optional[float]]:
+            return {
+                "p50": percentile(list(values), 50),
+                "p95": percentile(list(values), 95),
+            }
+
+        return {
+            "status": "ok",
+            "uptime": round(time.time() - self.started, 3),
+            "requests": self.requests,
+            "active": self.active,
+            "errors": self.errors,
+            "completions": self.completions,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "ttft": pcts(self.ttfts),
+            "latency": pcts(self.latencies),
+            "open_sessions": len(Session._open),
+            "upstream_pools": len(SDKManager._http_clients),
+        }
+
+
+class Gateway:
+    """OpenAI-compatible HTTP gateway in front of the configured profiles.
+
+    POST /v1/chat/completions is routed to the profile named by the request's
+    model (or to the first profile using that model), and sent through the
+    same ProviderManager, connection pools, rate limiters and response cache
+    as the CLI, so every client of the gateway shares them. A request that
+    names an ellm "session" sends its last user message with the session's
+    history as context, and the turn is saved to the session. GET /health
+    reports counters and recent latencies, GET /v1/models lists the profiles.
+    """
+
+    # Seconds an idle keep-alive connection stays open
+    KEEPALIVE_TIMEOUT = 75
+
+    def __init__(
+        self,
+        config_manager: ConfigManager,
+        index: SessionIndex,
+        output: TextIO,
+        search_index: Optional[SearchIndex] = None,
+    ):
+        self.config_manager = config_manager
+        self.index = index
+        self.output = output
+        self.search_index = search_index
+        self.stats = GatewayStats()
+        self.metrics = MetricsLog(METRICS_PATH)
+        self.response_cache = ResponseCache(CACHE_PATH)
+        # Turns in the same session must not interleave
+        self.session_locks: Dict[str, asyncio.Lock] = {}
+
+    async def serve(self, host: str, port: int) -> asyncio.Server:
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    def log(self, request: Request, status: int, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        self.output.write(
+            f"{request.method} {request.path} {status} {elapsed * 1000:.0f}ms\n"
+        )
+        self.output.flush()
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(
+                        read_request(reader), self.KEEPALIVE_TIMEOUT
+                    )
+                except HTTPError as e:
+                    await send_error(writer, e, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                await self.dispatch(request, writer)
+                if not request.keep_alive:
+                    break
+        except (ConnectionError, TimeoutError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, request: Request, writer: asyncio.StreamWriter) -> None:
+        started = time.perf_counter()
+        self.stats.requests += 1
+        self.stats.active += 1
+        status = 200
+        try:
+            if request.path == "/health" and request.method == "GET":
+                await send_json(writer, 200, self.stats.snapshot(), request.keep_alive)
+            elif request.path == "/v1/models" and request.method == "GET":
+                await send_json(writer, 200, self.models(), request.keep_alive)
+            elif request.path == "/v1/chat/completions" and request.method == "POST":
+                status = await self.chat_completions(request, writer)
+            else:
+                raise HTTPError(404, f"No route for {request.method} {request.path}")
+        except HTTPError as e:
+            status = e.status
+            await send_error(writer, e, request.keep_alive)
+        except ConnectionError:
+            raise
+        except Exception as e:
+            status = 500
+            await send_error(
+                writer, HTTPError(500, str(e), "server_error"), request.keep_alive
+            )
+        finally:
+            self.stats.active -= 1
+            self.log(request, status, started)
+
+    def models(self) -> Dict[str, Any]:
+        return {
+            "object": "list",
+            "data": [
+                {
+                    "id": name,
+                    "object": "model",
+                    "owned_by": "ellm",
+                    "model": self.config_manager.configs[name]["model"],
+                }
+                for name in self.config_manager.get_config_names()
+            ],
+        }
+
+    def resolve_settings(self, model: Optional[str], session: Optional[Session]) -> str:
+        "A profile name, or the first profile using the model"
+        if not model:
+            return session.settings if session else "DEFAULT"
+        if model in self.config_manager.configs:
+            return model
+        for name in self.config_manager.get_config_names():
+            if self.config_manager.configs[name]["model"] == model:
+                return name
+        raise HTTPError(404, f"No settings or model named {model}", "model_not_found")
+
+    def load_session(self, session_id: str) -> Optional[Session]:
+        # Sessions created by other ellm processes since startup aren't in
+        # the index yet
+        if session_id not in self.index and not Session.storage.exists(session_id):
+            return None
+        return Session.load(session_id, self.index, self.search_index)
+
+    async def get_session(self, session_id: str) -> Session:
+        # Loading can mean decompressing an archived session, so it runs on
+        # a worker thread like the other disk access below, and streams on
+        # the loop keep going
+        session = await asyncio.to_thread(self.load_session, session_id)
+        if session is None:
+            raise HTTPError(404, f"No session found with ID: {session_id}")
+        self.session_locks.setdefault(session_id, asyncio.Lock())
+        return session
+
+    async def chat_completions(
+        self, request: Request, writer: asyncio.StreamWriter
+    ) -> int:
+        body = request.json()
+        if not isinstance(body, dict):
+            raise HTTPError(400, "The request body must be a JSON object")
+        messages = parse_messages(body.get("messages"))
+
+        session_id = body.get("session") or request.headers.get("x-ellm-session")
+        session = await self.get_session(str(session_id)) if session_id else None
+        settings = self.resolve_settings(body.get("model"), session)
+        config = self.config_manager.get_config(settings)
+        if config["api_key"] == "NOTSET" or config["model"] == "NOTSET":
+            raise HTTPError(
+                400, f"Model and api key are required for settings: {settings}"
+            )
+
+        if session:
+            if messages[-1][0] != "user":
+                raise HTTPError(
+                    400, "With a session, the last message must be from the user"
+                )
+            async with self.session_locks[session.id]:
+                return await self.complete(
+                    request, writer, body, settings, config, messages[-1:], session
+                )
+        return await self.complete(
+            request, writer, body, settings, config, messages, None
+        )
+
+    async def complete(
+        self,
+        request: Request,
+        writer: asyncio.StreamWriter,
+        body: Dict[str, Any],
+        settings: str,
+        config: configparser.SectionProxy,
+        messages: List[Tuple[str, str]],
+        session: Optional[Session],
+    ) -> int:
+        try:
+            provider = ProviderManager.get_provider(config)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        model = str(config["model"])
+
+        if session:
+            prompt = messages[0][1]
+            user_message = Message(
+                role="user", content=prompt, tokens=count_tokens(prompt, model)
+            )
+            try:
+                window = context_window(self.config_manager, settings, session.id)
+            except ValueError as e:
+                raise HTTPError(500, f"{e}. Check settings: {settings}", "server_error")
+            context = window.build(
+                session.history, user_message, session.get_token_count()
+            )
+            context_messages, prompt_tokens = context.messages, context.tokens
+        else:
+            context_messages = [
+                Message(role=role, content=text, tokens=count_tokens(text, model))
+                for role, text in messages
+            ]
+            prompt_tokens = sum(msg.tokens for msg in context_messages)
+
+        prepared_request = provider.prepare_request(config, context_messages)
+        # The client's own limits win over the profile's
+        max_tokens = body.get("max_completion_tokens") or body.get("max_tokens")
+        if max_tokens:
+            if not isinstance(max_tokens, int) or max_tokens <= 0:
+                raise HTTPError(400, "max_tokens must be a positive integer")
+            prepared_request["max_tokens"] = max_tokens
+        if body.get("temperature") is not None:
+            prepared_request["temperature"] = body["temperature"]
+
+        use_cache = self.config_manager.get_bool_option(settings, "cache")
+        cached = None
+        if use_cache:
+            cache_key = ResponseCache.key(
+                str(config["api_type"]), str(config["base_url"]), prepared_request
+            )
+            max_age = (
+                int(self.config_manager.get_option(settings, "cache_max_age_days"))
+                * 86400
+            )
+            cached = await asyncio.to_thread(
+                self.response_cache.get, cache_key, max_age
+            )
+        if cached is not None:
+            events = ResponseCache.replay(cached)
+        else:
+            events = provider.stream(prepared_request, prompt_tokens)
+
+        completion_id = f"chatcmpl-{uuid4().hex}"
+        created = int(time.time())
+        if body.get("stream"):
+            include_usage = bool(
+                (body.get("stream_options") or {}).get("include_usage")
+            )
+            result, status = await self.stream(
+                writer,
+                events,
+                completion_id,
+                created,
+                model,
+                include_usage,
+                prompt_tokens,
+            )
+        else:
+            result = await collect(events, lambda _: None)
+            status = 200
+            if result.error:
+                error = upstream_error(result.error)
+                status = error.status
+                await send_error(writer, error, request.keep_alive)
+            else:
+                await send_json(
+                    writer,
+                    200,
+                    self.completion(
+                        completion_id, created, model, result, prompt_tokens, session
+                    ),
+                    request.keep_alive,
+                )
+
+        # Like the CLI, a response cut short keeps the text that arrived
+        if session and result.parts and not result.error:
+            await asyncio.to_thread(
+                self.save_turn, session, messages[0][1], result, model
+            )
+        if use_cache and cached is None and not result.error and not result.cancelled:
+            max_bytes = (
+                int(self.config_manager.get_option(settings, "cache_max_mb"))
+                * 1024
+                * 1024
+            )
+            await asyncio.to_thread(
+                self.response_cache.put, cache_key, result.parts, max_bytes, max_age
+            )
+        await self.record_metrics(
+            settings, model, result, prompt_tokens, cached is not None
+        )
+        return status
+
+    @staticmethod
+    def save_turn(
+        session: Session, prompt: str, result: StreamResult, model: str
+    ) -> None:
+        "Add the turn to the session, its index entry and the search index"
+        session.add_message("user", prompt, model)
+        session.add_message("assistant", result.text, model)
+        session.record_usage(result.usage)
+
+    @staticmethod
+    def usage(result: StreamResult, prompt_tokens: int, model: str) -> Dict[str, int]:
+        # token counts reported by the provider are preferred over local ones
+        prompt = result.usage.get("prompt_tokens", prompt_tokens)
+        completion = result.usage.get(
+            "completion_tokens", count_tokens(result.text, model)
+        )
+        return {
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "total_tokens": prompt + completion,
+        }
+
+    def completion(
+        self,
+        completion_id: str,
+        created: int,
+        model: str,
+        result: StreamResult,
+        prompt_tokens: int,
+        session: Optional[Session],
+    ) -> Dict[str, Any]:
+        response = {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": result.text},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": self.usage(result, prompt_tokens, model),
+        }
+        if session:
+            response["session"] = session.id
+        return response
+
+    async def stream(
+        self,
+        writer: asyncio.StreamWriter,
+        events,
+        completion_id: str,
+        created: int,
+        model: str,
+        include_usage: bool,
+        prompt_tokens: int,
+    ) -> Tuple[StreamResult, int]:
+        """Relay the provider's stream as chat.completion.chunk events.
+
+        The response only starts with the first text, so an upstream error
+        before it is still answered with an error status.
+        """
+        response = ChunkedResponse(writer, "text/event-stream")
+
+        def send(data: Any) -> None:
+            response.write(f"data: {json.dumps(data)}\n\n".encode())
+
+        def chunk(delta: Dict[str, str], finish_reason: Optional[str] = None):
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                ],
+            }
+
+        def on_text(text: str) -> None:
+            if response.started:
+                send(chunk({"content": text}))
+            else:
+                send(chunk({"role": "assistant", "content": text}))
+
+        async def drained(events):
+            # Wait for a slow client to take each chunk before reading the
+            # next, instead of buffering the whole response in the transport
+            async for event in events:
+                yield event
+                await writer.drain()
+
+        result = await collect(drained(events), on_text)
+        if isinstance(result.error, ConnectionError):
+            # The client went away, which cancels the generation
+            result.error = None
+            result.cancelled = True
+            return result, 499
+        if result.error and not response.started:
+            error = upstream_error(result.error)
+            await send_error(writer, error)
+            return result, error.status
+
+        try:
+            if result.error:
+                send(upstream_error(result.error).body())
+            else:
+                if not response.started:
+                    send(chunk({"role": "assistant", "content": ""}))
+                send(chunk({}, "stop"))
+                if include_usage:
+                    send(
+                        {
+                            **chunk({}),
+                            "choices": [],
+                            "usage": self.usage(result, prompt_tokens, model),
+                        }
+                    )
+            response.write(b"data: [DONE]\n\n")
+            await response.finish()
+        except ConnectionError:
+            return result, 499
+        return result, 200
+
+    async def record_metrics(
+        self,
+        settings: str,
+        model: str,
+        result: StreamResult,
+        prompt_tokens: int,
+        cached: bool,
+    ) -> None:
+        usage = self.usage(result, prompt_tokens, model)
+        metrics = RequestMetrics(
+            settings=settings,
+            model=model,
+            ttft=result.ttft,
+            latency=result.duration,
+            prompt_tokens=usage["prompt_tokens"],
+            completion_tokens=usage["completion_tokens"],
+            usage_source="provider" if result.usage else "local",
+            cache_creation_tokens=result.usage.get("cache_creation_tokens", 0),
+            cache_read_tokens=result.usage.get("cache_read_tokens", 0),
+            cached=cached,
+            cancelled=result.cancelled,
+            error=result.error is not None,
+            retries=result.retries,
+        )
+        self.stats.record(metrics)
+        await asyncio.to_thread(self.metrics.record, metrics)
@@ -0,0 +1,168 @@
+"""Just enough HTTP/1.1 on asyncio streams for the gateway.
+
+Requests are read whole (Content-Length or chunked bodies), responses are
+either a complete JSON body or a chunked stream. Connections are kept alive
+between requests unless the client asks otherwise.
+"""
+
+from dataclasses import dataclass
+from http import HTTPStatus
+from typing import Any, Dict, Optional
+import asyncio
+import json
+
+# Largest request body accepted, in bytes
+MAX_BODY = 32 * 1024 * 1024
+MAX_HEADERS = 100
+
+
+class HTTPError(Exception):
+    "An error answered with an OpenAI-style error body"
+
+    def __init__(
+        self, status: int, message: str, error_type: str = "invalid_request_error"
+    ):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.error_type = error_type
+
+    def body(self) -> Dict[str, Any]:
+        return {"error": {"message": self.message, "type": self.error_type}}
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    version: str
+    # Header names are lower case
+    headers: Dict[str, str]
+    body: bytes
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    def json(self) -> Any:
+        try:
+            return json.loads(self.body)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise HTTPError(400, f"Invalid JSON body: {e}")
+
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[Request]:
+    "The next request on the connection, or None once the client closed it"
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise HTTPError(431, "Too many headers")
+        name, sep, value = line.decode("latin-1").partition(":")
+        if not sep:
+            raise HTTPError(400, "Malformed header")
+        headers[name.strip().lower()] = value.strip()
+
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        body = await read_chunked(reader)
+    else:
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length")
+        if length > MAX_BODY:
+            raise HTTPError(413, "Request body too large")
+        body = await reader.readexactly(length) if length else b""
+
+    return Request(method, target.split("?", 1)[0], version, headers, body)
+
+
+async def read_chunked(reader: asyncio.StreamReader) -> bytes:
+    body = bytearray()
+    while True:
+        size_line = await reader.readline()
+        try:
+            size = int(size_line.split(b";", 1)[0], 16)
+        except ValueError:
+            raise HTTPError(400, "Malformed chunk")
+        if size == 0:
+            # Skip trailers
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            return bytes(body)
+        if len(body) + size > MAX_BODY:
+            raise HTTPError(413, "Request body too large")
+        body += await reader.readexactly(size)
+        await reader.readexactly(2)
+
+
+def status_line(status: int) -> str:
+    return f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+
+
+async def send_json(
+    writer: asyncio.StreamWriter, status: int, data: Any, keep_alive: bool = True
+) -> None:
+    body = json.dumps(data).encode()
+    writer.write(
+        (
+            status_line(status)
+            + "Content-Type: application/json\r\n"
+            + f"Content-Length: {len(body)}\r\n"
+            + f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        ).encode()
+        + body
+    )
+    await writer.drain()
+
+
+async def send_error(
+    writer: asyncio.StreamWriter, error: HTTPError, keep_alive: bool = True
+) -> None:
+    await send_json(writer, error.status, error.body(), keep_alive)
+
+
+class ChunkedResponse:
+    "A streamed response body, sent with chunked transfer encoding"
+
+    def __init__(self, writer: asyncio.StreamWriter, content_type: str):
+        self.writer = writer
+        self.content_type = content_type
+        self.started = False
+
+    def start(self, status: int = 200) -> None:
+        self.writer.write(
+            (
+                status_line(status)
+                + f"Content-Type: {self.content_type}\r\n"
+                + "Cache-Control: no-cache\r\n"
+                + "Transfer-Encoding: chunked\r\n\r\n"
+            ).encode()
+        )
+        self.started = True
+
+    def write(self, data: bytes) -> None:
+        if self.writer.transport.is_closing():
+            raise ConnectionResetError("Client disconnected")
+        if not self.started:
+            self.start()
+        self.writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    async def finish(self) -> None:
+        if not self.started:
+            self.start()
+        self.writer.write(b"0\r\n\r\n")
+        await self.writer.drain()
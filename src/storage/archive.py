@@ -0,0 +1,438 @@
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import json
+import sqlite3
+import threading
+import zlib
+from storage.backend import SessionStorage, StoredSession
+
+try:
+    import zstandard
+except ImportError:  # zlib with a preset dictionary is used instead
+    zstandard = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dictionaries (
+    id INTEGER PRIMARY KEY,
+    codec TEXT NOT NULL,
+    data BLOB NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    codec TEXT NOT NULL,
+    dictionary INTEGER REFERENCES dictionaries (id),
+    data BLOB NOT NULL,
+    -- Bytes of the uncompressed records, and what the session took in the
+    -- live storage before it was archived
+    raw_size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL,
+    archived_at TEXT NOT NULL
+);
+"""
+
+# Record fragments every session contains, at the end of zlib dictionaries
+ZLIB_SKELETON = (
+    b'{"role":"system","content":"'
+    b'","timestamp":"","tokens":}\n'
+    b'{"role":"user","content":"'
+    b'{"role":"assistant","content":"'
+)
+
+
+def serialize(metadata: Dict[str, Any], messages: List[Dict[str, Any]]) -> bytes:
+    "The metadata and then each message, one compact JSON record per line"
+    records = [metadata, *messages]
+    return "\n".join(
+        json.dumps(record, separators=(",", ":")) for record in records
+    ).encode()
+
+
+def deserialize(data: bytes) -> StoredSession:
+    metadata, *messages = [json.loads(line) for line in data.splitlines()]
+    return metadata, messages
+
+
+@dataclass
+class ArchiveStats:
+    """Archived sessions and the space they take up.
+
+    stored_bytes is what the sessions took up in the live storage and
+    compressed_bytes what they take up in the archive, measured on disk
+    where the backends allow it, so dictionaries and SQLite pages count.
+    """
+
+    sessions: int = 0
+    raw_bytes: int = 0
+    stored_bytes: int = 0
+    compressed_bytes: int = 0
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.stored_bytes - self.compressed_bytes
+
+    def add(self, raw_bytes: int, stored_bytes: int, compressed_bytes: int) -> None:
+        self.sessions += 1
+        self.raw_bytes += raw_bytes
+        self.stored_bytes += stored_bytes
+        self.compressed_bytes += compressed_bytes
+
+
+class SessionArchive:
+    """Compressed sessions, packed into a single SQLite file.
+
+    Each session is compressed on its own, so it can be read back without
+    the others, but with a dictionary shared by the whole archive: most of
+    a small session is the system prompt and record keys, which the
+    dictionary already holds. zstd (from the optional zstandard package)
+    with a trained dictionary is used when available, zlib with a preset
+    dictionary otherwise. Each session records its codec and dictionary, so
+    older entries stay readable after either changes.
+    """
+
+    ZLIB_LEVEL = 9
+    ZSTD_LEVEL = 19
+    # zlib only looks 32 KB back, so a larger dictionary would be wasted
+    ZLIB_DICTIONARY_SIZE = 32 * 1024
+    ZSTD_DICTIONARY_SIZE = 112 * 1024
+    # Sessions used to build a dictionary, and the fewest worth building from
+    DICTIONARY_SAMPLES = 1000
+    MIN_DICTIONARY_SAMPLES = 8
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        # Dictionaries by id, once loaded
+        self._dictionaries: Dict[int, Tuple[str, bytes]] = {}
+        self._lock = threading.RLock()
+
+    @property
+    def codec(self) -> str:
+        return "zstd" if zstandard is not None else "zlib"
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self.path.parent.mkdir(exist_ok=True)
+            # Used from the writer thread too
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def ids(self) -> List[str]:
+        # Reading never creates the archive
+        if not self.path.exists():
+            return []
+        with self._lock:
+            return [
+                row[0] for row in self.connection.execute("SELECT id FROM sessions")
+            ]
+
+    def exists(self, session_id: str) -> bool:
+        if not self.path.exists():
+            return False
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        return row is not None
+
+    def load(self, session_id: str) -> Optional[StoredSession]:
+        if not self.path.exists():
+            return None
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT codec, dictionary, data FROM sessions WHERE id = ?",
+                (session_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            codec, dictionary_id, data = row
+            dictionary = self.dictionary(dictionary_id)
+        return deserialize(self.decompress(codec, dictionary, data))
+
+    def delete(self, session_id: str) -> None:
+        if not self.path.exists():
+            return
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def dictionary(self, dictionary_id: Optional[int]) -> Optional[bytes]:
+        if dictionary_id is None:
+            return None
+        with self._lock:
+            if dictionary_id not in self._dictionaries:
+                self._dictionaries[dictionary_id] = self.connection.execute(
+                    "SELECT codec, data FROM dictionaries WHERE id = ?",
+                    (dictionary_id,),
+                ).fetchone()
+        return self._dictionaries[dictionary_id][1]
+
+    def current_dictionary(self) -> Optional[int]:
+        "The newest dictionary for the codec in use, if one has been built"
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT id FROM dictionaries WHERE codec = ? ORDER BY id DESC LIMIT 1",
+                (self.codec,),
+            ).fetchone()
+        return row[0] if row else None
+
+    def build_dictionary(self, samples: List[bytes]) -> Optional[int]:
+        "Build and store a dictionary from serialized sessions, if there are enough"
+        if len(samples) < self.MIN_DICTIONARY_SAMPLES:
+            return None
+        if self.codec == "zstd":
+            # Training wants far more sample data than dictionary
+            size = min(self.ZSTD_DICTIONARY_SIZE, sum(map(len, samples)) // 10)
+            try:
+                data = zstandard.train_dictionary(size, samples).as_bytes()
+            except zstandard.ZstdError:
+                # Too little data to train on
+                return None
+        else:
+            data = self.zlib_dictionary(samples)
+        with self._lock, self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO dictionaries (codec, data, created_at) VALUES (?, ?, ?)",
+                (self.codec, data, datetime.now().isoformat()),
+            )
+        return cursor.lastrowid
+
+    def zlib_dictionary(self, samples: List[bytes]) -> bytes:
+        """Strings found in several sessions, most common last.
+
+        zlib matches against the end of a preset dictionary most cheaply,
+        so the record skeleton goes last of all.
+        """
+        counts: Counter = Counter()
+        for sample in samples:
+            for line in set(sample.splitlines()[1:]):
+                message = json.loads(line)
+                counts[json.dumps(message.get("content", ""))[1:-1].encode()] += 1
+        budget = self.ZLIB_DICTIONARY_SIZE - len(ZLIB_SKELETON)
+        common: List[bytes] = []
+        for content, count in counts.most_common():
+            if count < 2 or budget <= 0:
+                break
+            common.append(content[:budget])
+            budget -= len(common[-1])
+        return b"".join(reversed(common)) + ZLIB_SKELETON
+
+    def compress(self, dictionary: Optional[bytes], data: bytes) -> bytes:
+        if self.codec == "zstd":
+            compressor = zstandard.ZstdCompressor(
+                level=self.ZSTD_LEVEL,
+                dict_data=(
+                    zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+                ),
+            )
+            return compressor.compress(data)
+        if dictionary:
+            compressor = zlib.compressobj(self.ZLIB_LEVEL, zdict=dictionary)
+        else:
+            compressor = zlib.compressobj(self.ZLIB_LEVEL)
+        return compressor.compress(data) + compressor.flush()
+
+    @staticmethod
+    def decompress(codec: str, dictionary: Optional[bytes], data: bytes) -> bytes:
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError(
+                    "This session was archived with zstd: pip install 'ellm[archive]'"
+                )
+            decompressor = zstandard.ZstdDecompressor(
+                dict_data=(
+                    zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+                )
+            )
+            return decompressor.decompress(data)
+        if dictionary:
+            decompressor = zlib.decompressobj(zdict=dictionary)
+        else:
+            decompressor = zlib.decompressobj()
+        return decompressor.decompress(data) + decompressor.flush()
+
+    def add(
+        self,
+        session_id: str,
+        data: bytes,
+        stored_size: int,
+        dictionary_id: Optional[int],
+    ) -> int:
+        "Store a serialized session and return its compressed size"
+        compressed = self.compress(self.dictionary(dictionary_id), data)
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sessions (id, codec, dictionary, data, "
+                "raw_size, stored_size, archived_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    session_id,
+                    self.codec,
+                    dictionary_id,
+                    compressed,
+                    len(data),
+                    stored_size,
+                    datetime.now().isoformat(),
+                ),
+            )
+        return len(compressed)
+
+    def disk_usage(self) -> int:
+        return self.path.stat().st_size if self.path.exists() else 0
+
+    def compact(self) -> None:
+        if not self.path.exists():
+            return
+        with self._lock:
+            self.connection.execute("VACUUM")
+
+    def stats(self) -> ArchiveStats:
+        "Every archived session, against the size of the whole archive file"
+        if not self.path.exists():
+            return ArchiveStats()
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT COUNT(*), SUM(raw_size), SUM(stored_size) FROM sessions"
+            ).fetchone()
+        return ArchiveStats(*(value or 0 for value in row), self.disk_usage())
+
+
+class TieredStorage(SessionStorage):
+    """Live sessions in any backend, idle ones compressed in a SessionArchive.
+
+    Archived sessions are listed and loaded as if they were live. Writing to
+    one moves it back to the live storage first, so the archive only ever
+    holds sessions as they were when archived.
+    """
+
+    def __init__(self, live: SessionStorage, archive: SessionArchive):
+        self.live = live
+        self.archive = archive
+
+    def ids(self) -> List[str]:
+        ids = self.live.ids()
+        live = set(ids)
+        return ids + [id for id in self.archive.ids() if id not in live]
+
+    def exists(self, session_id: str) -> bool:
+        return self.live.exists(session_id) or self.archive.exists(session_id)
+
+    def load(self, session_id: str) -> Optional[StoredSession]:
+        # A session restored by an interrupted write can be in both, and the
+        # live copy is the newer one
+        return self.live.load(session_id) or self.archive.load(session_id)
+
+    def restore(self, session_id: str) -> bool:
+        "Move an archived session back to the live storage"
+        if self.live.exists(session_id):
+            return False
+        stored = self.archive.load(session_id)
+        if stored is None:
+            return False
+        self.live.write(session_id, *stored)
+        self.archive.delete(session_id)
+        return True
+
+    def write(
+        self, session_id: str, metadata: Dict[str, Any], messages: List[Dict[str, Any]]
+    ) -> None:
+        self.live.write(session_id, metadata, messages)
+        self.archive.delete(session_id)
+
+    def save_metadata(self, session_id: str, metadata: Dict[str, Any]) -> None:
+        self.restore(session_id)
+        self.live.save_metadata(session_id, metadata)
+
+    def append(self, session_id: str, messages: List[Dict[str, Any]]) -> None:
+        self.restore(session_id)
+        self.live.append(session_id, messages)
+
+    def delete(self, session_id: str) -> None:
+        self.live.delete(session_id)
+        self.archive.delete(session_id)
+
+    def location(self) -> Path:
+        return self.live.location()
+
+    def modified(self, session_id: str) -> Optional[float]:
+        return self.live.modified(session_id)
+
+    def size(self, session_id: str) -> Optional[int]:
+        return self.live.size(session_id)
+
+    def archive_idle(self, before: float, skip: Iterable[str] = ()) -> ArchiveStats:
+        """Move live sessions last modified before a Unix time into the archive.
+
+        Sessions in skip (e.g. those open in this process) are left alone.
+        The first sessions archived also build the shared dictionary, if the
+        archive has none for its codec yet. A session written to by another
+        process while it was being archived stays live. Both storages are
+        compacted afterwards. compressed_bytes is what the sessions and any
+        new dictionary take up in the archive, stored_bytes what the live
+        storage shrank by.
+        """
+        skipped = set(skip)
+        # Last modified, to notice writes that land while archiving
+        idle: Dict[str, float] = {}
+        for session_id in self.live.ids():
+            modified = self.live.modified(session_id)
+            if session_id not in skipped and modified is not None and modified < before:
+                idle[session_id] = modified
+        serialized: Dict[str, bytes] = {}
+        live_before = self.live.disk_usage()
+
+        def data(session_id: str) -> Optional[bytes]:
+            if session_id in serialized:
+                return serialized.pop(session_id)
+            stored = self.live.load(session_id)
+            return serialize(*stored) if stored else None
+
+        stats = ArchiveStats()
+        dictionary_id = self.archive.current_dictionary()
+        if dictionary_id is None:
+            for session_id in list(idle)[: SessionArchive.DICTIONARY_SAMPLES]:
+                sample = data(session_id)
+                if sample is not None:
+                    serialized[session_id] = sample
+            dictionary_id = self.archive.build_dictionary(list(serialized.values()))
+            if dictionary_id is not None:
+                stats.compressed_bytes += len(self.archive.dictionary(dictionary_id))
+
+        for session_id, modified in idle.items():
+            session_data = data(session_id)
+            if session_data is None:
+                continue
+            stored_size = self.live.size(session_id) or len(session_data)
+            compressed = self.archive.add(
+                session_id, session_data, stored_size, dictionary_id
+            )
+            # Only removed from the live storage once safely archived, and
+            # only if nothing was written to it in the meantime
+            current = self.live.load(session_id)
+            if (
+                current is None
+                or serialize(*current) != session_data
+                or self.live.modified(session_id) != modified
+            ):
+                self.archive.delete(session_id)
+                continue
+            self.live.delete(session_id)
+            stats.add(len(session_data), stored_size, compressed)
+
+        if stats.sessions:
+            self.live.compact()
+            self.archive.compact()
+        live_after = self.live.disk_usage()
+        # Other processes may have grown it meanwhile; then the sessions'
+        # own sizes are the better estimate
+        if (
+            live_before is not None
+            and live_after is not None
+            and live_after < live_before
+        ):
+            stats.stored_bytes = live_before - live_after
+        return stats
@@ -0,0 +1,219 @@
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import json
+from storage.journal import Journal
+
+# Session metadata and its messages, as plain dicts
+StoredSession = Tuple[Dict[str, Any], List[Dict[str, Any]]]
+
+
+class SessionStorage(ABC):
+    """Where sessions and their messages are persisted.
+
+    Sessions don't use this directly but through storage.writer, which
+    creates each session with write() before updating it.
+    """
+
+    @abstractmethod
+    def ids(self) -> List[str]:
+        pass
+
+    @abstractmethod
+    def exists(self, session_id: str) -> bool:
+        pass
+
+    @abstractmethod
+    def load(self, session_id: str) -> Optional[StoredSession]:
+        "Return the session's metadata and messages, or None if it isn't stored"
+        pass
+
+    @abstractmethod
+    def write(
+        self, session_id: str, metadata: Dict[str, Any], messages: List[Dict[str, Any]]
+    ) -> None:
+        "Replace everything stored for the session"
+        pass
+
+    @abstractmethod
+    def save_metadata(self, session_id: str, metadata: Dict[str, Any]) -> None:
+        "Replace the metadata of a stored session"
+        pass
+
+    @abstractmethod
+    def append(self, session_id: str, messages: List[Dict[str, Any]]) -> None:
+        "Add messages to the end of a stored session"
+        pass
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        pass
+
+    @abstractmethod
+    def location(self) -> Path:
+        "Where the sessions are stored, for display"
+        pass
+
+    def modified(self, session_id: str) -> Optional[float]:
+        "Unix time the session was last written, if the backend knows it"
+        return None
+
+    def size(self, session_id: str) -> Optional[int]:
+        "Bytes the session takes up, if the backend can tell"
+        return None
+
+    def disk_usage(self) -> Optional[int]:
+        "Bytes all sessions take up on disk, if the backend can tell"
+        return None
+
+    def compact(self) -> None:
+        "Give the space of deleted sessions back to the file system"
+        pass
+
+
+class JournalStorage(SessionStorage):
+    """One append-only journal file per session, see storage.journal.
+
+    Sessions saved before journals were introduced ({id}.json) are still
+    read, and are converted on their next write.
+    """
+
+    # Compact a journal once this many metadata updates have been appended
+    COMPACT_AFTER = 32
+
+    def __init__(self, history_path: Path):
+        self.history_path = history_path
+        # Journals keep a count of appended metadata records
+        self._journals: Dict[str, Journal] = {}
+
+    def journal(self, session_id: str) -> Journal:
+        if session_id not in self._journals:
+            self._journals[session_id] = Journal(
+                self.history_path / f"{session_id}.jsonl"
+            )
+        return self._journals[session_id]
+
+    def legacy_file(self, session_id: str) -> Path:
+        return self.history_path / f"{session_id}.json"
+
+    def ids(self) -> List[str]:
+        if not self.history_path.exists():
+            return []
+        # A session converted mid-way can briefly have both files
+        return list(
+            {
+                convo.stem
+                for convo in self.history_path.iterdir()
+                if convo.suffix in (".jsonl", ".json")
+            }
+        )
+
+    def exists(self, session_id: str) -> bool:
+        return (
+            self.journal(session_id).exists() or self.legacy_file(session_id).exists()
+        )
+
+    def load(self, session_id: str) -> Optional[StoredSession]:
+        journal = self.journal(session_id)
+        if journal.exists():
+            return journal.replay()
+        legacy_file = self.legacy_file(session_id)
+        if legacy_file.exists():
+            with open(legacy_file) as f:
+                data = json.load(f)
+            return data, data.pop("history", [])
+        return None
+
+    def write(
+        self, session_id: str, metadata: Dict[str, Any], messages: List[Dict[str, Any]]
+    ) -> None:
+        self.history_path.mkdir(parents=True, exist_ok=True)
+        self.journal(session_id).write_snapshot(metadata, messages)
+        legacy_file = self.legacy_file(session_id)
+        if legacy_file.exists():
+            legacy_file.unlink()
+
+    def save_metadata(self, session_id: str, metadata: Dict[str, Any]) -> None:
+        # Appends a metadata record, or rewrites the journal once enough
+        # records have piled up
+        journal = self.journal(session_id)
+        if journal.meta_records < self.COMPACT_AFTER and journal.exists():
+            journal.append("meta", metadata)
+            return
+        stored = self.load(session_id)
+        self.write(session_id, metadata, stored[1] if stored else [])
+
+    def append(self, session_id: str, messages: List[Dict[str, Any]]) -> None:
+        self.journal(session_id).append_many("message", messages)
+
+    def delete(self, session_id: str) -> None:
+        for path in (self.journal(session_id).path, self.legacy_file(session_id)):
+            if path.exists():
+                path.unlink()
+        self._journals.pop(session_id, None)
+
+    def location(self) -> Path:
+        return self.history_path
+
+    def files(self, session_id: str) -> List[Path]:
+        return [
+            path
+            for path in (self.journal(session_id).path, self.legacy_file(session_id))
+            if path.exists()
+        ]
+
+    def modified(self, session_id: str) -> Optional[float]:
+        times = [path.stat().st_mtime for path in self.files(session_id)]
+        return max(times) if times else None
+
+    def size(self, session_id: str) -> Optional[int]:
+        return sum(path.stat().st_size for path in self.files(session_id))
+
+    def disk_usage(self) -> Optional[int]:
+        if not self.history_path.exists():
+            return 0
+        return sum(path.stat().st_size for path in self.history_path.iterdir())
+
+
+def copy_sessions(source: SessionStorage, target: SessionStorage) -> Tuple[int, int]:
+    """Copy every session from one storage to another, one session at a time.
+
+    Returns the number of sessions and messages copied.
+    """
+    sessions = messages = 0
+    for session_id in source.ids():
+        stored = source.load(session_id)
+        if stored is None:
+            continue
+        metadata, session_messages = stored
+        target.write(session_id, metadata, session_messages)
+        sessions += 1
+        messages += len(session_messages)
+    return sessions, messages
+
+
+STORAGES = ["journal", "sqlite"]
+
+
+def open_storage(name: str, archive: bool = True) -> SessionStorage:
+    """Create the storage backend selected by the storage option.
+
+    Unless archive is False, archived sessions are served along with it,
+    see storage.archive.
+    """
+    from utils.constants import ARCHIVE_PATH, HISTORY_PATH, DATABASE_PATH
+
+    storage: SessionStorage
+    if name == "journal":
+        storage = JournalStorage(HISTORY_PATH)
+    elif name == "sqlite":
+        from storage.sqlite import SQLiteStorage
+
+        storage = SQLiteStorage(DATABASE_PATH)
+    else:
+        raise ValueError(f"Unknown storage: {name}. Choose from: {', '.join(STORAGES)}")
+    if not archive:
+        return storage
+    from storage.archive import SessionArchive, TieredStorage
+
+    return TieredStorage(storage, SessionArchive(ARCHIVE_PATH))
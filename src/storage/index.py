@@ -0,0 +1,108 @@
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, List, Optional
+import json
+import os
+import threading
+
+
+@dataclass
+class SessionMeta:
+    id: str
+    title: str = "Untitled"
+    created_at: str = ""
+    branched_from: str = "master"
+    settings: str = "DEFAULT"
+    messages: int = 0
+    tokens: int = 0
+    # Set for copy-on-write branches, which depend on their parent's history
+    fork_offset: Optional[int] = None
+
+    @classmethod
+    def from_session(cls, session) -> "SessionMeta":
+        return cls(
+            id=session.id,
+            title=session.title,
+            created_at=session.created_at,
+            branched_from=session.branched_from,
+            settings=session.settings,
+            messages=session.message_count(),
+            tokens=session.get_token_count(),
+            fork_offset=session.fork_offset,
+        )
+
+
+class SessionIndex:
+    """Metadata for every stored session, kept in an append-only JSONL log.
+
+    Each update appends one record and the latest record for an id wins, so
+    listing sessions never has to open the conversation files themselves.
+    Updates may come from background jobs as well as the REPL thread.
+    """
+
+    # Rewrite the log once it holds this many more records than live entries
+    COMPACT_SLACK = 256
+
+    def __init__(self, index_path: Path):
+        self.index_path = index_path
+        self.entries: Dict[str, SessionMeta] = {}
+        self._records = 0
+        self._lock = threading.RLock()
+        self._load()
+
+    def _load(self) -> None:
+        if not self.index_path.exists():
+            return
+
+        with open(self.index_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn write from a crash only affects that one record
+                    continue
+                self._records += 1
+                if record.get("deleted"):
+                    self.entries.pop(record["id"], None)
+                else:
+                    self.entries[record["id"]] = SessionMeta(**record)
+
+    def _append(self, record: Dict) -> None:
+        self.index_path.parent.mkdir(exist_ok=True)
+        with open(self.index_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        self._records += 1
+        if self._records > len(self.entries) + self.COMPACT_SLACK:
+            self.compact()
+
+    def compact(self) -> None:
+        with self._lock:
+            tmp_path = self.index_path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                for meta in self.entries.values():
+                    f.write(json.dumps(asdict(meta)) + "\n")
+            os.replace(tmp_path, self.index_path)
+            self._records = len(self.entries)
+
+    def update(self, session) -> SessionMeta:
+        meta = SessionMeta.from_session(session)
+        with self._lock:
+            if self.entries.get(meta.id) != meta:
+                self.entries[meta.id] = meta
+                self._append(asdict(meta))
+        return meta
+
+    def remove(self, session_id: str) -> None:
+        with self._lock:
+            if session_id in self.entries:
+                del self.entries[session_id]
+                self._append({"id": session_id, "deleted": True})
+
+    def get(self, session_id: str) -> Optional[SessionMeta]:
+        return self.entries.get(session_id)
+
+    def ids(self) -> List[str]:
+        return list(self.entries.keys())
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self.entries
@@ -0,0 +1,81 @@
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+import json
+import os
+
+
+class Journal:
+    """Append-only JSONL storage for a single session.
+
+    The first record is a header holding the session metadata. After that,
+    every message is one "message" record and every metadata change is one
+    "meta" record whose fields override the header. Appends never touch
+    earlier bytes, so a crash mid-write can only lose the record being written.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        # Number of "meta" records appended since the last snapshot
+        self.meta_records = 0
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def replay(self) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        "Return the effective metadata and the message records"
+        metadata: Dict[str, Any] = {}
+        messages: List[Dict[str, Any]] = []
+        self.meta_records = 0
+
+        with open(self.path, "rb") as f:
+            data = f.read()
+
+        # Anything after the last newline is a torn write. Drop it so the
+        # next append starts on a clean line.
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            with open(self.path, "r+b") as f:
+                f.truncate(end)
+
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            record_type = record.pop("type", None)
+            if record_type == "message":
+                messages.append(record)
+            elif record_type == "header":
+                metadata.update(record)
+            elif record_type == "meta":
+                metadata.update(record)
+                self.meta_records += 1
+
+        return metadata, messages
+
+    def append(self, record_type: str, record: Dict[str, Any]) -> None:
+        self.append_many(record_type, [record])
+
+    def append_many(self, record_type: str, records: List[Dict[str, Any]]) -> None:
+        "Append records in a single write"
+        lines = "".join(
+            json.dumps({"type": record_type, **record}) + "\n" for record in records
+        )
+        with open(self.path, "a") as f:
+            f.write(lines)
+        if record_type == "meta":
+            self.meta_records += len(records)
+
+    def write_snapshot(
+        self, metadata: Dict[str, Any], messages: List[Dict[str, Any]]
+    ) -> None:
+        "Rewrite the journal as a header plus messages, atomically"
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps({"type": "header", **metadata}) + "\n")
+            for msg in messages:
+                f.write(json.dumps({"type": "message", **msg}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.meta_records = 0
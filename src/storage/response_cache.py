@@ -0,0 +1,133 @@
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+import hashlib
+import json
+import os
+import threading
+import time
+from providers.streaming import StreamEvent
+
+
+class ResponseCache:
+    """Content-addressed cache of complete responses, one file per entry.
+
+    Entries are keyed by a hash of the prepared request. A file's mtime is
+    its last use, which drives LRU eviction once the cache outgrows its size
+    limit. Entries older than the maximum age are treated as misses.
+    """
+
+    STATS_FILE = "stats.json"
+
+    def __init__(self, cache_path: Path):
+        self.cache_path = cache_path
+        self.stats = {"hits": 0, "misses": 0}
+        # Used from the background job loop too
+        self._lock = threading.RLock()
+        try:
+            with open(self.cache_path / self.STATS_FILE) as f:
+                self.stats.update(json.load(f))
+        except (OSError, json.JSONDecodeError, TypeError, ValueError):
+            # Missing, or left corrupt by a crash: start counting again
+            pass
+
+    @staticmethod
+    def key(api_type: str, base_url: str, prepared_request: Dict[str, Any]) -> str:
+        # The endpoint is part of the key: the same model name can be served
+        # by different providers
+        request = {k: v for k, v in prepared_request.items() if k != "stream"}
+        payload = json.dumps(
+            [api_type, base_url, request], sort_keys=True, default=str
+        ).encode()
+        return hashlib.sha256(payload).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_path / f"{key}.json"
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self.stats[stat] += 1
+            self.cache_path.mkdir(parents=True, exist_ok=True)
+            stats_file = self.cache_path / self.STATS_FILE
+            tmp_path = stats_file.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(self.stats, f)
+            os.replace(tmp_path, stats_file)
+
+    def get(self, key: str, max_age: float) -> Optional[List[str]]:
+        "Return the cached response chunks, or None on a miss"
+        with self._lock:
+            path = self._path(key)
+            try:
+                with open(path) as f:
+                    entry = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self._count("misses")
+                return None
+
+            if time.time() - entry["created"] > max_age:
+                path.unlink(missing_ok=True)
+                self._count("misses")
+                return None
+
+            # Mark as recently used
+            os.utime(path)
+            self._count("hits")
+            return entry["parts"]
+
+    def put(self, key: str, parts: List[str], max_bytes: int, max_age: float) -> None:
+        with self._lock:
+            self.cache_path.mkdir(parents=True, exist_ok=True)
+            path = self._path(key)
+            tmp_path = path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump({"created": time.time(), "parts": parts}, f)
+            os.replace(tmp_path, path)
+            self.evict(max_bytes, max_age)
+
+    def evict(self, max_bytes: int, max_age: float) -> None:
+        "Remove expired entries, then least recently used ones until under max_bytes"
+        with self._lock:
+            if not self.cache_path.exists():
+                return
+
+            now = time.time()
+            entries = []
+            for path in self.cache_path.glob("*.json"):
+                if path.name == self.STATS_FILE:
+                    continue
+                stat = path.stat()
+                # Last use is never earlier than creation, so this entry has expired
+                if now - stat.st_mtime > max_age:
+                    path.unlink(missing_ok=True)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+
+    def size(self) -> int:
+        if not self.cache_path.exists():
+            return 0
+        return sum(
+            path.stat().st_size
+            for path in self.cache_path.glob("*.json")
+            if path.name != self.STATS_FILE
+        )
+
+    def clear(self) -> None:
+        with self._lock:
+            if self.cache_path.exists():
+                for path in self.cache_path.glob("*.json"):
+                    path.unlink(missing_ok=True)
+            self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    async def replay(parts: List[str]) -> AsyncIterator[StreamEvent]:
+        "Stream a cached response as if it came from the provider"
+        for part in parts:
+            yield StreamEvent("text", part)
+        yield StreamEvent("stop")
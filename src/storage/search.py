@@ -0,0 +1,103 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, List, Tuple
+import sqlite3
+import threading
+
+
+@dataclass
+class SearchResult:
+    session_id: str
+    role: str
+    snippet: str
+    rank: float
+
+
+class SearchIndex:
+    """Full-text index of every message, stored in SQLite FTS5.
+
+    Messages are added one at a time as they are persisted, so the index
+    never needs to read the conversations back. Branches only index the
+    messages they added themselves; inherited messages are found through
+    the parent.
+    """
+
+    # Marks the matched terms in snippets, chosen so they never occur in text
+    MATCH_START = "\x02"
+    MATCH_END = "\x03"
+
+    def __init__(self, search_path: Path):
+        self.search_path = search_path
+        self._connection = None
+        # Messages are also indexed from background jobs, on another thread
+        self._lock = threading.RLock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # Opened on first use so startup doesn't pay for it
+        if self._connection is None:
+            self.search_path.parent.mkdir(exist_ok=True)
+            self._connection = sqlite3.connect(
+                self.search_path, check_same_thread=False
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5("
+                "content, session_id UNINDEXED, role UNINDEXED)"
+            )
+        return self._connection
+
+    def add(self, session_id: str, role: str, content: str) -> None:
+        self.add_many(session_id, [(role, content)])
+
+    def add_many(self, session_id: str, messages: Iterable[Tuple[str, str]]) -> None:
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO messages (content, session_id, role) VALUES (?, ?, ?)",
+                [(content, session_id, role) for role, content in messages],
+            )
+
+    def remove(self, session_id: str) -> None:
+        with self._lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM messages WHERE session_id = ?", (session_id,)
+            )
+
+    def rebuild(self, sessions: Iterable[Tuple[str, Iterable[Tuple[str, str]]]]) -> int:
+        """Replace the index with the given (session id, [(role, content)]) pairs.
+
+        Returns the number of messages indexed.
+        """
+        count = 0
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM messages")
+            for session_id, messages in sessions:
+                rows = [(content, session_id, role) for role, content in messages]
+                self.connection.executemany(
+                    "INSERT INTO messages (content, session_id, role) VALUES (?, ?, ?)",
+                    rows,
+                )
+                count += len(rows)
+            self.connection.execute(
+                "INSERT INTO messages(messages) VALUES ('optimize')"
+            )
+        return count
+
+    @staticmethod
+    def to_match(query: str) -> str:
+        "Quote each word so user input is never parsed as FTS5 syntax"
+        return " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+    def search(self, query: str, limit: int = 20) -> List[SearchResult]:
+        "Best matches first, by BM25"
+        match = self.to_match(query)
+        if not match:
+            return []
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT session_id, role, snippet(messages, 0, ?, ?, '…', 16), rank "
+                "FROM messages WHERE messages MATCH ? ORDER BY rank LIMIT ?",
+                (self.MATCH_START, self.MATCH_END, match, limit),
+            )
+            return [SearchResult(*row) for row in rows]
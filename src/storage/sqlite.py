@@ -0,0 +1,228 @@
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import json
+import sqlite3
+from storage.backend import SessionStorage, StoredSession
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    branched_from TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    fork_offset INTEGER,
+    fork_tokens INTEGER NOT NULL DEFAULT 0,
+    usage TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_created_at ON sessions (created_at);
+CREATE INDEX IF NOT EXISTS sessions_settings ON sessions (settings);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    tokens INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id);
+"""
+
+SESSION_COLUMNS = [
+    "title",
+    "branched_from",
+    "settings",
+    "created_at",
+    "fork_offset",
+    "fork_tokens",
+    "usage",
+]
+# Columns added after the first release, created on older databases
+ADDED_COLUMNS = {"usage": "TEXT"}
+MESSAGE_COLUMNS = ["role", "content", "timestamp", "tokens"]
+
+UPSERT_SESSION = (
+    f"INSERT INTO sessions (id, {', '.join(SESSION_COLUMNS)}) "
+    f"VALUES (?, {', '.join('?' for _ in SESSION_COLUMNS)}) "
+    f"ON CONFLICT (id) DO UPDATE SET "
+    + ", ".join(f"{column} = excluded.{column}" for column in SESSION_COLUMNS)
+)
+INSERT_MESSAGE = (
+    f"INSERT INTO messages (session_id, {', '.join(MESSAGE_COLUMNS)}) "
+    f"VALUES (?, {', '.join('?' for _ in MESSAGE_COLUMNS)})"
+)
+
+
+class SQLiteStorage(SessionStorage):
+    """Sessions and messages in a single SQLite database.
+
+    The database runs in WAL mode, so several ellm processes can read and
+    write it at once: every write is a short transaction, and writers wait
+    for each other instead of overwriting.
+    Messages are ordered by their row id, so turns added to the same session
+    from two terminals are interleaved rather than lost.
+    """
+
+    # Milliseconds to wait for another process's write to finish
+    BUSY_TIMEOUT = 5000
+
+    def __init__(self, database_path: Path):
+        self.database_path = database_path
+        self._connection: Optional[sqlite3.Connection] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self.database_path.parent.mkdir(exist_ok=True)
+            # Used from the writer thread too, which serializes every call
+            connection = sqlite3.connect(
+                self.database_path,
+                timeout=self.BUSY_TIMEOUT / 1000,
+                check_same_thread=False,
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            connection.executescript(SCHEMA)
+            columns = {
+                row[1] for row in connection.execute("PRAGMA table_info(sessions)")
+            }
+            for column, column_type in ADDED_COLUMNS.items():
+                if column not in columns:
+                    connection.execute(
+                        f"ALTER TABLE sessions ADD COLUMN {column} {column_type}"
+                    )
+            self._connection = connection
+        return self._connection
+
+    @staticmethod
+    def session_row(session_id: str, metadata: Dict[str, Any]) -> List[Any]:
+        return [
+            session_id,
+            metadata.get("title", "Untitled"),
+            metadata.get("branched_from", "master"),
+            metadata.get("settings", "DEFAULT"),
+            metadata.get("created_at", ""),
+            metadata.get("fork_offset"),
+            metadata.get("fork_tokens", 0),
+            json.dumps(metadata["usage"]) if metadata.get("usage") else None,
+        ]
+
+    @staticmethod
+    def message_row(session_id: str, message: Dict[str, Any]) -> List[Any]:
+        return [session_id] + [message.get(column) for column in MESSAGE_COLUMNS]
+
+    def ids(self) -> List[str]:
+        return [row[0] for row in self.connection.execute("SELECT id FROM sessions")]
+
+    def exists(self, session_id: str) -> bool:
+        row = self.connection.execute(
+            "SELECT 1 FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        return row is not None
+
+    def load(self, session_id: str) -> Optional[StoredSession]:
+        row = self.connection.execute(
+            f"SELECT {', '.join(SESSION_COLUMNS)} FROM sessions WHERE id = ?",
+            (session_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        metadata = {
+            column: value
+            for column, value in zip(SESSION_COLUMNS, row)
+            if value is not None
+        }
+        if "fork_offset" not in metadata:
+            del metadata["fork_tokens"]
+        if "usage" in metadata:
+            metadata["usage"] = json.loads(metadata["usage"])
+
+        messages = [
+            dict(zip(MESSAGE_COLUMNS, message))
+            for message in self.connection.execute(
+                f"SELECT {', '.join(MESSAGE_COLUMNS)} FROM messages "
+                "WHERE session_id = ? ORDER BY id",
+                (session_id,),
+            )
+        ]
+        return metadata, messages
+
+    def write(
+        self, session_id: str, metadata: Dict[str, Any], messages: List[Dict[str, Any]]
+    ) -> None:
+        with self.connection:
+            self.connection.execute(
+                UPSERT_SESSION, self.session_row(session_id, metadata)
+            )
+            self.connection.execute(
+                "DELETE FROM messages WHERE session_id = ?", (session_id,)
+            )
+            self.connection.executemany(
+                INSERT_MESSAGE, (self.message_row(session_id, msg) for msg in messages)
+            )
+
+    def save_metadata(self, session_id: str, metadata: Dict[str, Any]) -> None:
+        with self.connection:
+            self.connection.execute(
+                UPSERT_SESSION, self.session_row(session_id, metadata)
+            )
+
+    def append(self, session_id: str, messages: List[Dict[str, Any]]) -> None:
+        # Messages are ordered by row id, so turns appended from two
+        # processes are interleaved rather than lost
+        with self.connection:
+            self.connection.executemany(
+                INSERT_MESSAGE, (self.message_row(session_id, msg) for msg in messages)
+            )
+
+    def delete(self, session_id: str) -> None:
+        with self.connection:
+            self.connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def location(self) -> Path:
+        return self.database_path
+
+    def modified(self, session_id: str) -> Optional[float]:
+        # The newest message, or the session's creation if it has none
+        row = self.connection.execute(
+            "SELECT COALESCE(MAX(messages.timestamp), sessions.created_at) "
+            "FROM sessions LEFT JOIN messages ON messages.session_id = sessions.id "
+            "WHERE sessions.id = ?",
+            (session_id,),
+        ).fetchone()
+        if not row or not row[0]:
+            return None
+        return datetime.fromisoformat(row[0]).timestamp()
+
+    def size(self, session_id: str) -> Optional[int]:
+        # The bytes of its rows, without SQLite's page and index overhead
+        row = self.connection.execute(
+            "SELECT LENGTH(CAST(title AS BLOB)) + LENGTH(branched_from) "
+            "+ LENGTH(settings) + LENGTH(created_at) + COALESCE(LENGTH(usage), 0) "
+            "+ (SELECT COALESCE(SUM(LENGTH(role) + LENGTH(CAST(content AS BLOB)) "
+            "+ LENGTH(timestamp) + 8), 0) FROM messages WHERE session_id = ?) "
+            "FROM sessions WHERE id = ?",
+            (session_id, session_id),
+        ).fetchone()
+        return row[0] if row else None
+
+    def disk_usage(self) -> Optional[int]:
+        if not self.database_path.exists():
+            return 0
+        # Checkpointed first, so pages still in the WAL are counted once
+        self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        wal = self.database_path.with_name(self.database_path.name + "-wal")
+        return sum(
+            path.stat().st_size for path in (self.database_path, wal) if path.exists()
+        )
+
+    def compact(self) -> None:
+        # Deleted rows only leave free pages behind until the file is rebuilt
+        try:
+            self.connection.execute("VACUUM")
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.OperationalError:
+            # Another process is using the database, try again next time
+            pass
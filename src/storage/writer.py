@@ -0,0 +1,217 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Set
+import atexit
+import threading
+import time
+from storage.archive import ArchiveStats
+from storage.backend import SessionStorage, StoredSession
+
+if TYPE_CHECKING:
+    from models.message import Message
+    from models.session import Session
+
+
+@dataclass
+class PendingWrite:
+    "Changes to one session that haven't been written yet"
+
+    metadata: Optional[Dict[str, Any]] = None
+    messages: List[Dict[str, Any]] = field(default_factory=list)
+    # Replace everything stored for the session instead of appending
+    snapshot: bool = False
+
+    def merge(self, newer: "PendingWrite") -> "PendingWrite":
+        if newer.snapshot:
+            return newer
+        return PendingWrite(
+            newer.metadata if newer.metadata is not None else self.metadata,
+            self.messages + newer.messages,
+            self.snapshot,
+        )
+
+
+class SessionWriter:
+    """Persists sessions from a background thread.
+
+    Sessions hand over copies of what changed, so the REPL never waits on
+    disk and the thread never reads a session while it is being modified.
+    Changes to the same session are coalesced until the thread gets to it:
+    any number of metadata updates become one write, and new messages are
+    appended in one batch. Reads go through the writer too and see pending
+    changes, and close() (run at exit) writes whatever is left.
+    """
+
+    # Seconds to let a burst of changes (a turn's messages and usage) pile up
+    COALESCE_DELAY = 0.05
+    # Seconds before trying again after a failed write
+    RETRY_DELAY = 1.0
+
+    def __init__(self, storage: SessionStorage):
+        self.storage = storage
+        self._pending: Dict[str, PendingWrite] = {}
+        # Sessions known to be stored, or with a snapshot pending
+        self._stored: Set[str] = set()
+        # Sessions created in this process and not saved yet
+        self._new: Set[str] = set()
+        self._changed = threading.Condition()
+        # Held while the storage is used, so reads never see a half-done write
+        self._io_lock = threading.RLock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        # The last write that failed, for the CLI to report
+        self.error: Optional[Exception] = None
+
+    def _start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="ellm-writer", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _run(self) -> None:
+        while True:
+            with self._changed:
+                while not self._pending and not self._closed:
+                    self._changed.wait()
+                if not self._pending:
+                    return
+            time.sleep(self.COALESCE_DELAY)
+            try:
+                self._write_pending()
+            except Exception as e:
+                self.error = e
+                time.sleep(self.RETRY_DELAY)
+
+    def _write_pending(self, session_id: Optional[str] = None) -> None:
+        "Write the pending changes of one session, or of all of them"
+        with self._io_lock:
+            while True:
+                with self._changed:
+                    if session_id is None:
+                        if not self._pending:
+                            return
+                        current = next(iter(self._pending))
+                    else:
+                        current = session_id
+                    pending = self._pending.pop(current, None)
+                if pending is None:
+                    return
+                try:
+                    self._write(current, pending)
+                except Exception:
+                    # Keep the changes, along with any that came in meanwhile
+                    with self._changed:
+                        newer = self._pending.get(current)
+                        self._pending[current] = (
+                            pending.merge(newer) if newer else pending
+                        )
+                    raise
+                if session_id is not None:
+                    return
+
+    def _write(self, session_id: str, pending: PendingWrite) -> None:
+        if pending.snapshot:
+            self.storage.write(session_id, pending.metadata or {}, pending.messages)
+            return
+        if pending.messages:
+            self.storage.append(session_id, pending.messages)
+        if pending.metadata is not None:
+            self.storage.save_metadata(session_id, pending.metadata)
+
+    def _queue(self, session_id: str, change: PendingWrite) -> None:
+        with self._changed:
+            pending = self._pending.get(session_id)
+            self._pending[session_id] = pending.merge(change) if pending else change
+            if change.snapshot:
+                self._stored.add(session_id)
+                self._new.discard(session_id)
+            self._changed.notify()
+        self._start()
+
+    def _known(self, session_id: str) -> bool:
+        if session_id in self._new:
+            return False
+        if session_id not in self._stored:
+            with self._io_lock:
+                if self.storage.exists(session_id):
+                    self._stored.add(session_id)
+        return session_id in self._stored
+
+    def created(self, session_id: str) -> None:
+        "Note a new session, so its first save doesn't look it up in the storage"
+        self._new.add(session_id)
+
+    def snapshot(self, session: "Session") -> None:
+        "Rewrite the stored session from memory"
+        self._queue(
+            session.id,
+            PendingWrite(
+                session.metadata(),
+                [msg.to_dict() for msg in session.messages],
+                snapshot=True,
+            ),
+        )
+
+    def save_metadata(self, session: "Session") -> None:
+        "Persist the session metadata, and the messages if it was never stored"
+        if self._known(session.id):
+            self._queue(session.id, PendingWrite(session.metadata()))
+        else:
+            self.snapshot(session)
+
+    def append(self, session: "Session", message: "Message") -> None:
+        "Persist a message that was just added to the session"
+        if self._known(session.id):
+            self._queue(session.id, PendingWrite(messages=[message.to_dict()]))
+        else:
+            # The message is already in session.messages
+            self.snapshot(session)
+
+    def flush(self, session_id: Optional[str] = None) -> None:
+        "Write pending changes now, for one session or all of them"
+        self._write_pending(session_id)
+
+    def close(self) -> None:
+        "Write everything that is pending and stop the thread"
+        with self._changed:
+            self._closed = True
+            self._changed.notify()
+        self.flush()
+
+    def ids(self) -> List[str]:
+        with self._io_lock:
+            ids = self.storage.ids()
+        stored = set(ids)
+        with self._changed:
+            return ids + [id for id in self._pending if id not in stored]
+
+    def exists(self, session_id: str) -> bool:
+        return session_id in self._pending or self._known(session_id)
+
+    def load(self, session_id: str) -> Optional[StoredSession]:
+        with self._io_lock:
+            self.flush(session_id)
+            stored = self.storage.load(session_id)
+        if stored is not None:
+            self._stored.add(session_id)
+        return stored
+
+    def delete(self, session_id: str) -> None:
+        with self._io_lock:
+            with self._changed:
+                self._pending.pop(session_id, None)
+            self.storage.delete(session_id)
+            self._stored.discard(session_id)
+
+    def location(self) -> Path:
+        return self.storage.location()
+
+    def archive_idle(self, before: float, skip: Iterable[str] = ()) -> ArchiveStats:
+        "Archive idle sessions, leaving alone those in skip or still being written"
+        with self._io_lock:
+            self.flush()
+            with self._changed:
+                skipped = set(skip) | set(self._pending)
+            return self.storage.archive_idle(before, skipped)
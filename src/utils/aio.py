@@ -0,0 +1,65 @@
+from typing import Any, Coroutine, Dict, Optional
+import asyncio
+import concurrent.futures
+import threading
+
+
+class BackgroundLoop:
+    """A single asyncio event loop running in a daemon thread.
+
+    Async SDK clients keep their connection pools bound to the loop that
+    first used them, so every coroutine in the process runs on this one loop
+    while the REPL keeps the main thread.
+    """
+
+    _loop: Optional[asyncio.AbstractEventLoop] = None
+    _thread: Optional[threading.Thread] = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_loop(cls) -> asyncio.AbstractEventLoop:
+        with cls._lock:
+            if cls._loop is None:
+                cls._loop = asyncio.new_event_loop()
+                cls._thread = threading.Thread(
+                    target=cls._loop.run_forever, name="ellm-loop", daemon=True
+                )
+                cls._thread.start()
+        return cls._loop
+
+    @classmethod
+    def submit(cls, coro: Coroutine) -> concurrent.futures.Future:
+        "Schedule a coroutine without waiting for it"
+        return asyncio.run_coroutine_threadsafe(coro, cls.get_loop())
+
+    @classmethod
+    def run(cls, coro: Coroutine) -> Any:
+        """Run a coroutine on the loop and wait for its result.
+
+        Ctrl-C cancels the coroutine instead of abandoning it. Its result
+        (or exception) is still returned once it has finished unwinding, so
+        coroutines that handle cancellation can hand back partial work.
+        """
+        loop = cls.get_loop()
+        outcome: concurrent.futures.Future = concurrent.futures.Future()
+        tasks: Dict[str, asyncio.Task] = {}
+
+        def copy_outcome(task: asyncio.Task) -> None:
+            if task.cancelled():
+                outcome.set_exception(asyncio.CancelledError())
+            elif task.exception() is not None:
+                outcome.set_exception(task.exception())
+            else:
+                outcome.set_result(task.result())
+
+        def start() -> None:
+            tasks["task"] = loop.create_task(coro)
+            tasks["task"].add_done_callback(copy_outcome)
+
+        loop.call_soon_threadsafe(start)
+        try:
+            return outcome.result()
+        except KeyboardInterrupt:
+            # Scheduled after start(), so the task is guaranteed to exist
+            loop.call_soon_threadsafe(lambda: tasks["task"].cancel())
+            return outcome.result()
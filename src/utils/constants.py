@@ -2,3 +2,10 @@ from pathlib import Path
 
 HISTORY_PATH = Path.home() / ".ellm" / "conversations"
 CONFIG_PATH = Path.home() / ".ellm" / "config.ini"
+INDEX_PATH = Path.home() / ".ellm" / "index.jsonl"
+CACHE_PATH = Path.home() / ".ellm" / "cache"
+METRICS_PATH = Path.home() / ".ellm" / "metrics.jsonl"
+SEARCH_PATH = Path.home() / ".ellm" / "search.db"
+DATABASE_PATH = Path.home() / ".ellm" / "sessions.db"
+RATE_LIMIT_PATH = Path.home() / ".ellm" / "ratelimit.json"
+ARCHIVE_PATH = Path.home() / ".ellm" / "archive.db"
@@ -0,0 +1,91 @@
+from importlib.abc import MetaPathFinder
+from typing import Any, Dict, List, Optional, TextIO
+import sys
+import time
+
+
+class _TimedLoader:
+    "Wraps a module loader to time its exec_module call"
+
+    def __init__(self, loader: Any, name: str, profiler: "ImportProfiler"):
+        self._loader = loader
+        self._name = name
+        self._profiler = profiler
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._profiler._start(self._name)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profiler._stop(self._name)
+
+
+class ImportProfiler(MetaPathFinder):
+    """Records how long each newly imported module takes to load.
+
+    Cumulative time includes the module's own imports, self time excludes
+    them (the same split as `python -X importtime`).
+    """
+
+    def __init__(self):
+        self.cumulative: Dict[str, float] = {}
+        self.self_time: Dict[str, float] = {}
+        # (module name, start time, time spent in nested imports)
+        self._stack: List[List[Any]] = []
+        # Time spent importing, excluding the code between imports
+        self.import_total = 0.0
+        self._started = 0.0
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, fullname, self)
+                return spec
+        return None
+
+    def _start(self, name: str) -> None:
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def _stop(self, name: str) -> None:
+        name, start, nested = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        self.cumulative[name] = elapsed
+        self.self_time[name] = elapsed - nested
+        if self._stack:
+            self._stack[-1][2] += elapsed
+        else:
+            self.import_total += elapsed
+
+    def start(self) -> None:
+        self._started = time.perf_counter()
+        sys.meta_path.insert(0, self)
+
+    def stop(self) -> None:
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def report(self, limit: int = 25, file: Optional[TextIO] = None) -> None:
+        file = file or sys.stderr
+        total = time.perf_counter() - self._started
+        print(f"Imported {len(self.cumulative)} modules", file=file)
+        print(f"{'cumulative ms':>14} {'self ms':>10}  module", file=file)
+        ranked = sorted(self.cumulative.items(), key=lambda item: -item[1])
+        for name, elapsed in ranked[:limit]:
+            print(
+                f"{elapsed * 1000:>14.1f} {self.self_time[name] * 1000:>10.1f}  {name}",
+                file=file,
+            )
+        print(
+            f"Importing took {self.import_total * 1000:.1f} ms of {total * 1000:.1f} ms",
+            file=file,
+        )
@@ -0,0 +1,157 @@
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import json
+import math
+import os
+import threading
+import time
+
+
+@dataclass
+class RequestMetrics:
+    settings: str
+    model: str
+    timestamp: float = field(default_factory=time.time)
+    # Seconds from sending the request to the first text delta
+    ttft: Optional[float] = None
+    # Seconds from sending the request to the end of the stream
+    latency: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # "provider" when the token counts come from the provider's usage fields
+    usage_source: str = "local"
+    # Prompt tokens written to and read from the provider's prompt cache
+    cache_creation_tokens: int = 0
+    cache_read_tokens: int = 0
+    cached: bool = False
+    cancelled: bool = False
+    error: bool = False
+    retries: int = 0
+    # Local time spent per stage of the turn, in seconds
+    stages: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        "Output rate once the first token has arrived"
+        if self.ttft is None or self.latency <= self.ttft:
+            return None
+        return self.completion_tokens / (self.latency - self.ttft)
+
+    @property
+    def overhead(self) -> float:
+        "Local time outside of the stream itself"
+        return sum(t for stage, t in self.stages.items() if stage != "stream")
+
+
+class StageTimer:
+    "Accumulates elapsed time per named stage"
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self._stage: Optional[str] = None
+        self._started = 0.0
+
+    def start(self, stage: str) -> None:
+        self.stop()
+        self._stage = stage
+        self._started = time.perf_counter()
+
+    def stop(self) -> None:
+        if self._stage is not None:
+            elapsed = time.perf_counter() - self._started
+            self.stages[self._stage] = self.stages.get(self._stage, 0.0) + elapsed
+            self._stage = None
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    "Nearest-rank percentile"
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+class MetricsLog:
+    """Rolling JSONL log of request metrics.
+
+    Once the file grows past MAX_BYTES, the older half of the records is
+    dropped.
+    """
+
+    MAX_BYTES = 4 * 1024 * 1024
+
+    def __init__(self, metrics_path: Path):
+        self.metrics_path = metrics_path
+        # Recorded from background jobs and gateway threads too
+        self._lock = threading.RLock()
+
+    def record(self, metrics: RequestMetrics) -> None:
+        with self._lock:
+            self.metrics_path.parent.mkdir(exist_ok=True)
+            with open(self.metrics_path, "a") as f:
+                f.write(json.dumps(asdict(metrics)) + "\n")
+                size = f.tell()
+            if size > self.MAX_BYTES:
+                self.roll()
+
+    def roll(self) -> None:
+        with self._lock:
+            with open(self.metrics_path) as f:
+                lines = f.readlines()
+            tmp_path = self.metrics_path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                f.writelines(lines[len(lines) // 2 :])
+            os.replace(tmp_path, self.metrics_path)
+
+    def load(self) -> List[RequestMetrics]:
+        if not self.metrics_path.exists():
+            return []
+        records = []
+        with open(self.metrics_path) as f:
+            for line in f:
+                try:
+                    records.append(RequestMetrics(**json.loads(line)))
+                except (json.JSONDecodeError, TypeError):
+                    continue
+        return records
+
+    def summarize(self) -> Dict[Tuple[str, str], Dict[str, Optional[float]]]:
+        """p50/p95 per (settings, model) over completed provider requests.
+
+        Cached, cancelled and failed requests are counted but don't affect
+        the percentiles.
+        """
+        groups: Dict[Tuple[str, str], List[RequestMetrics]] = {}
+        for metrics in self.load():
+            groups.setdefault((metrics.settings, metrics.model), []).append(metrics)
+
+        summary = {}
+        for key, records in groups.items():
+            complete = [m for m in records if not (m.cached or m.cancelled or m.error)]
+            ttfts = [m.ttft for m in complete if m.ttft is not None]
+            latencies = [m.latency for m in complete]
+            rates = [
+                m.tokens_per_second for m in complete if m.tokens_per_second is not None
+            ]
+            overheads = [m.overhead for m in complete]
+            summary[key] = {
+                "requests": len(records),
+                "ttft_p50": percentile(ttfts, 50),
+                "ttft_p95": percentile(ttfts, 95),
+                "latency_p50": percentile(latencies, 50),
+                "latency_p95": percentile(latencies, 95),
+                "tokens_per_second_p50": percentile(rates, 50),
+                "tokens_per_second_p95": percentile(rates, 95),
+                "overhead_p50": percentile(overheads, 50),
+                "overhead_p95": percentile(overheads, 95),
+            }
+        return summary
+
+    def export(self, path: Path) -> int:
+        "Write every record as a JSON array, returning the number written"
+        records = self.load()
+        with open(path, "w") as f:
+            json.dump([asdict(m) for m in records], f, indent=2)
+        return len(records)
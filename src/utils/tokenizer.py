@@ -0,0 +1,80 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import threading
+
+
+class Tokenizer:
+    """Process-wide token counting.
+
+    Encoders are created once per model and counts are cached by content
+    hash, so repeated content (like the system prompt) is only encoded once.
+    """
+
+    DEFAULT_ENCODING = "cl100k_base"
+    MAX_CACHED_COUNTS = 8192
+
+    _encoders: Dict[str, Any] = {}
+    _counts: "OrderedDict[Tuple[str, bytes], int]" = OrderedDict()
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_encoder(cls, model: str = "") -> Any:
+        if model not in cls._encoders:
+            # Deferred: loading tiktoken is slow and most commands never count
+            import tiktoken
+
+            try:
+                name = tiktoken.encoding_name_for_model(model)
+            except KeyError:
+                # Unknown to tiktoken (Anthropic, Ollama, ...): use the default
+                name = cls.DEFAULT_ENCODING
+            cls._encoders[model] = tiktoken.get_encoding(name)
+        return cls._encoders[model]
+
+    @classmethod
+    def _key(cls, text: str, model: str) -> Tuple[str, bytes]:
+        encoder = cls.get_encoder(model)
+        digest = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        return encoder.name, digest
+
+    @classmethod
+    def _cache(cls, key: Tuple[str, bytes], count: int) -> None:
+        with cls._lock:
+            cls._counts[key] = count
+            if len(cls._counts) > cls.MAX_CACHED_COUNTS:
+                cls._counts.popitem(last=False)
+
+    @classmethod
+    def _cached(cls, key: Tuple[str, bytes]) -> Optional[int]:
+        with cls._lock:
+            count = cls._counts.get(key)
+            if count is not None:
+                cls._counts.move_to_end(key)
+            return count
+
+    @classmethod
+    def count(cls, text: str, model: str = "") -> int:
+        key = cls._key(text, model)
+        count = cls._cached(key)
+        if count is None:
+            count = len(cls.get_encoder(model).encode_ordinary(text))
+            cls._cache(key, count)
+        return count
+
+    @classmethod
+    def count_batch(cls, texts: List[str], model: str = "") -> List[int]:
+        "Count many texts at once, encoding uncached ones in a single batch"
+        keys = [cls._key(text, model) for text in texts]
+        counts = [cls._cached(key) for key in keys]
+
+        missing = [i for i, count in enumerate(counts) if count is None]
+        if missing:
+            encoded = cls.get_encoder(model).encode_ordinary_batch(
+                [texts[i] for i in missing]
+            )
+            for i, tokens in zip(missing, encoded):
+                counts[i] = len(tokens)
+                cls._cache(keys[i], len(tokens))
+
+        return counts